@@ -1,22 +1,37 @@
 import os
-from flask import Flask
+from flask import Flask, request, flash, redirect, url_for
 from werkzeug.security import generate_password_hash
-from extensions import db, login_manager, csrf
+from config import Config, engine_options, instance_secret_key
+from extensions import db, login_manager, csrf, apply_sqlite_pragmas
 from routes import register_blueprints
+from commands import register_commands
+import migrations
+import events
+import jobs
+from utils import PRODUCT_IMAGE_DIR, IMAGE_MAX_AGE
 from models import User, Distributor, Product
+from controllers.period_controller import PeriodClosedError
 
-def create_app():
+def create_app(overrides=None):
+    """Build the app. `overrides` is a dict of config values applied on top of Config."""
     app = Flask(__name__)
-    
+
     # Configuration
-    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', os.urandom(24).hex())
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///pos.db'
-    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config.from_object(Config)
+    app.config.update(overrides or {})
+    if not app.config['SECRET_KEY']:
+        app.config['SECRET_KEY'] = instance_secret_key(app.instance_path)
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config))
 
     # Initialize Extensions
     db.init_app(app)
     login_manager.init_app(app)
     csrf.init_app(app)
+    events.init_app(app)
+    jobs.init_app(app)
+
+    with app.app_context():
+        apply_sqlite_pragmas(db.engine, app.config['SQLITE_PRAGMAS'])
 
     @login_manager.user_loader
     def load_user(user_id):
@@ -24,34 +39,55 @@ def create_app():
 
     # Register Blueprints
     register_blueprints(app)
+    register_commands(app)
 
-    return app
+    @app.errorhandler(PeriodClosedError)
+    def closed_period_write(error):
+        # Raised from a flush when a write is dated in a closed month
+        db.session.rollback()
+        flash(str(error), 'danger')
+        return redirect(request.referrer or url_for('main.dashboard'))
 
-app = create_app()
+    @app.after_request
+    def cache_product_images(response):
+        # Image file names carry a content hash, so browsers can keep them for good
+        filename = (request.view_args or {}).get('filename', '')
+        if request.endpoint == 'static' and filename.startswith(f'{PRODUCT_IMAGE_DIR}/'):
+            response.cache_control.no_cache = None
+            response.cache_control.public = True
+            response.cache_control.max_age = IMAGE_MAX_AGE
+            response.cache_control.immutable = True
+        return response
 
-def initialize_database():
+    return app
+
+def initialize_database(app):
     with app.app_context():
         db.create_all()
-        
+        migrations.upgrade()
+
         # Create users if they don't exist
         if not User.query.filter_by(username='admin').first():
             admin = User(
-                username='admin', 
-                password_hash=generate_password_hash('admin123'), 
+                username='admin',
+                password_hash=generate_password_hash('admin123'),
                 role='admin',
                 full_name='Administrator',
                 phone='03001234567'
             )
             staff = User(
-                username='staff',  
-                password_hash=generate_password_hash('staff123'), 
+                username='staff',
+                password_hash=generate_password_hash('staff123'),
                 role='staff',
                 full_name='Staff User',
                 phone='03007654321'
             )
-            db.session.add_all([admin, staff])        
+            db.session.add_all([admin, staff])
         db.session.commit()
 
 if __name__ == '__main__':
-    initialize_database()
-    app.run(host="0.0.0.0", port=8080, debug=True)
\ No newline at end of file
+    # Development server only; see wsgi.py for production
+    app = create_app()
+    initialize_database(app)
+    jobs.start_workers(app)
+    app.run(host="0.0.0.0", port=int(os.environ.get('PORT', 8080)), debug=True)
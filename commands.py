@@ -0,0 +1,131 @@
+import os
+import signal
+import threading
+import click
+from flask import current_app
+from datetime import datetime
+from extensions import db
+from models import PKT
+from controllers.balance_controller import BalanceController
+from controllers.rollup_controller import RollupController
+from controllers.running_balance_controller import RunningBalanceController, LEDGERS
+from controllers.report_job_controller import ReportJobController
+from controllers.reports_controller import ReportsController
+from controllers.statement_controller import StatementController, STATEMENT_FORMATS
+import migrations
+import jobs
+
+
+def register_commands(app):
+    @app.cli.command('upgrade-db')
+    def upgrade_db():
+        """Create missing tables and apply pending schema migrations."""
+        db.create_all()
+        applied = migrations.upgrade(progress=lambda v, name: click.echo(f"Applied v{v:04d} {name}"))
+        if not applied:
+            click.echo('Schema is up to date.')
+
+    @app.cli.command('migration-status')
+    def migration_status():
+        """List schema migrations and whether each has been applied."""
+        for version, name, applied in migrations.status():
+            click.echo(f"v{version:04d} {name:<40} {'applied' if applied else 'pending'}")
+
+    @app.cli.command('reconcile-balances')
+    @click.option('--dry-run', is_flag=True, help='Report drift without correcting it.')
+    def reconcile_balances(dry_run):
+        """Recompute customer/distributor balances from their ledgers."""
+        drift = BalanceController.reconcile(fix=not dry_run)
+        if not drift:
+            click.echo('All balances match their ledgers.')
+            return
+
+        for row in drift:
+            click.echo(f"{row['kind']:<12} #{row['id']:<6} {row['name']:<30} "
+                       f"stored={row['stored']:>12,.2f}  ledger={row['ledger']:>12,.2f}")
+        verb = 'Found' if dry_run else 'Corrected'
+        click.echo(f"{verb} {len(drift)} drifted balance(s).")
+
+    @app.cli.command('rebuild-rollups')
+    @click.option('--start', help='First day to rebuild (YYYY-MM-DD). Defaults to the earliest activity.')
+    @click.option('--end', help='Day after the last one to rebuild (YYYY-MM-DD). Defaults to tomorrow.')
+    @click.option('--chunk-days', default=31, show_default=True, help='Days recomputed per transaction.')
+    def rebuild_rollups(start, end, chunk_days):
+        """Backfill the daily sales/profit rollups from raw rows (closed months are left alone)."""
+        start = datetime.strptime(start, '%Y-%m-%d').date() if start else None
+        end = datetime.strptime(end, '%Y-%m-%d').date() if end else None
+
+        def progress(chunk_start, chunk_end, days):
+            click.echo(f"{chunk_start} .. {chunk_end}: {days} day(s) with activity")
+
+        written = RollupController.rebuild(start, end, chunk_days=chunk_days, progress=progress)
+        click.echo(f"Rebuilt rollups for {written} day(s).")
+
+    @app.cli.command('close-period')
+    @click.option('--year', type=int, required=True)
+    @click.option('--month', type=click.IntRange(1, 12), required=True)
+    def close_period(year, month):
+        """Freeze a finished month's reports and refuse further writes dated in it."""
+        success, message = ReportsController.close_month(year, month, None)
+        if not success:
+            raise click.ClickException(message)
+        click.echo(message)
+
+    @app.cli.command('statements')
+    @click.option('--year', type=int, help='Defaults to the month that just ended.')
+    @click.option('--month', type=click.IntRange(1, 12))
+    @click.option('--format', 'fmt', type=click.Choice(sorted(STATEMENT_FORMATS)), default='pdf', show_default=True)
+    @click.option('--workers', type=int, help='Worker processes. Defaults to the number of CPUs.')
+    @click.option('--output', help='Directory to write to. Defaults to instance/statements/YYYY-MM.')
+    def statements(year, month, fmt, workers, output):
+        """Write a month's statement for every customer with an outstanding balance."""
+        if (year is None) != (month is None):
+            raise click.ClickException('Pass both --year and --month, or neither.')
+        if year is None:
+            today = datetime.now(PKT)
+            year, month = (today.year, today.month - 1) if today.month > 1 else (today.year - 1, 12)
+        output = output or os.path.join(current_app.instance_path, 'statements', f"{year}-{month:02d}")
+        written = StatementController.render_batch(
+            year, month, output, fmt, workers, progress=lambda customer_id, path: click.echo(path))
+        click.echo(f"Wrote {len(written)} statement(s) to {output}.")
+
+    @app.cli.command('refresh-balance-checkpoints')
+    @click.option('--ledger', type=click.Choice(sorted(LEDGERS)), multiple=True,
+                  help='Ledger to refresh (repeatable). Defaults to all of them.')
+    @click.option('--rebuild', is_flag=True, help='Drop existing checkpoints and recompute from the first row.')
+    def refresh_balance_checkpoints(ledger, rebuild):
+        """Add month-start running-balance checkpoints for closed months."""
+        ledgers = list(ledger) or list(LEDGERS)
+        if rebuild:
+            for name in ledgers:
+                RunningBalanceController.invalidate(name, datetime.min)
+        written = RunningBalanceController.refresh_checkpoints(ledgers)
+        click.echo(f"Wrote {written} checkpoint(s).")
+
+    @app.cli.command('report-worker')
+    @click.option('--threads', default=1, show_default=True, help='Jobs rendered at the same time.')
+    def report_worker(threads):
+        """Render queued report jobs until stopped (Ctrl+C or SIGTERM)."""
+        flask_app = current_app._get_current_object()
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *args: stop.set())
+        workers = [threading.Thread(target=jobs.run_worker, args=(flask_app, stop)) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        click.echo(f"Report worker running with {threads} thread(s).")
+        try:
+            while any(w.is_alive() for w in workers):
+                stop.wait(1)
+        except KeyboardInterrupt:
+            pass
+        stop.set()
+        jobs.wake()
+        for worker in workers:
+            worker.join()
+
+    @app.cli.command('prune-report-jobs')
+    @click.option('--days', default=30, show_default=True, help='Keep jobs newer than this.')
+    def prune_report_jobs(days):
+        """Delete old report jobs and artifacts nothing refers to; closed-period reports are kept."""
+        deleted_jobs, deleted_files = ReportJobController.prune(days)
+        click.echo(f"Deleted {deleted_jobs} job(s) and {deleted_files} artifact file(s).")
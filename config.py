@@ -0,0 +1,94 @@
+import os
+
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value not in (None, '') else default
+
+
+def _database_url():
+    url = os.environ.get('DATABASE_URL', 'sqlite:///pos.db')
+    # Some hosts still hand out the pre-SQLAlchemy-1.4 scheme
+    if url.startswith('postgres://'):
+        url = 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
+class Config:
+    """Settings read from the environment, with defaults suited to a single-shop install."""
+
+    # Unset: a key generated once and kept in the instance folder (see instance_secret_key)
+    SECRET_KEY = os.environ.get('SECRET_KEY')
+    SQLALCHEMY_DATABASE_URI = _database_url()
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Connection pool (per worker process)
+    DB_POOL_SIZE = _env_int('DB_POOL_SIZE', 10)
+    DB_MAX_OVERFLOW = _env_int('DB_MAX_OVERFLOW', 10)
+    DB_POOL_TIMEOUT = _env_int('DB_POOL_TIMEOUT', 30)
+    DB_POOL_RECYCLE = _env_int('DB_POOL_RECYCLE', 1800)
+
+    # Where new-order notifications are published; see events.py
+    EVENT_BROKER = os.environ.get('EVENT_BROKER', 'local')
+
+    # Background report rendering; see jobs.py. REPORT_ARTIFACT_DIR defaults to instance/report_artifacts.
+    REPORT_WORKER_THREADS = _env_int('REPORT_WORKER_THREADS', 1)
+    REPORT_JOB_POLL_SECONDS = _env_int('REPORT_JOB_POLL_SECONDS', 5)
+    REPORT_ARTIFACT_DIR = os.environ.get('REPORT_ARTIFACT_DIR')
+
+    # Applied to every new SQLite connection. WAL lets the dashboards read while a
+    # counter is writing; busy_timeout makes writers queue instead of failing with
+    # "database is locked".
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': _env_int('SQLITE_BUSY_TIMEOUT_MS', 15000),
+        'mmap_size': _env_int('SQLITE_MMAP_SIZE', 256 * 1024 * 1024),
+        'cache_size': -_env_int('SQLITE_CACHE_KB', 64 * 1024),
+        'temp_store': 'MEMORY',
+    }
+
+
+def instance_secret_key(instance_path):
+    """The key in <instance>/secret_key, generated on first use.
+
+    Every process of an install (gunicorn workers, the report worker, the
+    CLI) reads the same file, so sessions and CSRF tokens signed by one are
+    accepted by the others. The file is published with a hard link, which
+    fails if another process got there first; that process's key wins.
+    """
+    path = os.path.join(instance_path, 'secret_key')
+    if not os.path.exists(path):
+        os.makedirs(instance_path, exist_ok=True)
+        tmp = f'{path}.{os.getpid()}'
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(os.urandom(32).hex())
+        try:
+            os.link(tmp, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp)
+    with open(path) as f:
+        return f.read().strip()
+
+
+def engine_options(config):
+    """SQLALCHEMY_ENGINE_OPTIONS for the configured database URL."""
+    url = config['SQLALCHEMY_DATABASE_URI']
+    if url.startswith('sqlite'):
+        if url in ('sqlite://', 'sqlite:///:memory:'):
+            return {}  # single shared in-memory connection, no pool to size
+        return {
+            'pool_size': config['DB_POOL_SIZE'],
+            'max_overflow': config['DB_MAX_OVERFLOW'],
+            'pool_timeout': config['DB_POOL_TIMEOUT'],
+        }
+    return {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': True,
+    }
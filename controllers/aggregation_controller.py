@@ -0,0 +1,159 @@
+from collections import defaultdict
+from models import DailySummary, ProductDailySales, Product
+from extensions import db
+from controllers.rollup_controller import ORDER_TYPE_COLUMNS
+from controllers.period_controller import PeriodController
+from sqlalchemy import func, extract
+from utils import period_bounds
+
+
+def _empty_bucket():
+    return {
+        'orders': defaultdict(lambda: {'revenue': 0.0, 'magnitude': 0.0, 'profit': 0.0, 'count': 0}),
+        'expenses': 0.0,
+        'staff_expenses': 0.0,
+        'purchases': 0.0,
+        'receipts': 0.0,
+    }
+
+
+def _bucket_from_snapshot(snapshot):
+    bucket = _empty_bucket()
+    bucket['orders'].update(snapshot['bucket']['orders'])
+    for key in ('expenses', 'staff_expenses', 'purchases', 'receipts'):
+        bucket[key] = snapshot['bucket'][key]
+    return bucket
+
+
+_ROLLUP_COLUMNS = [c.name for c in DailySummary.__table__.columns if c.name != 'date']
+
+
+class AggregationController:
+    """Monthly aggregation shared by the dashboards and reports.
+
+    `collect` reads the DailySummary rollup in one grouped query and returns
+    buckets keyed by (year, month); `totals` and `monthly_series` fold those
+    buckets into headline cards and chart series without touching the
+    database again. The cost depends on the number of days in range, not on
+    the number of orders. Closed months come from their period snapshot.
+    """
+
+    @staticmethod
+    def collect(start=None, end=None, frozen=True):
+        """Aggregate the daily rollup over [start, end); None means unbounded.
+
+        With `frozen`, closed months inside the range are read from their
+        snapshots rather than the rollup.
+        """
+        buckets = defaultdict(_empty_bucket)
+
+        y = extract('year', DailySummary.date).label('y')
+        m = extract('month', DailySummary.date).label('m')
+        columns = [func.sum(getattr(DailySummary, name)) for name in _ROLLUP_COLUMNS]
+        query = db.session.query(y, m, *columns)
+        if start is not None:
+            query = query.filter(DailySummary.date >= start.date())
+        if end is not None:
+            query = query.filter(DailySummary.date < end.date())
+
+        for year, month, *sums in query.group_by('y', 'm'):
+            values = dict(zip(_ROLLUP_COLUMNS, (s or 0 for s in sums)))
+            bucket = buckets[(int(year), int(month))]
+            for order_type, (total_col, profit_col, count_col) in ORDER_TYPE_COLUMNS.items():
+                revenue = float(values[total_col])
+                bucket['orders'][order_type] = {
+                    'revenue': revenue,
+                    'magnitude': abs(revenue),
+                    'profit': float(values[profit_col]),
+                    'count': int(values[count_col]),
+                }
+            bucket['expenses'] = float(values['expenses_total'])
+            bucket['staff_expenses'] = float(values['staff_expenses_total'])
+            bucket['purchases'] = float(values['purchases_total'])
+            bucket['receipts'] = float(values['receipts_total'])
+
+        if frozen:
+            for key, snapshot in PeriodController.snapshots(start, end).items():
+                buckets[key] = _bucket_from_snapshot(snapshot)
+        return buckets
+
+    @staticmethod
+    def snapshot_bucket(bucket):
+        """A collect() bucket as plain JSON-ready values."""
+        return {**bucket, 'orders': dict(bucket['orders'])}
+
+    @staticmethod
+    def top_products(start=None, end=None, limit=10):
+        """Best sellers by net quantity from the per-product daily rollup."""
+        total_sold = func.sum(ProductDailySales.quantity)
+        query = db.session.query(
+            Product.name,
+            Product.sku,
+            total_sold.label('total_sold'),
+            func.sum(ProductDailySales.revenue).label('revenue'),
+            func.sum(ProductDailySales.profit).label('profit')
+        ).join(Product, Product.id == ProductDailySales.product_id)
+        if start is not None:
+            query = query.filter(ProductDailySales.date >= start.date())
+        if end is not None:
+            query = query.filter(ProductDailySales.date < end.date())
+        return query.group_by(Product.id).order_by(total_sold.desc()).limit(limit).all()
+
+    @staticmethod
+    def totals(buckets, keys=None):
+        """Fold the selected (year, month) buckets (all when keys is None) into headline figures."""
+        selected = buckets.values() if keys is None else [buckets[k] for k in keys if k in buckets]
+
+        result = {
+            'total_revenue': 0.0, 'gross_profit': 0.0, 'total_orders': 0,
+            'cash_revenue': 0.0, 'cash_profit': 0.0, 'cash_count': 0,
+            'credit_revenue': 0.0, 'credit_profit': 0.0, 'credit_count': 0,
+            'total_returns_amount': 0.0, 'total_returns_count': 0,
+            'total_expenses': 0.0, 'total_staff_expenses': 0.0,
+            'total_purchases': 0.0, 'total_receipts': 0.0,
+        }
+        for bucket in selected:
+            for order_type, o in bucket['orders'].items():
+                result['total_revenue'] += o['revenue']
+                result['gross_profit'] += o['profit']
+                result['total_orders'] += o['count']
+                if order_type == 'sale':
+                    result['cash_revenue'] += o['revenue']
+                    result['cash_profit'] += o['profit']
+                    result['cash_count'] += o['count']
+                elif order_type == 'credit_sale':
+                    result['credit_revenue'] += o['revenue']
+                    result['credit_profit'] += o['profit']
+                    result['credit_count'] += o['count']
+                elif order_type == 'return':
+                    result['total_returns_amount'] += o['magnitude']
+                    result['total_returns_count'] += o['count']
+            result['total_expenses'] += bucket['expenses']
+            result['total_staff_expenses'] += bucket['staff_expenses']
+            result['total_purchases'] += bucket['purchases']
+            result['total_receipts'] += bucket['receipts']
+
+        result['net_profit'] = result['gross_profit'] - result['total_expenses'] - result['total_staff_expenses']
+        result['outstanding_credit'] = result['credit_revenue'] - result['total_receipts']
+        return result
+
+    @staticmethod
+    def monthly_series(buckets, year):
+        """Twelve-month chart series for one year."""
+        series = {'monthly_cash': [], 'monthly_credit': [], 'monthly_profit': [], 'monthly_expenses': []}
+        for m in range(1, 13):
+            t = AggregationController.totals(buckets, [(year, m)])
+            series['monthly_cash'].append(t['cash_revenue'])
+            series['monthly_credit'].append(t['credit_revenue'])
+            series['monthly_expenses'].append(t['total_expenses'] + t['total_staff_expenses'])
+            series['monthly_profit'].append(t['net_profit'])
+        return series
+
+    @staticmethod
+    def get_month_totals(year, month):
+        """Headline figures for a single calendar month."""
+        snapshot = PeriodController.get_snapshot(year, month)
+        if snapshot is not None:
+            return AggregationController.totals({(year, month): _bucket_from_snapshot(snapshot)})
+        start, end = period_bounds(year, month)
+        return AggregationController.totals(AggregationController.collect(start, end), [(year, month)])
@@ -0,0 +1,79 @@
+from decimal import Decimal
+from datetime import datetime
+from sqlalchemy import case, func, insert, literal, select, update
+from models import (CustomerTransaction, SupplierTransaction, Order, PurchaseOrder, PaymentAllocation,
+                    SupplierPaymentAllocation, PKT)
+from extensions import db
+
+# ledger -> (payment model, its account column, invoice model, invoice account column,
+#            allocation model, allocation invoice column)
+ALLOCATIONS = {
+    'customer': (CustomerTransaction, 'customer_id', Order, Order.customer_id,
+                 PaymentAllocation, PaymentAllocation.order_id),
+    'supplier': (SupplierTransaction, 'distributor_id', PurchaseOrder, PurchaseOrder.distributor_id,
+                 SupplierPaymentAllocation, SupplierPaymentAllocation.purchase_order_id),
+}
+MODEL_ALLOCATIONS = {payment: name for name, (payment, *_) in ALLOCATIONS.items()}
+
+
+class AllocationController:
+    """FIFO allocation of account payments to open invoices, in SQL.
+
+    A running total of balance_due over the account's open invoices (oldest
+    first, read through the open-invoice partial index) decides how much of a
+    payment each invoice takes; the invoices past the point where the payment
+    runs out are never returned. The allocations are inserted with one
+    INSERT ... SELECT and applied to the invoices with one UPDATE, so a payment
+    costs the same few statements however many invoices it settles. Customer
+    payments settle orders, supplier payments settle purchase orders.
+    """
+
+    @staticmethod
+    def plan(ledger, account_id, amount):
+        """Select of (invoice_id, amount) for the oldest open invoices `amount` pays, oldest first."""
+        _, _, invoice, account_column, _, _ = ALLOCATIONS[ledger]
+        running = func.round(func.sum(invoice.balance_due).over(order_by=(invoice.created_at, invoice.id)), 2)
+        invoices = select(invoice.id.label('invoice_id'), invoice.created_at,
+                          func.round(invoice.balance_due, 2).label('due'), running.label('running'))\
+            .where(account_column == account_id, invoice.is_open == True).subquery()
+        before = invoices.c.running - invoices.c.due
+        applied = case((invoices.c.running <= amount, invoices.c.due), else_=func.round(literal(amount) - before, 2))
+        return select(invoices.c.invoice_id, applied.label('amount'))\
+            .where(before < amount).order_by(invoices.c.created_at, invoices.c.invoice_id)
+
+    @staticmethod
+    def allocate(transaction):
+        """Apply a flushed Customer/SupplierTransaction payment to the oldest open invoices of its account.
+
+        Records an allocation row per invoice; whatever is left once every open
+        invoice is paid stays on the account as credit. Returns (amount
+        allocated, invoices touched).
+        """
+        ledger = MODEL_ALLOCATIONS[type(transaction)]
+        _, account_key, invoice, _, allocation, invoice_column = ALLOCATIONS[ledger]
+        amount = Decimal(str(transaction.amount))
+        plan = AllocationController.plan(ledger, getattr(transaction, account_key), amount).subquery()
+        db.session.execute(insert(allocation).from_select(
+            ['transaction_id', invoice_column.key, 'amount', 'created_at'],
+            select(literal(transaction.id), plan.c.invoice_id, plan.c.amount,
+                   literal(datetime.now(PKT).replace(tzinfo=None)))))
+
+        applied = select(func.sum(allocation.amount))\
+            .where(allocation.transaction_id == transaction.id, invoice_column == invoice.id)\
+            .scalar_subquery()
+        settled = applied >= func.round(invoice.balance_due, 2)
+        # A settled invoice is paid exactly its total, so float rounding can never leave it open
+        values = {'amount_paid': case((settled, invoice.total_amount),
+                                      else_=func.round(invoice.amount_paid + applied, 2))}
+        if invoice is PurchaseOrder:
+            values['payment_status'] = case((settled, 'paid'), else_='partial')
+        allocated_invoices = select(invoice_column).where(allocation.transaction_id == transaction.id)
+        # 'fetch' returns the updated ids, so orders or POs already loaded in the
+        # session have the new amount_paid/balance_due read back instead of going stale
+        db.session.execute(
+            update(invoice).where(invoice.id.in_(allocated_invoices)).values(values)
+            .execution_options(synchronize_session='fetch'))
+
+        total, count = db.session.query(func.coalesce(func.sum(allocation.amount), 0), func.count(allocation.id))\
+            .filter(allocation.transaction_id == transaction.id).one()
+        return Decimal(str(total)), count
@@ -1,303 +1,230 @@
+import sys
+from decimal import Decimal
 from models import (Order, PurchaseOrder, Product, Distributor, Customer,
                      OrderItem, CustomerTransaction, SupplierTransaction,
                      Expense, CashTransaction, EmployeePayment, PKT)
 from extensions import db
-from sqlalchemy import func, extract
+from controllers.aggregation_controller import AggregationController
+from controllers.running_balance_controller import RunningBalanceController
+from controllers.period_controller import PeriodController
+from sqlalchemy import case, func, literal, null, select, tuple_, union_all
+from sqlalchemy.orm import aliased, joinedload
 from datetime import datetime, timedelta
+from utils import period_bounds, filter_period, keyset_page, encode_cursor, decode_cursor, PAGE_SIZE
 
+# Tie-break order of the combined ledger for rows with the same timestamp
+LEDGER_ORDER = ('customer', 'supplier')
 
-class AnalyticsController:
-    @staticmethod
-    def get_dashboard_metrics(year, month):
-        # Base queries
-        sales_query = Order.query.filter(Order.status == 'approved')
-        purchases_query = PurchaseOrder.query.filter(PurchaseOrder.status == 'received')
-        expenses_query = Expense.query
-        staff_query = EmployeePayment.query
+# Aging buckets by days since the invoice date, youngest first
+AGING_BUCKETS = ('0-30', '31-60', '61-90', '90+')
+AGING_SIDES = ('receivables', 'payables')
 
-        if month:
-            sales_query = sales_query.filter(
-                extract('year', Order.created_at) == year,
-                extract('month', Order.created_at) == month)
-            purchases_query = purchases_query.filter(
-                extract('year', PurchaseOrder.created_at) == year,
-                extract('month', PurchaseOrder.created_at) == month)
-            expenses_query = expenses_query.filter(
-                extract('year', Expense.expense_date) == year,
-                extract('month', Expense.expense_date) == month)
-            staff_query = staff_query.filter(
-                extract('year', EmployeePayment.date) == year,
-                extract('month', EmployeePayment.date) == month)
-
-        # Sales metrics
-        total_revenue = float(sales_query.with_entities(func.sum(Order.total_amount)).scalar() or 0)
-        gross_profit = float(sales_query.with_entities(func.sum(Order.total_profit)).scalar() or 0)
-        total_orders = sales_query.count()
-
-        # Cash vs Credit breakdown
-        cash_query = sales_query.filter(Order.order_type == 'sale')
-        credit_query = sales_query.filter(Order.order_type == 'credit_sale')
-
-        cash_revenue = float(cash_query.with_entities(func.sum(Order.total_amount)).scalar() or 0)
-        cash_count = cash_query.count()
-        cash_profit = float(cash_query.with_entities(func.sum(Order.total_profit)).scalar() or 0)
-
-        credit_revenue = float(credit_query.with_entities(func.sum(Order.total_amount)).scalar() or 0)
-        credit_count = credit_query.count()
-        credit_profit = float(credit_query.with_entities(func.sum(Order.total_profit)).scalar() or 0)
-
-        # Returns metrics
-        returns_query = sales_query.filter(Order.order_type == 'return')
-        total_returns_amount = float(returns_query.with_entities(func.sum(func.abs(Order.total_amount))).scalar() or 0)
-        total_returns_count = returns_query.count()
-
-        # Expense metrics
-        total_expenses = float(expenses_query.with_entities(func.sum(Expense.amount)).scalar() or 0)
-
-        # Staff expenses
-        total_staff_expenses = float(staff_query.with_entities(func.sum(EmployeePayment.amount)).scalar() or 0)
-
-        # Purchase metrics
-        total_purchases = float(purchases_query.with_entities(func.sum(PurchaseOrder.total_amount)).scalar() or 0)
-
-        # Net Profit = Gross Profit (Profit from sales) - Expenses - Staff Expenses
-        net_profit = gross_profit - total_expenses - total_staff_expenses
-
-        # Receipts collected (customer payments)
-        receipts_query = CustomerTransaction.query.filter(
-            CustomerTransaction.transaction_type == 'payment')
-        if month:
-            receipts_query = receipts_query.filter(
-                extract('year', CustomerTransaction.created_at) == year,
-                extract('month', CustomerTransaction.created_at) == month)
-        total_receipts = float(receipts_query.with_entities(
-            func.sum(CustomerTransaction.amount)).scalar() or 0)
+# Open purchase orders listed per distributor on the payables page, oldest first
+PAYABLES_PO_LIMIT = 10
+
+
+def _aging_bounds(today):
+    """{bucket: (start, end)} invoice-date ranges; an invoice is N days old N midnights after its date."""
+    def midnight(days):
+        return datetime.combine(today - timedelta(days=days), datetime.min.time())
+
+    return {
+        '0-30': (midnight(30), None),
+        '31-60': (midnight(60), midnight(30)),
+        '61-90': (midnight(90), midnight(60)),
+        '90+': (None, midnight(90)),
+    }
 
-        # Outstanding credit
-        outstanding_credit = credit_revenue - total_receipts
 
-        # Credit metrics (all-time for summary cards)
+class AnalyticsController:
+    @staticmethod
+    def get_outstanding_totals():
+        """All-time receivables and payables still open on invoices."""
         total_receivables = float(
-            db.session.query(func.sum(Order.total_amount - Order.amount_paid))
-            .filter(Order.status == 'approved',
-                    Order.total_amount > Order.amount_paid).scalar() or 0)
+            db.session.query(func.sum(Order.balance_due)).filter(Order.is_open == True).scalar() or 0)
 
         total_payables = float(
-            db.session.query(func.sum(PurchaseOrder.total_amount - PurchaseOrder.amount_paid))
-            .filter(PurchaseOrder.payment_status != 'paid').scalar() or 0)
-
-        # Top products
-        top_products_query = db.session.query(
-            Product.name,
-            Product.sku,
-            func.sum(OrderItem.quantity).label('total_sold'),
-            func.sum(OrderItem.quantity * OrderItem.price).label('revenue'),
-            func.sum((OrderItem.price - Product.cost_price) * OrderItem.quantity).label('profit')
-        ).join(OrderItem).join(Order).filter(Order.status == 'approved')
+            db.session.query(func.sum(PurchaseOrder.balance_due)).filter(PurchaseOrder.is_open == True).scalar() or 0)
+
+        return {
+            'total_receivables': total_receivables,
+            'total_payables': total_payables,
+        }
 
+    @staticmethod
+    def get_dashboard_metrics(year, month):
+        # Cards and charts come from the daily rollup. With a month selected the
+        # cards cover that month; without one they are all-time. Charts always
+        # cover `year`.
         if month:
-            top_products_query = top_products_query.filter(
-                extract('year', Order.created_at) == year,
-                extract('month', Order.created_at) == month)
+            start, end = period_bounds(year, month)
+            buckets = AggregationController.collect(*period_bounds(year))
+            cards = AggregationController.totals(buckets, [(year, month)])
+        else:
+            start = end = None
+            buckets = AggregationController.collect()
+            cards = AggregationController.totals(buckets)
+
+        series = AggregationController.monthly_series(buckets, year)
+        outstanding = AnalyticsController.get_outstanding_totals()
+
+        # A closed month's rankings are part of its snapshot
+        snapshot = PeriodController.get_snapshot(year, month) if month else None
+        rankings = snapshot['rankings'] if snapshot else AnalyticsController.get_rankings(start, end)
+
+        return {
+            **cards,
+            **outstanding,
+            **series,
+            'top_products': rankings['top_products'],
+            'top_distributors': rankings['top_distributors'],
+            'expense_categories': [e['category'] for e in rankings['expense_breakdown']],
+            'expense_amounts': [e['total'] for e in rankings['expense_breakdown']],
+        }
 
-        top_products = top_products_query.group_by(Product.id)\
-            .order_by(func.sum(OrderItem.quantity).desc()).limit(10).all()
+    @staticmethod
+    def get_rankings(start, end):
+        """Top products, top distributors and expenses by category over [start, end), as plain dicts."""
+        top_products = AggregationController.top_products(start, end)
 
-        # Top distributors
-        top_distributors_query = db.session.query(
+        top_distributors_query = filter_period(db.session.query(
             Distributor.name,
             func.count(PurchaseOrder.id).label('purchase_count'),
             func.sum(PurchaseOrder.total_amount).label('total_purchases')
-        ).join(PurchaseOrder).filter(PurchaseOrder.status == 'received')
-
-        if month:
-            top_distributors_query = top_distributors_query.filter(
-                extract('year', PurchaseOrder.created_at) == year,
-                extract('month', PurchaseOrder.created_at) == month)
+        ).join(PurchaseOrder).filter(PurchaseOrder.status == 'received'), PurchaseOrder.created_at, start, end)
 
         top_distributors = top_distributors_query.group_by(Distributor.id)\
             .order_by(func.sum(PurchaseOrder.total_amount).desc()).limit(5).all()
 
-        # Monthly sales for chart (cash vs credit split)
-        monthly_cash = []
-        monthly_credit = []
-        monthly_profit = []
-        monthly_expenses_arr = []
-        for m in range(1, 13):
-            base = db.session.query(func.sum(Order.total_amount))\
-                .filter(Order.status == 'approved',
-                        extract('year', Order.created_at) == year,
-                        extract('month', Order.created_at) == m)
-            cash_m = float(base.filter(Order.order_type == 'sale').scalar() or 0)
-            credit_m = float(base.filter(Order.order_type == 'credit_sale').scalar() or 0)
-            monthly_cash.append(cash_m)
-            monthly_credit.append(credit_m)
-
-            # Monthly revenue and gross profit
-            rev_m = cash_m + credit_m
-            
-            # Monthly gross profit (profit from sales)
-            gross_m = float(base.with_entities(func.sum(Order.total_profit)).scalar() or 0)
-
-            # Monthly expenses
-            exp_m = float(db.session.query(func.sum(Expense.amount))
-                          .filter(extract('year', Expense.expense_date) == year,
-                                  extract('month', Expense.expense_date) == m).scalar() or 0)
-
-            # Monthly staff expenses
-            staff_m = float(db.session.query(func.sum(EmployeePayment.amount))
-                            .filter(extract('year', EmployeePayment.date) == year,
-                                    extract('month', EmployeePayment.date) == m).scalar() or 0)
-
-            monthly_expenses_arr.append(exp_m + staff_m)
-            monthly_profit.append(gross_m - exp_m - staff_m)
-
-        # Expense breakdown by category
-        expense_breakdown = db.session.query(
+        expense_breakdown = filter_period(db.session.query(
             Expense.category,
             func.sum(Expense.amount).label('total')
-        )
-        if month:
-            expense_breakdown = expense_breakdown.filter(
-                extract('year', Expense.expense_date) == year,
-                extract('month', Expense.expense_date) == month)
+        ), Expense.expense_date, start, end)
         expense_breakdown = expense_breakdown.group_by(Expense.category)\
             .order_by(func.sum(Expense.amount).desc()).all()
 
-        expense_categories = [e.category for e in expense_breakdown]
-        expense_amounts = [float(e.total) for e in expense_breakdown]
-
         return {
-            'total_revenue': total_revenue,
-            'gross_profit': gross_profit,
-            'net_profit': net_profit,
-            'total_expenses': total_expenses,
-            'total_staff_expenses': total_staff_expenses,
-            'total_orders': total_orders,
-            'cash_revenue': cash_revenue,
-            'cash_count': cash_count,
-            'cash_profit': cash_profit,
-            'credit_revenue': credit_revenue,
-            'credit_count': credit_count,
-            'credit_profit': credit_profit,
-            'total_returns_amount': total_returns_amount,
-            'total_returns_count': total_returns_count,
-            'total_purchases': total_purchases,
-            'total_receivables': total_receivables,
-            'total_payables': total_payables,
-            'total_receipts': total_receipts,
-            'outstanding_credit': outstanding_credit,
-            'top_products': top_products,
-            'top_distributors': top_distributors,
-            'monthly_cash': monthly_cash,
-            'monthly_credit': monthly_credit,
-            'monthly_profit': monthly_profit,
-            'monthly_expenses': monthly_expenses_arr,
-            'expense_categories': expense_categories,
-            'expense_amounts': expense_amounts,
+            'top_products': [{'name': p.name, 'sku': p.sku, 'total_sold': int(p.total_sold or 0),
+                              'revenue': float(p.revenue or 0), 'profit': float(p.profit or 0)}
+                             for p in top_products],
+            'top_distributors': [{'name': d.name, 'purchase_count': d.purchase_count,
+                                  'total_purchases': float(d.total_purchases or 0)} for d in top_distributors],
+            'expense_breakdown': [{'category': e.category, 'total': float(e.total or 0)}
+                                  for e in expense_breakdown],
         }
 
     @staticmethod
     def get_aging_data():
-        today = datetime.now(PKT).date()
+        """Open receivables and payables by age, per counterparty, in one grouped query per side.
 
-        receivables = Order.query.filter(Order.status == 'approved')\
-            .filter(Order.total_amount > Order.amount_paid).all()
+        Returns {'receivables': summary, 'payables': summary}; each summary has
+        'parties' (id, name, {bucket: {'amount', 'count'}}, total, count)
+        biggest first, plus the same figures summed over all parties.
+        """
+        today = datetime.now(PKT).date()
+        return {side: AnalyticsController._aging_summary(side, today) for side in AGING_SIDES}
 
-        aging_receivables = {
-            '0-30': [], '31-60': [], '61-90': [], '90+': []
-        }
+    @staticmethod
+    def _aging_open(side):
+        """(model, query over the side's open invoices, party id column, party name column)."""
+        if side == 'receivables':
+            query = db.session.query(Order).outerjoin(Customer, Customer.id == Order.customer_id)\
+                .filter(Order.is_open == True)
+            return Order, query, Order.customer_id, func.coalesce(Customer.name, Order.customer_name)
+        query = db.session.query(PurchaseOrder).outerjoin(Distributor, Distributor.id == PurchaseOrder.distributor_id)\
+            .filter(PurchaseOrder.is_open == True)
+        return PurchaseOrder, query, PurchaseOrder.distributor_id, Distributor.name
 
-        for order in receivables:
-            days_due = (today - order.created_at.date()).days
-            remaining = order.total_amount - order.amount_paid
-
-            item = {
-                'id': order.id,
-                'customer': order.customer_name or f"Order #{order.id}",
-                'amount': remaining,
-                'date': order.created_at.strftime('%Y-%m-%d'),
-                'days_due': days_due
-            }
-
-            if days_due <= 30:
-                aging_receivables['0-30'].append(item)
-            elif days_due <= 60:
-                aging_receivables['31-60'].append(item)
-            elif days_due <= 90:
-                aging_receivables['61-90'].append(item)
-            else:
-                aging_receivables['90+'].append(item)
-
-        payables = PurchaseOrder.query.filter(PurchaseOrder.payment_status != 'paid')\
-            .filter(PurchaseOrder.total_amount > PurchaseOrder.amount_paid).all()
-
-        aging_payables = {
-            '0-30': [], '31-60': [], '61-90': [], '90+': []
-        }
+    @staticmethod
+    def _aging_summary(side, today):
+        model, query, party_id, party_name = AnalyticsController._aging_open(side)
+        bounds = _aging_bounds(today)
+        bucket = case(*[(model.created_at >= bounds[b][0], b) for b in AGING_BUCKETS[:-1]], else_=AGING_BUCKETS[-1])
+        remaining = model.balance_due
+        # Walk-in customers have no id; their invoices are grouped by the name on the order
+        walk_in = case((party_id.is_(None), party_name))
+
+        columns = []
+        for b in AGING_BUCKETS:
+            columns += [func.sum(case((bucket == b, remaining), else_=0)), func.sum(case((bucket == b, 1), else_=0))]
+        rows = query.with_entities(party_id, func.max(party_name), *columns).group_by(party_id, walk_in).all()
+
+        empty = {b: {'amount': 0.0, 'count': 0} for b in AGING_BUCKETS}
+        summary = {'parties': [], 'buckets': {b: dict(v) for b, v in empty.items()}, 'total': 0.0, 'count': 0}
+        for row_id, name, *figures in rows:
+            party = {'id': row_id, 'name': name or 'Walk-in', 'buckets': {}, 'total': 0.0, 'count': 0}
+            for i, b in enumerate(AGING_BUCKETS):
+                amount, count = float(figures[2 * i] or 0), int(figures[2 * i + 1] or 0)
+                party['buckets'][b] = {'amount': amount, 'count': count}
+                summary['buckets'][b]['amount'] += amount
+                summary['buckets'][b]['count'] += count
+                party['total'] += amount
+                party['count'] += count
+            summary['parties'].append(party)
+            summary['total'] += party['total']
+            summary['count'] += party['count']
+        summary['parties'].sort(key=lambda p: p['total'], reverse=True)
+        return summary
 
-        for po in payables:
-            days_since = (today - po.created_at.date()).days
-            remaining = po.total_amount - po.amount_paid
-
-            item = {
-                'id': po.id,
-                'distributor': po.distributor.name,
-                'amount': remaining,
-                'date': po.created_at.strftime('%Y-%m-%d'),
-                'days': days_since
-            }
-
-            if days_since <= 30:
-                aging_payables['0-30'].append(item)
-            elif days_since <= 60:
-                aging_payables['31-60'].append(item)
-            elif days_since <= 90:
-                aging_payables['61-90'].append(item)
-            else:
-                aging_payables['90+'].append(item)
-
-        return aging_receivables, aging_payables
+    @staticmethod
+    def get_aging_bucket(side, bucket, party_id=None, party_name=None, cursor=None):
+        """One page of the open invoices in an aging bucket, newest first, optionally for one party.
+
+        A walk-in customer is picked by `party_name` with no `party_id`.
+        Returns (invoices, next_cursor).
+        """
+        model, query, party_column, name_column = AnalyticsController._aging_open(side)
+        start, end = _aging_bounds(datetime.now(PKT).date())[bucket]
+        query = filter_period(query, model.created_at, start, end)
+        if party_id is not None:
+            query = query.filter(party_column == party_id)
+        elif party_name:
+            query = query.filter(party_column.is_(None), name_column == party_name)
+        query = query.options(joinedload(Order.customer) if model is Order else joinedload(PurchaseOrder.distributor))
+        return keyset_page(query, model.created_at, model.id, cursor)
 
     @staticmethod
-    def get_ledger_data(transaction_type, start_date, end_date):
+    def get_ledger_data(transaction_type, start_date, end_date, cursor=None):
+        """One page of the cash book, newest first. Returns (rows, next_cursor).
+
+        Running balances are cash in hand after each row, counting everything
+        before it (before the date range too); filtered to one type they are
+        that type's running total. See RunningBalanceController.
+        """
         query = CashTransaction.query
 
         if transaction_type != 'all':
             query = query.filter_by(transaction_type=transaction_type)
 
-        if start_date:
-            query = query.filter(CashTransaction.created_at >= datetime.strptime(start_date, '%Y-%m-%d'))
-        if end_date:
-            query = query.filter(CashTransaction.created_at <= datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1))
-
-        transactions = query.order_by(CashTransaction.created_at.asc()).all()
-
-        balance = 0
-        result = []
-        for t in transactions:
-            if t.transaction_type == 'in':
-                balance += float(t.amount)
-            else:
-                balance -= float(t.amount)
-            result.append({
-                'id': t.id,
-                'transaction_type': t.transaction_type,
-                'amount': t.amount,
-                'source': t.source,
-                'description': t.description,
-                'created_at': t.created_at,
-                'creator_username': t.creator.username if t.creator else '—',
-                'running_balance': balance
-            })
+        start, end = period_bounds(start_date=start_date, end_date=end_date)
+        query = filter_period(query, CashTransaction.created_at, start, end)
+
+        page, next_cursor = keyset_page(query.options(joinedload(CashTransaction.creator)),
+                                        CashTransaction.created_at, CashTransaction.id, cursor)
+        if not page:
+            return [], None
 
-        return reversed(result)
+        balances = RunningBalanceController.running_balances(
+            'cash', page, transaction_type=None if transaction_type == 'all' else transaction_type)
+
+        result = [{
+            'id': t.id,
+            'transaction_type': t.transaction_type,
+            'amount': t.amount,
+            'source': t.source,
+            'description': t.description,
+            'created_at': t.created_at,
+            'creator_username': t.creator.username if t.creator else '—',
+            'running_balance': balances[t.id],
+        } for t in page]
+
+        return result, next_cursor
 
     @staticmethod
     def get_receivables_data():
         """Returns registered customer outstanding balances only."""
-        all_customers = Customer.query.all()
-        debtors = [c for c in all_customers if c.balance > 0]
+        debtors = Customer.query.filter(Customer.balance > 0)\
+            .order_by(Customer.balance.desc()).all()
         total_registered = sum(c.balance for c in debtors)
 
         return {
@@ -307,111 +234,196 @@ class AnalyticsController:
         }
 
     @staticmethod
-    def get_payables_data():
-        """Returns distributor outstanding balances with per-PO breakdown."""
-        all_distributors = Distributor.query.all()
+    def get_creditors():
+        """Distributors with a balance, each with its open purchase orders summarised.
+
+        One query: the stored balances joined to open-PO counts, totals and
+        oldest dates grouped over the open-PO index. Returns [{distributor,
+        balance, open_count, open_amount, oldest, oldest_due, overdue}],
+        largest balance first.
+        """
+        open_pos = select(PurchaseOrder.distributor_id,
+                          func.count(PurchaseOrder.id).label('open_count'),
+                          func.sum(PurchaseOrder.balance_due).label('open_amount'),
+                          func.min(PurchaseOrder.created_at).label('oldest'))\
+            .where(PurchaseOrder.is_open == True).group_by(PurchaseOrder.distributor_id).subquery()
+        rows = db.session.query(Distributor, open_pos.c.open_count, open_pos.c.open_amount, open_pos.c.oldest)\
+            .outerjoin(open_pos, open_pos.c.distributor_id == Distributor.id)\
+            .filter(Distributor.balance > 0).order_by(Distributor.balance.desc(), Distributor.id)
+
+        now = datetime.now(PKT).replace(tzinfo=None)
         creditors = []
-        for d in all_distributors:
-            if d.balance > 0:
-                outstanding_pos = PurchaseOrder.query.filter(
-                    PurchaseOrder.distributor_id == d.id,
-                    PurchaseOrder.payment_status != 'paid'
-                ).order_by(PurchaseOrder.created_at.desc()).all()
-                creditors.append({
-                    'distributor': d,
-                    'balance': d.balance,
-                    'outstanding_pos': outstanding_pos,
-                })
-        total_payable = sum(c['balance'] for c in creditors)
+        for distributor, open_count, open_amount, oldest in rows:
+            oldest_due = oldest + timedelta(days=distributor.payment_terms or 0) if oldest else None
+            creditors.append({
+                'distributor': distributor,
+                'balance': distributor.balance,
+                'open_count': open_count or 0,
+                'open_amount': Decimal(str(open_amount or 0)),
+                'oldest': oldest,
+                'oldest_due': oldest_due,
+                'overdue': bool(oldest_due and oldest_due < now),
+            })
+        return creditors
+
+    @staticmethod
+    def get_outstanding_pos(limit=PAYABLES_PO_LIMIT):
+        """{distributor_id: [PurchaseOrder]}: the `limit` oldest open POs of every distributor with a balance.
+
+        A single windowed query (ROW_NUMBER per distributor), so the number
+        of queries does not grow with the number of suppliers.
+        """
+        position = func.row_number().over(partition_by=PurchaseOrder.distributor_id,
+                                          order_by=(PurchaseOrder.created_at, PurchaseOrder.id))
+        ranked = select(PurchaseOrder, position.label('position'))\
+            .where(PurchaseOrder.is_open == True,
+                   PurchaseOrder.distributor_id.in_(select(Distributor.id).where(Distributor.balance > 0)))\
+            .subquery()
+        # Map the ranked rows straight back to POs rather than re-reading them by id
+        po = aliased(PurchaseOrder, ranked)
+        outstanding = {}
+        for purchase in db.session.query(po).filter(ranked.c.position <= limit)\
+                .order_by(po.distributor_id, po.created_at, po.id):
+            outstanding.setdefault(purchase.distributor_id, []).append(purchase)
+        return outstanding
+
+    @staticmethod
+    def get_payables_data():
+        """Returns distributor outstanding balances with their oldest open POs, in two queries."""
+        creditors = AnalyticsController.get_creditors()
+        outstanding = AnalyticsController.get_outstanding_pos()
+        for creditor in creditors:
+            creditor['outstanding_pos'] = outstanding.get(creditor['distributor'].id, [])
+        total_payable = sum((c['balance'] for c in creditors), Decimal('0'))
         return {
             'creditors': creditors,
             'total_payable': total_payable,
+            'po_limit': PAYABLES_PO_LIMIT,
         }
 
     @staticmethod
-    def get_ledger_entries(transaction_type, start_date, end_date):
-        """Returns unified CustomerTransaction + SupplierTransaction ledger with running balance."""
-        ct_query = CustomerTransaction.query
-        st_query = SupplierTransaction.query
-
-        if transaction_type == 'customer':
-            st_query = st_query.filter(False)
-        elif transaction_type == 'supplier':
-            ct_query = ct_query.filter(False)
-
-        if start_date:
-            start_dt = datetime.strptime(start_date, '%Y-%m-%d')
-            ct_query = ct_query.filter(CustomerTransaction.created_at >= start_dt)
-            st_query = st_query.filter(SupplierTransaction.created_at >= start_dt)
-        if end_date:
-            end_dt = datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)
-            ct_query = ct_query.filter(CustomerTransaction.created_at <= end_dt)
-            st_query = st_query.filter(SupplierTransaction.created_at <= end_dt)
-
-        customer_txns = ct_query.all()
-        supplier_txns = st_query.all()
+    def _ledger_arms(transaction_type, start, end):
+        """[(ledger, select, model)] for the combined ledger, projected to the same columns.
+
+        `signed_amount` is each row's effect on the net position: receivables
+        and supplier payments raise it, customer payments and payables lower it.
+        """
+        arms = []
+        if transaction_type != 'supplier':
+            ct = CustomerTransaction
+            arms.append(('customer', select(
+                literal('customer').label('ledger'), ct.id, ct.created_at,
+                Customer.name.label('entity'), ct.customer_id.label('entity_id'),
+                ct.transaction_type, ct.amount, ct.reference, ct.notes, ct.payment_method,
+                ct.order_id, null().label('purchase_order_id'),
+                RunningBalanceController.signed_amount('customer').label('signed_amount'),
+            ).outerjoin(Customer, Customer.id == ct.customer_id), ct))
+        if transaction_type != 'customer':
+            st = SupplierTransaction
+            arms.append(('supplier', select(
+                literal('supplier').label('ledger'), st.id, st.created_at,
+                Distributor.name.label('entity'), st.distributor_id.label('entity_id'),
+                st.transaction_type, st.amount, st.reference, st.notes, st.payment_method,
+                null().label('order_id'), st.purchase_order_id,
+                (-RunningBalanceController.signed_amount('supplier')).label('signed_amount'),
+            ).outerjoin(Distributor, Distributor.id == st.distributor_id), st))
+        return [(ledger, filter_period(stmt, model.created_at, start, end), model)
+                for ledger, stmt, model in arms]
 
-        entries = []
-        for t in customer_txns:
-            entries.append({
-                'created_at': t.created_at,
-                'ledger': 'customer',
-                'entity': t.customer.name if t.customer else 'Unknown',
-                'entity_id': t.customer_id,
-                'transaction_type': t.transaction_type,
-                'amount': float(t.amount),
-                'reference': t.reference,
-                'notes': t.notes,
-                'payment_method': t.payment_method,
-                'order_id': t.order_id,
-                'purchase_order_id': None,
-            })
-        for t in supplier_txns:
-            entries.append({
-                'created_at': t.created_at,
-                'ledger': 'supplier',
-                'entity': t.distributor.name if t.distributor else 'Unknown',
-                'entity_id': t.distributor_id,
-                'transaction_type': t.transaction_type,
-                'amount': float(t.amount),
-                'reference': t.reference,
-                'notes': t.notes,
-                'payment_method': t.payment_method,
-                'order_id': None,
-                'purchase_order_id': t.purchase_order_id,
-            })
+    @staticmethod
+    def _ledger_opening(transaction_type, created_at, ledger=None, row_id=None):
+        """Net position before (created_at, ledger, row_id) in the combined order, from checkpoints.
+
+        Customer rows sort before supplier rows with the same timestamp.
+        """
+        balance = Decimal('0')
+        if transaction_type != 'supplier':
+            # Every customer row at `created_at` precedes a supplier row there
+            bound = row_id if ledger == 'customer' else (sys.maxsize if ledger == 'supplier' else None)
+            balance += RunningBalanceController.balance_before('customer', created_at, bound)
+        if transaction_type != 'customer':
+            bound = row_id if ledger == 'supplier' else None
+            balance -= RunningBalanceController.balance_before('supplier', created_at, bound)
+        return balance
 
-        entries.sort(key=lambda x: x['created_at'])
+    @staticmethod
+    def _ledger_totals():
+        totals = RunningBalanceController.ledger_totals(['customer', 'supplier'])
+        receivable, received = totals['customer']
+        payable, paid = totals['supplier']
+        return {
+            'total_receivables': max(float(receivable - received), 0),
+            'total_payables': max(float(payable - paid), 0),
+        }
 
-        balance = 0.0
-        for e in entries:
-            if e['transaction_type'] in ('receivable',):
-                balance += e['amount']
-            elif e['ledger'] == 'customer' and e['transaction_type'] == 'payment':
-                balance -= e['amount']
-            elif e['transaction_type'] == 'payable':
-                balance -= e['amount']
-            elif e['ledger'] == 'supplier' and e['transaction_type'] == 'payment':
-                balance += e['amount']
-            e['running_balance'] = balance
+    @staticmethod
+    def get_ledger_entries(transaction_type, start_date, end_date, cursor=None):
+        """One newest-first page of the combined customer/supplier ledger.
+
+        Both ledgers are read by a single UNION ALL whose arms are each an
+        index range scan limited to one page, ordered by (created_at, ledger,
+        id). Returns {'transactions', 'next_cursor', 'total_receivables',
+        'total_payables'}; running balances are the net position after each row.
+        """
+        start, end = period_bounds(start_date=start_date, end_date=end_date)
+        position = decode_cursor(cursor)
+
+        arms = []
+        for ledger, stmt, model in AnalyticsController._ledger_arms(transaction_type, start, end):
+            if position is not None:
+                # Cursor ids carry the ledger in their low bit: id * 2 + rank
+                created_at, key = position
+                cursor_ledger, cursor_id = LEDGER_ORDER[key % 2], key // 2
+                if ledger == cursor_ledger:
+                    stmt = stmt.where(tuple_(model.created_at, model.id) < tuple_(created_at, cursor_id))
+                elif ledger < cursor_ledger:
+                    stmt = stmt.where(model.created_at <= created_at)
+                else:
+                    stmt = stmt.where(model.created_at < created_at)
+            arm = stmt.order_by(model.created_at.desc(), model.id.desc()).limit(PAGE_SIZE + 1).subquery()
+            arms.append(select(arm))
+        merged = union_all(*arms).subquery()
+        rows = db.session.execute(
+            select(merged).order_by(merged.c.created_at.desc(), merged.c.ledger.desc(), merged.c.id.desc())
+            .limit(PAGE_SIZE + 1)).mappings().all()
+
+        next_cursor = None
+        if len(rows) > PAGE_SIZE:
+            rows = rows[:PAGE_SIZE]
+            last = rows[-1]
+            next_cursor = encode_cursor(last['created_at'], last['id'] * 2 + LEDGER_ORDER.index(last['ledger']))
 
-        total_receivables = float(
-            db.session.query(func.sum(CustomerTransaction.amount))
-            .filter(CustomerTransaction.transaction_type == 'receivable').scalar() or 0
-        ) - float(
-            db.session.query(func.sum(CustomerTransaction.amount))
-            .filter(CustomerTransaction.transaction_type == 'payment').scalar() or 0
-        )
-        total_payables = float(
-            db.session.query(func.sum(SupplierTransaction.amount))
-            .filter(SupplierTransaction.transaction_type == 'payable').scalar() or 0
-        ) - float(
-            db.session.query(func.sum(SupplierTransaction.amount))
-            .filter(SupplierTransaction.transaction_type == 'payment').scalar() or 0
-        )
+        entries = []
+        if rows:
+            oldest = rows[-1]
+            balance = AnalyticsController._ledger_opening(
+                transaction_type, oldest['created_at'], oldest['ledger'], oldest['id'])
+            for row in reversed(rows):
+                balance += Decimal(str(row['signed_amount']))
+                entries.append(dict(row, amount=float(row['amount']), entity=row['entity'] or 'Unknown',
+                                    running_balance=float(balance)))
+            entries.reverse()
 
         return {
-            'transactions': list(reversed(entries)),
-            'total_receivables': max(total_receivables, 0),
-            'total_payables': max(total_payables, 0),
+            'transactions': entries,
+            'next_cursor': next_cursor,
+            **AnalyticsController._ledger_totals(),
         }
+
+    @staticmethod
+    def iter_ledger_entries(transaction_type, start_date, end_date, batch_size=500):
+        """Every row of the combined ledger in the range, oldest first, with running balances.
+
+        Streams from one ordered UNION ALL in batches of `batch_size`, so memory
+        stays flat however long the range is.
+        """
+        start, end = period_bounds(start_date=start_date, end_date=end_date)
+        merged = union_all(*[stmt for _, stmt, _ in
+                             AnalyticsController._ledger_arms(transaction_type, start, end)]).subquery()
+        stmt = select(merged).order_by(merged.c.created_at, merged.c.ledger, merged.c.id)
+
+        balance = AnalyticsController._ledger_opening(transaction_type, start) if start else Decimal('0')
+        for row in db.session.execute(stmt, execution_options={'yield_per': batch_size}).mappings():
+            balance += Decimal(str(row['signed_amount']))
+            yield dict(row, amount=float(row['amount']), entity=row['entity'] or 'Unknown',
+                       running_balance=float(balance))
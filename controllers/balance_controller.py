@@ -0,0 +1,99 @@
+from decimal import Decimal
+from datetime import datetime
+from sqlalchemy import case, func, update
+from models import Customer, Distributor, CustomerTransaction, SupplierTransaction, PKT
+from extensions import db
+from controllers.rollup_controller import RollupController
+
+
+# (account model, ledger model, ledger foreign key, transaction type that increases the balance)
+LEDGERS = {
+    'customer': (Customer, CustomerTransaction, CustomerTransaction.customer_id, 'receivable'),
+    'distributor': (Distributor, SupplierTransaction, SupplierTransaction.distributor_id, 'payable'),
+}
+
+
+def _to_decimal(value):
+    return value if isinstance(value, Decimal) else Decimal(str(value or 0))
+
+
+class BalanceController:
+    @staticmethod
+    def post(transaction):
+        """Add a Customer/SupplierTransaction and move the stored account balance with it.
+
+        The balance is changed with a single relative UPDATE in the caller's
+        transaction, so it commits or rolls back together with the ledger row.
+        Customer payments are also added to the daily receipts rollup.
+        """
+        if transaction.created_at is None:
+            transaction.created_at = datetime.now(PKT)
+        db.session.add(transaction)
+
+        if isinstance(transaction, CustomerTransaction) and transaction.transaction_type == 'payment':
+            RollupController.record_receipt(transaction.created_at, transaction.amount)
+
+        if isinstance(transaction, CustomerTransaction):
+            account, account_id, increasing = Customer, transaction.customer_id, 'receivable'
+        else:
+            account, account_id, increasing = Distributor, transaction.distributor_id, 'payable'
+
+        if not account_id:
+            return transaction
+
+        amount = _to_decimal(transaction.amount)
+        if transaction.transaction_type == increasing:
+            delta = amount
+        elif transaction.transaction_type == 'payment':
+            delta = -amount
+        else:
+            return transaction
+
+        db.session.execute(
+            update(account)
+            .where(account.id == account_id)
+            .values(balance=account.balance + delta)
+        )
+        return transaction
+
+    @staticmethod
+    def ledger_balances(kind):
+        """Recompute {account_id: balance} for one ledger with a single grouped query."""
+        _, ledger, foreign_key, increasing = LEDGERS[kind]
+        signed = case(
+            (ledger.transaction_type == increasing, ledger.amount),
+            (ledger.transaction_type == 'payment', -ledger.amount),
+            else_=0)
+        rows = db.session.query(foreign_key, func.sum(signed))\
+            .filter(foreign_key.isnot(None))\
+            .group_by(foreign_key).all()
+        return {account_id: _to_decimal(total) for account_id, total in rows}
+
+    @staticmethod
+    def reconcile(fix=True):
+        """Compare stored balances with the ledgers and optionally correct any drift.
+
+        Returns a list of dicts describing every account whose stored balance
+        did not match its ledger.
+        """
+        drift = []
+        for kind, (account, _, _, _) in LEDGERS.items():
+            expected = BalanceController.ledger_balances(kind)
+            for account_id, name, stored in db.session.query(account.id, account.name, account.balance):
+                stored = _to_decimal(stored)
+                actual = expected.get(account_id, Decimal('0'))
+                if abs(actual - stored) >= Decimal('0.01'):
+                    drift.append({
+                        'kind': kind,
+                        'id': account_id,
+                        'name': name,
+                        'stored': float(stored),
+                        'ledger': float(actual),
+                    })
+                    if fix:
+                        db.session.execute(
+                            update(account).where(account.id == account_id).values(balance=actual)
+                        )
+        if fix:
+            db.session.commit()
+        return drift
@@ -1,17 +1,84 @@
-from models import Customer, CustomerTransaction, CashTransaction, Order, OrderItem, Product, PKT
+import io
+import csv
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from models import (Customer, CustomerTransaction, CashTransaction, Order, OrderItem, Product, Distributor,
+                    SupplierTransaction, PKT, normalize_phone)
 from extensions import db
 from flask_login import current_user
-from sqlalchemy import func, extract
+from controllers.balance_controller import BalanceController
+from controllers.running_balance_controller import RunningBalanceController
+from controllers.allocation_controller import AllocationController
+from controllers.period_controller import PeriodController
+from sqlalchemy import func, extract, tuple_
+from utils import keyset_page
+
+DEPOSIT_DATE_FORMATS = ('%Y-%m-%d', '%Y-%m-%d %H:%M', '%d/%m/%Y')
+
+
+def _parse_deposit_date(value):
+    for fmt in DEPOSIT_DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def _prefix_filter(column, prefix):
+    """`column` starts with `prefix`, as a range so an index on `column` can serve it."""
+    return (column >= prefix) & (column < prefix[:-1] + chr(ord(prefix[-1]) + 1))
 
 class CustomerController:
     @staticmethod
-    def get_all_customers():
-        return Customer.query.order_by(Customer.created_at.desc()).all()
+    def get_all_customers(cursor=None):
+        """One page of customers, newest first. Returns (customers, next_cursor)."""
+        return keyset_page(Customer.query, Customer.created_at, Customer.id, cursor)
+
+    @staticmethod
+    def search_customers(term, cursor=None, per_page=20):
+        """Customers whose name, or phone number, starts with `term`.
+
+        Digits-only terms match the normalized phone and list in phone order;
+        anything else matches the lower-cased name and lists in name order, so
+        either way the page is one index range scan. Returns (customers, next_cursor).
+        """
+        term = (term or '').strip()
+        sort_key = func.lower(Customer.name)
+        query = Customer.query
+        if term and not any(ch.isalpha() for ch in term) and sum(ch.isdigit() for ch in term) >= 3:
+            digits = ''.join(ch for ch in term if ch.isdigit())
+            for prefix in ('0092', '92'):
+                if digits.startswith(prefix):
+                    digits = '0' + digits[len(prefix):]
+                    break
+            sort_key = Customer.phone_normalized
+            query = query.filter(_prefix_filter(sort_key, digits))
+        elif term:
+            query = query.filter(_prefix_filter(sort_key, term.lower()))
+
+        if str(cursor or '').isdigit():
+            # The cursor is the last customer's id; its sort key is read back with the same expression
+            after_key = db.session.query(sort_key).filter(Customer.id == int(cursor)).scalar()
+            if after_key is not None:
+                query = query.filter(tuple_(sort_key, Customer.id) > tuple_(after_key, int(cursor)))
+
+        customers = query.order_by(sort_key, Customer.id).limit(per_page + 1).all()
+        next_cursor = None
+        if len(customers) > per_page:
+            customers = customers[:per_page]
+            next_cursor = str(customers[-1].id)
+        return customers, next_cursor
 
     @staticmethod
     def get_customer(customer_id):
         return db.session.get(Customer, customer_id)
 
+    @staticmethod
+    def get_transactions_page(customer_id, cursor=None):
+        """One newest-first page of the customer's ledger with running balances. Returns (rows, next_cursor)."""
+        return RunningBalanceController.account_page('customer', customer_id, cursor)
+
     @staticmethod
     def create_customer(data):
         name = data.get('name')
@@ -47,10 +114,10 @@ class CustomerController:
         if not customer:
             return None
 
-        # Total purchases
-        total_purchases = db.session.query(func.sum(Order.total_amount))\
-            .filter(Order.customer_id == customer_id, Order.status == 'approved').scalar() or 0
-        total_orders = Order.query.filter_by(customer_id=customer_id, status='approved').count()
+        # Total purchases and order count in one pass over the customer's orders
+        total_purchases, total_orders = db.session.query(
+            func.coalesce(func.sum(Order.total_amount), 0), func.count(Order.id)
+        ).filter(Order.customer_id == customer_id, Order.status == 'approved').one()
 
         # Yearly breakdown
         yearly = db.session.query(
@@ -81,75 +148,163 @@ class CustomerController:
         }
 
     @staticmethod
-    def apply_account_payment(customer_id, amount, payment_method, notes, payment_destination='business', supplier_id=None):
-        customer = db.session.get(Customer, customer_id)
-        if not customer:
-            return False, "Customer not found", None
-            
-        try:
-            amount = float(amount)
-            if amount <= 0:
-                return False, "Amount must be greater than zero", None
-        except ValueError:
-            return False, "Invalid amount", None
-            
+    def record_payment(customer, amount, payment_method, notes, user_id, created_at=None,
+                       reference="Account Payment (FIFO)", to_supplier=None):
+        """Post a customer payment, book the money in, and allocate it to the oldest open invoices.
+
+        Money paid straight to a supplier (`to_supplier`) settles that supplier's
+        account, and its oldest open purchase orders, instead of going into the
+        cash book. Nothing is committed.
+        Returns (transaction, amount allocated, invoices touched).
+        """
         transaction = CustomerTransaction(
             customer_id=customer.id,
             transaction_type='payment',
             amount=amount,
             payment_method=payment_method,
-            reference="Account Payment (FIFO)",
+            reference=reference,
             notes=notes,
-            created_by=current_user.id
+            created_by=user_id,
+            created_at=created_at
         )
-        db.session.add(transaction)
-        
-        from models import Distributor, SupplierTransaction
-        if payment_destination == 'supplier':
-            if not supplier_id:
-                return False, "Supplier must be selected for third-party payment", None
-            supplier = db.session.get(Distributor, supplier_id)
-            if not supplier:
-                return False, "Supplier not found", None
-                
-            supplier_tx = SupplierTransaction(
-                distributor_id=supplier.id,
+        if to_supplier is not None:
+            transaction.reference = f"Third-Party Payment to {to_supplier.name}"
+            transaction.notes = f"Paid directly to supplier {to_supplier.name}. {notes or ''}"
+            supplier_transaction = BalanceController.post(SupplierTransaction(
+                distributor_id=to_supplier.id,
                 transaction_type='payment',
                 amount=amount,
                 payment_method=payment_method,
                 reference=f"Third-Party Payment from Customer {customer.name}",
                 notes=f"Customer settled account directly to supplier. Note: {notes}",
-                created_by=current_user.id
-            )
-            db.session.add(supplier_tx)
-            transaction.reference = f"Third-Party Payment to {supplier.name}"
-            transaction.notes = f"Paid directly to supplier {supplier.name}. {notes or ''}"
+                created_by=user_id,
+                created_at=created_at
+            ))
         else:
-            cash_tx = CashTransaction(
+            db.session.add(CashTransaction(
                 transaction_type='in',
                 amount=amount,
                 source='customer_payment',
                 description=f"Account Payment from {customer.name}",
-                created_by=current_user.id
-            )
-            db.session.add(cash_tx)
-        
-        unpaid_orders = [o for o in customer.orders if o.status == 'approved' and float(o.total_amount) > float(o.amount_paid)]
-        unpaid_orders.sort(key=lambda x: x.created_at)
-        
-        remaining_payment = amount
-        for order in unpaid_orders:
-            if remaining_payment <= 0:
-                break
-                
-            due_on_order = float(order.total_amount) - float(order.amount_paid)
-            if remaining_payment >= due_on_order:
-                order.amount_paid = float(order.amount_paid) + due_on_order
-                remaining_payment -= due_on_order
+                created_by=user_id,
+                created_at=created_at
+            ))
+        BalanceController.post(transaction)
+        db.session.flush()
+        if to_supplier is not None:
+            AllocationController.allocate(supplier_transaction)
+        allocated, invoices = AllocationController.allocate(transaction)
+        return transaction, allocated, invoices
+
+    @staticmethod
+    def apply_account_payment(customer_id, amount, payment_method, notes, payment_destination='business', supplier_id=None):
+        customer = db.session.get(Customer, customer_id)
+        if not customer:
+            return False, "Customer not found", None
+            
+        try:
+            amount = Decimal(str(amount)).quantize(Decimal('0.01'))
+            if amount <= 0:
+                return False, "Amount must be greater than zero", None
+        except (InvalidOperation, TypeError):
+            return False, "Invalid amount", None
+
+        supplier = None
+        if payment_destination == 'supplier':
+            if not supplier_id:
+                return False, "Supplier must be selected for third-party payment", None
+            supplier = db.session.get(Distributor, supplier_id)
+            if not supplier:
+                return False, "Supplier not found", None
+
+        transaction, allocated, invoices = CustomerController.record_payment(
+            customer, amount, payment_method, notes, current_user.id, to_supplier=supplier)
+        db.session.commit()
+        return True, f"Payment applied successfully to {invoices} invoice(s)", transaction.id
+
+    @staticmethod
+    def read_deposit_file(stream):
+        """Parse a bank deposit CSV into ([row dicts], [errors]).
+
+        Columns (header names, any order): amount, and customer_id or phone;
+        optional date (YYYY-MM-DD, YYYY-MM-DD HH:MM or DD/MM/YYYY) and reference.
+        Customers are looked up with one query per column, not one per row.
+        """
+        text = stream.read()
+        if isinstance(text, bytes):
+            text = text.decode('utf-8-sig', errors='replace')
+        reader = csv.DictReader(io.StringIO(text))
+        reader.fieldnames = [(name or '').strip().lower() for name in reader.fieldnames or []]
+        if 'amount' not in reader.fieldnames or not {'customer_id', 'phone'} & set(reader.fieldnames):
+            return [], ["The file needs an 'amount' column and a 'customer_id' or 'phone' column."]
+
+        rows, errors, closed_months = [], [], {}
+        for line, raw in enumerate(reader, start=2):
+            raw = {key: (value or '').strip() for key, value in raw.items() if key}
+            try:
+                amount = Decimal(raw['amount'].replace(',', '')).quantize(Decimal('0.01'))
+            except InvalidOperation:
+                errors.append(f"Line {line}: invalid amount '{raw['amount']}'")
+                continue
+            if not amount.is_finite() or amount <= 0:
+                errors.append(f"Line {line}: amount must be greater than zero")
+                continue
+            created_at = None
+            if raw.get('date'):
+                created_at = _parse_deposit_date(raw['date'])
+                if created_at is None:
+                    errors.append(f"Line {line}: invalid date '{raw['date']}'")
+                    continue
+                month = (created_at.year, created_at.month)
+                if month not in closed_months:
+                    closed_months[month] = PeriodController.closed_period(created_at) is not None
+                if closed_months[month]:
+                    errors.append(f"Line {line}: {created_at:%B %Y} is closed")
+                    continue
+            rows.append({'line': line, 'customer_id': raw.get('customer_id'), 'phone': normalize_phone(raw.get('phone')),
+                         'amount': amount, 'created_at': created_at, 'reference': raw.get('reference') or None})
+
+        ids = {int(r['customer_id']) for r in rows if (r['customer_id'] or '').isdigit()}
+        phones = {r['phone'] for r in rows if r['phone'] and not r['customer_id']}
+        by_id = {c.id: c for c in Customer.query.filter(Customer.id.in_(ids))} if ids else {}
+        by_phone = {}
+        if phones:
+            for customer in Customer.query.filter(Customer.phone_normalized.in_(phones)).order_by(Customer.id):
+                by_phone.setdefault(customer.phone_normalized, []).append(customer)
+        for row in rows:
+            if row['customer_id']:
+                row['customer'] = by_id.get(int(row['customer_id'])) if row['customer_id'].isdigit() else None
             else:
-                order.amount_paid = float(order.amount_paid) + remaining_payment
-                remaining_payment = 0
-                
+                matches = by_phone.get(row['phone'], [])
+                row['customer'] = matches[0] if len(matches) == 1 else None
+                if len(matches) > 1:
+                    errors.append(f"Line {row['line']}: phone {row['phone']} matches {len(matches)} customers")
+                    continue
+            if row['customer'] is None:
+                errors.append(f"Line {row['line']}: no customer {row['customer_id'] or row['phone'] or '(blank)'}")
+        return rows, errors
+
+    @staticmethod
+    def import_deposits(stream, user_id):
+        """Apply every payment in a bank deposit file in one transaction; nothing is applied if any line is bad."""
+        rows, errors = CustomerController.read_deposit_file(stream)
+        if errors:
+            shown = '; '.join(errors[:10])
+            more = f" (and {len(errors) - 10} more)" if len(errors) > 10 else ''
+            return False, f"Nothing imported. {shown}{more}"
+        if not rows:
+            return False, "The file has no deposits."
+
+        total = allocated = Decimal('0')
+        invoices = 0
+        for row in rows:
+            _, applied, touched = CustomerController.record_payment(
+                row['customer'], row['amount'], 'bank_transfer', 'Imported bank deposit', user_id,
+                created_at=row['created_at'], reference=row['reference'] or "Bank Deposit (FIFO)")
+            total += row['amount']
+            allocated += applied
+            invoices += touched
         db.session.commit()
-        return True, "Payment applied successfully", transaction.id
+        return True, (f"Imported {len(rows)} deposit(s) totalling Rs. {total:,.2f}; "
+                      f"Rs. {allocated:,.2f} settled {invoices} invoice(s).")
 
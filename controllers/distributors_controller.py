@@ -1,12 +1,20 @@
-from models import Distributor, Product, PurchaseOrder, SupplierTransaction
+from models import Distributor, Product, PurchaseOrder
 from extensions import db
+from sqlalchemy import func
 from sqlalchemy.exc import IntegrityError
+from controllers.running_balance_controller import RunningBalanceController
 
 class DistributorsController:
     @staticmethod
     def get_all_distributors():
         return Distributor.query.all()
 
+    @staticmethod
+    def get_product_counts():
+        """{distributor_id: number of products} in one grouped query, for the distributor list."""
+        return dict(db.session.query(Product.distributor_id, func.count(Product.id))
+                    .filter(Product.distributor_id.isnot(None)).group_by(Product.distributor_id))
+
     @staticmethod
     def add_distributor(data):
         distributor = Distributor(
@@ -22,16 +30,18 @@ class DistributorsController:
         return True, "Distributor added successfully!"
 
     @staticmethod
-    def get_distributor_details(distributor_id):
+    def get_distributor_details(distributor_id, transactions_cursor=None):
+        """Distributor with products, POs and one page of its ledger (with running balances)."""
         distributor = db.session.get(Distributor, distributor_id)
         if not distributor:
-            return False, "Distributor not found.", None, None, None, None
+            return False, "Distributor not found.", None, None, None, None, None
             
         products = Product.query.filter_by(distributor_id=distributor_id).all()
         purchase_orders = PurchaseOrder.query.filter_by(distributor_id=distributor_id).order_by(PurchaseOrder.created_at.desc()).all()
-        transactions = SupplierTransaction.query.filter_by(distributor_id=distributor_id).order_by(SupplierTransaction.created_at.desc()).limit(20).all()
+        transactions, next_cursor = RunningBalanceController.account_page(
+            'supplier', distributor_id, transactions_cursor, per_page=20)
         
-        return True, "Success", distributor, products, purchase_orders, transactions
+        return True, "Success", distributor, products, purchase_orders, transactions, next_cursor
 
     @staticmethod
     def edit_distributor(distributor_id, data):
@@ -2,13 +2,18 @@ from models import Expense, CashTransaction
 from extensions import db
 from datetime import datetime
 from flask_login import current_user
+from controllers.rollup_controller import RollupController
+from controllers.period_controller import PeriodController
+from utils import keyset_page
+from sqlalchemy import func
 
 class ExpensesController:
     @staticmethod
-    def get_all_expenses():
-        expenses = Expense.query.order_by(Expense.expense_date.desc()).all()
-        total_expenses = sum(e.amount for e in expenses)
-        return expenses, total_expenses
+    def get_all_expenses(cursor=None):
+        """One page of expenses, newest first. Returns (expenses, total of all expenses, next_cursor)."""
+        expenses, next_cursor = keyset_page(Expense.query, Expense.expense_date, Expense.id, cursor)
+        total_expenses = db.session.query(func.sum(Expense.amount)).scalar() or 0
+        return expenses, total_expenses, next_cursor
 
     @staticmethod
     def add_expense(data, current_user_id):
@@ -34,6 +39,7 @@ class ExpensesController:
         )
         db.session.add(expense)
         db.session.flush()
+        RollupController.record_expense(expense.expense_date, amount_val)
         
         # Add to Cash Book
         cash_tx = CashTransaction(
@@ -59,6 +65,8 @@ class ExpensesController:
         expense = db.session.get(Expense, expense_id)
         if not expense:
             return False, "Expense not found"
+        if PeriodController.closed_period(expense.expense_date):
+            return False, "This expense is in a closed month. Add an adjustment in the current month instead."
             
         category = data.get('category')
         amount = data.get('amount')
@@ -84,6 +92,7 @@ class ExpensesController:
                 created_by=current_user.id
             )
             db.session.add(cash_tx)
+            RollupController.record_expense(expense.expense_date, diff)
              
         expense.category = category
         expense.amount = amount_val
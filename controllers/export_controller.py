@@ -0,0 +1,184 @@
+import io
+import csv
+import tempfile
+from decimal import Decimal
+from sqlalchemy import select, func
+from models import (Order, OrderItem, Product, Customer, User, StockMovement, CashTransaction)
+from extensions import db
+from controllers.analytics_controller import AnalyticsController
+from controllers.running_balance_controller import RunningBalanceController
+from utils import period_bounds, filter_period
+
+# Rows fetched from the database cursor per round trip
+BATCH_SIZE = 1000
+# Bytes per chunk sent to the client
+CHUNK_SIZE = 64 * 1024
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+def _stream(stmt):
+    """Execute `stmt` and iterate its rows BATCH_SIZE at a time instead of loading them all."""
+    return db.session.execute(stmt, execution_options={'yield_per': BATCH_SIZE})
+
+
+class ExportController:
+    """Row-level CSV/XLSX exports that stream in constant memory.
+
+    Each dataset is a (title, headers, rows) triple where `rows` is a
+    generator over a server-side cursor; the writers turn it into chunks for a
+    streaming Response, so a download starts before the query finishes.
+    """
+
+    @staticmethod
+    def get_dataset(name, filters):
+        """(title, headers, rows) for an export, filtered like its page. None for an unknown name."""
+        builders = {
+            'sales': ExportController._sales,
+            'order-items': ExportController._order_items,
+            'stock-movements': ExportController._stock_movements,
+            'cashbook': ExportController._cashbook,
+            'ledger': ExportController._ledger,
+        }
+        builder = builders.get(name)
+        return builder(filters) if builder else None
+
+    @staticmethod
+    def _order_filters(stmt, filters):
+        if filters.get('type', 'all') != 'all':
+            stmt = stmt.where(Order.order_type == filters['type'])
+        if filters.get('status'):
+            stmt = stmt.where(Order.status == filters['status'])
+        start, end = period_bounds(start_date=filters.get('start_date'), end_date=filters.get('end_date'))
+        return filter_period(stmt, Order.created_at, start, end)
+
+    @staticmethod
+    def _sales(filters):
+        headers = ['Order #', 'Date', 'Customer', 'Type', 'Status', 'Total', 'Paid', 'Remaining', 'Profit',
+                   'Created By']
+        stmt = select(Order.id, Order.created_at, func.coalesce(Customer.name, Order.customer_name),
+                      Order.order_type, Order.status, Order.total_amount, Order.amount_paid,
+                      Order.total_amount - Order.amount_paid, Order.total_profit, User.username)\
+            .outerjoin(Customer, Customer.id == Order.customer_id)\
+            .outerjoin(User, User.id == Order.created_by)
+        stmt = ExportController._order_filters(stmt, filters).order_by(Order.created_at, Order.id)
+        return 'Sales history', headers, (tuple(row) for row in _stream(stmt))
+
+    @staticmethod
+    def _order_items(filters):
+        headers = ['Order #', 'Date', 'Customer', 'Type', 'Status', 'SKU', 'Product', 'Quantity', 'Unit Price',
+                   'Line Total']
+        stmt = select(Order.id, Order.created_at, func.coalesce(Customer.name, Order.customer_name),
+                      Order.order_type, Order.status, Product.sku, Product.name, OrderItem.quantity,
+                      OrderItem.price, OrderItem.quantity * OrderItem.price)\
+            .select_from(Order)\
+            .join(OrderItem, OrderItem.order_id == Order.id)\
+            .join(Product, Product.id == OrderItem.product_id)\
+            .outerjoin(Customer, Customer.id == Order.customer_id)
+        stmt = ExportController._order_filters(stmt, filters).order_by(Order.created_at, Order.id, OrderItem.id)
+        return 'Order items', headers, (tuple(row) for row in _stream(stmt))
+
+    @staticmethod
+    def _stock_movements(filters):
+        headers = ['Date', 'SKU', 'Product', 'Movement', 'Reference #', 'Change', 'Before', 'After', 'User']
+        stmt = select(StockMovement.timestamp, Product.sku, Product.name, StockMovement.reference_type,
+                      StockMovement.reference_id, StockMovement.quantity_change, StockMovement.quantity_before,
+                      StockMovement.quantity_after, User.username)\
+            .join(Product, Product.id == StockMovement.product_id)\
+            .outerjoin(User, User.id == StockMovement.user_id)
+        search = (filters.get('search') or '').strip()
+        if search:
+            like = f'%{search}%'
+            stmt = stmt.where(db.or_(Product.name.ilike(like), Product.sku.ilike(like), Product.brand.ilike(like)))
+        if filters.get('movement_type'):
+            stmt = stmt.where(StockMovement.reference_type == filters['movement_type'])
+        start, end = period_bounds(start_date=filters.get('start_date'), end_date=filters.get('end_date'))
+        stmt = filter_period(stmt, StockMovement.timestamp, start, end)\
+            .order_by(StockMovement.timestamp, StockMovement.id)
+        return 'Stock movements', headers, (tuple(row) for row in _stream(stmt))
+
+    @staticmethod
+    def _cashbook(filters):
+        headers = ['Date', 'Type', 'Source', 'Description', 'In', 'Out', 'Running Balance', 'User']
+        transaction_type = filters.get('type', 'all')
+        stmt = select(CashTransaction.created_at, CashTransaction.transaction_type, CashTransaction.source,
+                      CashTransaction.description, CashTransaction.amount, User.username)\
+            .outerjoin(User, User.id == CashTransaction.created_by)
+        if transaction_type != 'all':
+            stmt = stmt.where(CashTransaction.transaction_type == transaction_type)
+        start, end = period_bounds(start_date=filters.get('start_date'), end_date=filters.get('end_date'))
+        stmt = filter_period(stmt, CashTransaction.created_at, start, end)\
+            .order_by(CashTransaction.created_at, CashTransaction.id)
+
+        def rows():
+            balance = Decimal('0')
+            if start is not None:
+                balance = RunningBalanceController.balance_before(
+                    'cash', start, transaction_type=None if transaction_type == 'all' else transaction_type)
+            for created_at, kind, source, description, amount, username in _stream(stmt):
+                amount = Decimal(str(amount or 0))
+                balance += amount if kind == 'in' else -amount
+                yield (created_at, kind, source, description, amount if kind == 'in' else None,
+                       amount if kind != 'in' else None, balance, username)
+
+        return 'Cash book', headers, rows()
+
+    @staticmethod
+    def _ledger(filters):
+        headers = ['Date', 'Ledger', 'Account', 'Type', 'Amount', 'Payment Method', 'Reference', 'Notes',
+                   'Order #', 'PO #', 'Running Balance']
+        entries = AnalyticsController.iter_ledger_entries(
+            filters.get('type', 'all'), filters.get('start_date'), filters.get('end_date'), batch_size=BATCH_SIZE)
+        rows = ((e['created_at'], e['ledger'], e['entity'], e['transaction_type'], e['amount'],
+                 e['payment_method'], e['reference'], e['notes'], e['order_id'], e['purchase_order_id'],
+                 e['running_balance']) for e in entries)
+        return 'Ledger', headers, rows
+
+    @staticmethod
+    def iter_csv(headers, rows):
+        """CSV text chunks; the header goes out before the first row is read."""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        buffer.write('\ufeff')  # lets Excel detect UTF-8
+        writer.writerow(headers)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+        for row in rows:
+            writer.writerow(row)
+            if buffer.tell() >= CHUNK_SIZE:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+
+    @staticmethod
+    def iter_xlsx(title, headers, rows):
+        """XLSX byte chunks from an openpyxl write-only workbook.
+
+        Write-only sheets spool rows to a temporary file instead of keeping
+        cell objects, and the finished zip is read back from disk in chunks.
+        """
+        from openpyxl import Workbook
+        from openpyxl.cell import WriteOnlyCell
+        from openpyxl.styles import Font
+
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet(title[:31])
+        header_font = Font(bold=True)
+        header_cells = []
+        for label in headers:
+            cell = WriteOnlyCell(ws, value=label)
+            cell.font = header_font
+            header_cells.append(cell)
+        ws.append(header_cells)
+        for row in rows:
+            ws.append(row)
+
+        with tempfile.TemporaryFile() as output:
+            wb.save(output)
+            output.seek(0)
+            while chunk := output.read(CHUNK_SIZE):
+                yield chunk
@@ -0,0 +1,105 @@
+from sqlalchemy import update, select, case, func
+from sqlalchemy.orm.attributes import set_committed_value
+from models import Product
+from extensions import db
+
+
+def _sync(rows, *names):
+    """Copy values the database just wrote onto any Product already loaded in the session."""
+    for product_id, *values in rows:
+        product = db.session.identity_map.get(db.session.identity_key(Product, product_id))
+        if product is not None:
+            for name, value in zip(names, values):
+                set_committed_value(product, name, value)
+
+
+def _execute(stmt, ids, *columns):
+    """Run a guarded UPDATE and return [(id, *columns)] for the rows it changed."""
+    stmt = stmt.execution_options(synchronize_session=False)
+    if db.session.get_bind().dialect.update_returning:
+        return [tuple(row) for row in db.session.execute(stmt.returning(Product.id, *columns))]
+
+    # No RETURNING: the rows we just changed are read back inside the same transaction.
+    # A partial update cannot say which rows it skipped, so it reports none.
+    if db.session.execute(stmt).rowcount != len(ids):
+        return []
+    return [tuple(row) for row in db.session.execute(select(Product.id, *columns).where(Product.id.in_(ids)))]
+
+
+class InventoryController:
+    """Stock changes as single conditional UPDATE statements.
+
+    The database applies each change relative to the value it currently holds,
+    so concurrent sales, receipts and returns cannot overwrite each other and a
+    decrement can never take stock below zero. Each helper returns
+    {product_id: (quantity_before, quantity_after)} for the StockMovement rows.
+    Call them inside the caller's transaction.
+    """
+
+    @staticmethod
+    def take(quantities):
+        """Remove {product_id: quantity} from stock, all or nothing.
+
+        Returns (changes, short_ids). When short_ids is non-empty those products
+        lacked the stock; other rows may already have been decremented, so the
+        caller must roll back.
+        """
+        quantities = {pid: qty for pid, qty in quantities.items() if qty}
+        if not quantities:
+            return {}, []
+        ids = sorted(quantities)
+        qty = case(quantities, value=Product.id)
+        stock = func.coalesce(Product.stock_quantity, 0)
+        stmt = update(Product)\
+            .where(Product.id.in_(ids), stock >= qty)\
+            .values(stock_quantity=stock - qty)
+        rows = _execute(stmt, ids, Product.stock_quantity)
+        if len(rows) != len(ids):
+            updated = {pid for pid, _ in rows}
+            return {}, [pid for pid in ids if pid not in updated]
+        _sync(rows, 'stock_quantity')
+        return {pid: (after + quantities[pid], after) for pid, after in rows}, []
+
+    @staticmethod
+    def put(quantities, costs=None):
+        """Add {product_id: quantity} to stock.
+
+        `costs` optionally maps product_id to the total cost of the added units;
+        the product's cost price is then re-averaged (weighted average cost)
+        against the stock on hand in the same statement.
+        """
+        quantities = {pid: qty for pid, qty in quantities.items() if qty}
+        if not quantities:
+            return {}
+        ids = sorted(quantities)
+        qty = case(quantities, value=Product.id)
+        stock = func.coalesce(Product.stock_quantity, 0)
+        values = {'stock_quantity': stock + qty}
+        columns = [Product.stock_quantity]
+        if costs:
+            added_cost = case({pid: float(costs[pid]) for pid in ids}, value=Product.id)
+            unit_cost = case({pid: float(costs[pid]) / quantities[pid] for pid in ids}, value=Product.id)
+            on_hand_value = stock * func.coalesce(Product.cost_price, 0) * 1.0
+            values['cost_price'] = case(
+                (stock + qty > 0, (on_hand_value + added_cost) / (stock + qty)),
+                else_=unit_cost)
+            columns.append(Product.cost_price)
+
+        rows = _execute(update(Product).where(Product.id.in_(ids)).values(**values), ids, *columns)
+        _sync(rows, 'stock_quantity', 'cost_price')
+        return {pid: (after - quantities[pid], after) for pid, after, *_ in rows}
+
+    @staticmethod
+    def set_count(product_id, expected, new_quantity):
+        """Overwrite stock with a counted quantity, only if it still equals `expected`.
+
+        Returns (before, after), or None when the stock changed since it was read.
+        """
+        stmt = update(Product)\
+            .where(Product.id == product_id, func.coalesce(Product.stock_quantity, 0) == expected)\
+            .values(stock_quantity=new_quantity)
+        rows = _execute(stmt, [product_id], Product.stock_quantity)
+        if not rows:
+            return None
+        _sync(rows, 'stock_quantity')
+        return expected, rows[0][1]
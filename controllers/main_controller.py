@@ -1,7 +1,6 @@
-from sqlalchemy import func, extract
-from extensions import db
-from models import (Order, PurchaseOrder, Product, Customer,
-                     CustomerTransaction, EmployeePayment, Expense, PKT)
+from models import Order, PurchaseOrder, Product, PKT
+from controllers.aggregation_controller import AggregationController
+from controllers.analytics_controller import AnalyticsController
 from datetime import datetime, timedelta
 
 
@@ -16,67 +15,28 @@ class MainController:
         pending_orders = Order.query.filter_by(status='draft').count()
 
         # ── Financial summary for current month ──
-        sales_q = Order.query.filter(
-            Order.status == 'approved',
-            extract('year', Order.created_at) == year,
-            extract('month', Order.created_at) == month)
-
-        revenue = float(sales_q.with_entities(func.sum(Order.total_amount)).scalar() or 0)
-
-        cash_sales = float(
-            sales_q.filter(Order.order_type == 'sale')
-            .with_entities(func.sum(Order.total_amount)).scalar() or 0)
-        credit_sales = float(
-            sales_q.filter(Order.order_type == 'credit_sale')
-            .with_entities(func.sum(Order.total_amount)).scalar() or 0)
-            
-        returns_q = sales_q.filter(Order.order_type == 'return')
-        total_returns_amount = float(returns_q.with_entities(func.sum(func.abs(Order.total_amount))).scalar() or 0)
-        total_returns_count = returns_q.count()
-            
-        total_orders_month = sales_q.filter(Order.order_type != 'return').count()
-
-        purchases = float(
-            PurchaseOrder.query.filter(
-                PurchaseOrder.status == 'received',
-                extract('year', PurchaseOrder.created_at) == year,
-                extract('month', PurchaseOrder.created_at) == month
-            ).with_entities(func.sum(PurchaseOrder.total_amount)).scalar() or 0)
-
-        expenses = float(
-            Expense.query.filter(
-                extract('year', Expense.expense_date) == year,
-                extract('month', Expense.expense_date) == month
-            ).with_entities(func.sum(Expense.amount)).scalar() or 0)
-
-        staff_expenses = float(
-            EmployeePayment.query.filter(
-                extract('year', EmployeePayment.date) == year,
-                extract('month', EmployeePayment.date) == month
-            ).with_entities(func.sum(EmployeePayment.amount)).scalar() or 0)
-
-        gross_profit = float(sales_q.with_entities(func.sum(Order.total_profit)).scalar() or 0)
-        net_profit = gross_profit - expenses - staff_expenses
+        totals = AggregationController.get_month_totals(year, month)
 
-        # Receipts collected this month
-        receipts = float(
-            CustomerTransaction.query.filter(
-                CustomerTransaction.transaction_type == 'payment',
-                extract('year', CustomerTransaction.created_at) == year,
-                extract('month', CustomerTransaction.created_at) == month
-            ).with_entities(func.sum(CustomerTransaction.amount)).scalar() or 0)
+        revenue = totals['total_revenue']
+        cash_sales = totals['cash_revenue']
+        credit_sales = totals['credit_revenue']
+        total_returns_amount = totals['total_returns_amount']
+        total_returns_count = totals['total_returns_count']
+        total_orders_month = totals['total_orders'] - total_returns_count
 
-        outstanding_credit = credit_sales - receipts
+        purchases = totals['total_purchases']
+        expenses = totals['total_expenses']
+        staff_expenses = totals['total_staff_expenses']
+        net_profit = totals['net_profit']
 
-        # ── All-time balances ──
-        total_receivables = float(
-            db.session.query(func.sum(Order.total_amount - Order.amount_paid))
-            .filter(Order.status == 'approved',
-                    Order.total_amount > Order.amount_paid).scalar() or 0)
+        # Receipts collected this month
+        receipts = totals['total_receipts']
+        outstanding_credit = totals['outstanding_credit']
 
-        total_payables = float(
-            db.session.query(func.sum(PurchaseOrder.total_amount - PurchaseOrder.amount_paid))
-            .filter(PurchaseOrder.payment_status != 'paid').scalar() or 0)
+        # ── All-time balances ──
+        outstanding = AnalyticsController.get_outstanding_totals()
+        total_receivables = outstanding['total_receivables']
+        total_payables = outstanding['total_payables']
 
         # ── Alerts ──
         low_stock_products = Product.query.filter(
@@ -92,9 +52,8 @@ class MainController:
         credit_reminders = MainController.get_credit_due_reminders()
 
         unpaid_supplier_invoices = PurchaseOrder.query.filter(
-            PurchaseOrder.payment_status != 'paid',
-            PurchaseOrder.status == 'received',
-            PurchaseOrder.total_amount > PurchaseOrder.amount_paid
+            PurchaseOrder.is_open == True,
+            PurchaseOrder.status == 'received'
         ).order_by(PurchaseOrder.created_at.desc()).limit(10).all()
 
         return {
@@ -139,16 +98,15 @@ class MainController:
         reminder_window = now + timedelta(days=7)
 
         overdue_orders = Order.query.filter(
+            Order.is_open == True,
             Order.order_type == 'credit_sale',
-            Order.status == 'approved',
-            Order.total_amount > Order.amount_paid,
             Order.due_date.isnot(None),
             Order.due_date <= reminder_window
         ).order_by(Order.due_date.asc()).limit(20).all()
 
         reminders = []
         for order in overdue_orders:
-            remaining = float(order.total_amount) - float(order.amount_paid)
+            remaining = float(order.balance_due)
             is_overdue = order.due_date.replace(tzinfo=None) < now.replace(tzinfo=None)
             reminders.append({
                 'order_id': order.id,
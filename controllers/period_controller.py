@@ -0,0 +1,140 @@
+import json
+from datetime import datetime
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from models import (PeriodClose, Order, PurchaseOrder, Expense, EmployeePayment, CashTransaction,
+                    CustomerTransaction, SupplierTransaction, StockMovement, PKT)
+from extensions import db
+from utils import period_bounds
+
+# model -> (date attribute, whether existing rows in a closed month are frozen too).
+# Orders and purchase orders keep moving after their month (approval, payments,
+# receiving), so only back-dated inserts and date changes are refused for them;
+# their report effects are posted to the open period instead (see posting_day).
+GUARDED = {
+    Order: ('created_at', False),
+    PurchaseOrder: ('created_at', False),
+    Expense: ('expense_date', True),
+    EmployeePayment: ('date', True),
+    CashTransaction: ('created_at', True),
+    CustomerTransaction: ('created_at', True),
+    SupplierTransaction: ('created_at', True),
+    StockMovement: ('timestamp', True),
+}
+
+
+class PeriodClosedError(ValueError):
+    """A write dated in a closed month."""
+
+
+def _naive(value):
+    if isinstance(value, datetime):
+        return value.astimezone(PKT).replace(tzinfo=None) if value.tzinfo else value
+    return datetime.combine(value, datetime.min.time())
+
+
+def _current_month_start():
+    return period_bounds(*datetime.now(PKT).timetuple()[:2])[0]
+
+
+class PeriodController:
+    """Closed months: their report figures are frozen and writes dated in them are refused.
+
+    Closing a month (ReportsController.close_month) stores a PeriodClose
+    snapshot of every report metric; reports for that month read the snapshot
+    instead of the rollups. The current month can never be closed, so writes
+    dated in it never look anything up.
+    """
+
+    @staticmethod
+    def closed_period(when):
+        """The PeriodClose covering `when` (a date or datetime), or None."""
+        if when is None:
+            return None
+        when = _naive(when)
+        if when >= _current_month_start():
+            return None
+        return PeriodClose.query.filter(PeriodClose.period_start <= when, PeriodClose.period_end > when).first()
+
+    @staticmethod
+    def get_close(year, month):
+        return PeriodClose.query.filter_by(period_start=period_bounds(year, month)[0]).first()
+
+    @staticmethod
+    def get_snapshot(year, month):
+        """The frozen report figures of a closed month, or None while it is open."""
+        close = PeriodController.get_close(year, month)
+        return json.loads(close.snapshot) if close else None
+
+    @staticmethod
+    def snapshots(start=None, end=None):
+        """{(year, month): snapshot} for the closed months lying wholly inside [start, end)."""
+        query = PeriodClose.query
+        if start is not None:
+            query = query.filter(PeriodClose.period_start >= start)
+        if end is not None:
+            query = query.filter(PeriodClose.period_end <= end)
+        return {(c.period_start.year, c.period_start.month): json.loads(c.snapshot) for c in query}
+
+    @staticmethod
+    def closed_ranges():
+        """[(first day, day after the last)] of every closed month, oldest first."""
+        return [(start.date(), end.date()) for start, end in
+                db.session.query(PeriodClose.period_start, PeriodClose.period_end).order_by(PeriodClose.period_start)]
+
+    @staticmethod
+    def posting_day(day):
+        """The day a report figure dated `day` is added to: `day` itself, or today when its month is closed."""
+        day = day or datetime.now(PKT)
+        if PeriodController.closed_period(day) is None:
+            return day
+        return datetime.now(PKT).date()
+
+    @staticmethod
+    def begin_close(year, month, user_id):
+        """Add the PeriodClose row for a month (snapshot still empty) and flush it.
+
+        Returns (close, None), or (None, reason) when the month cannot be
+        closed. On SQLite the flush takes the write lock, so no write can
+        slip in between the snapshot and the commit.
+        """
+        start, end = period_bounds(year, month)
+        if end > _current_month_start():
+            return None, "Only months that have ended can be closed."
+        if PeriodController.get_close(year, month):
+            return None, f"{start:%B %Y} is already closed."
+        close = PeriodClose(period_start=start, period_end=end, snapshot='{}', closed_by=user_id,
+                            closed_at=datetime.now(PKT).replace(tzinfo=None))
+        db.session.add(close)
+        db.session.flush()
+        return close, None
+
+
+@event.listens_for(Session, 'before_flush')
+def _refuse_closed_period_writes(session, flush_context, instances):
+    """Back-dated inserts, date changes into or out of a closed month, and edits of frozen rows."""
+    current = None
+    dates = []
+    for kind, objects in (('new', session.new), ('dirty', session.dirty), ('deleted', session.deleted)):
+        for obj in objects:
+            guarded = GUARDED.get(type(obj))
+            if guarded is None:
+                continue
+            attribute, frozen = guarded
+            history = inspect(obj).attrs[attribute].history
+            if kind == 'dirty' and not (history.has_changes() or frozen and session.is_modified(obj)):
+                continue
+            current = current or _current_month_start()
+            # New rows default to now; nothing in the open month needs a lookup
+            dates += [d for d in [getattr(obj, attribute), *history.deleted]
+                      if d is not None and _naive(d) < current]
+    if not dates:
+        return
+
+    closes = session.query(PeriodClose.period_start, PeriodClose.period_end)\
+        .filter(PeriodClose.period_start <= max(_naive(d) for d in dates)).all()
+    for value in dates:
+        for start, end in closes:
+            if start <= _naive(value) < end:
+                raise PeriodClosedError(
+                    f"{start:%B %Y} is closed; record this as an adjustment in the current month instead.")
@@ -1,13 +1,81 @@
 from models import Product, Distributor, OrderItem, PurchaseOrderItem, PurchaseOrder, SupplierTransaction, StockMovement, CashTransaction, PKT
 from extensions import db
 from datetime import datetime
+import re
 from flask_login import current_user
+from sqlalchemy import inspect, or_, text
+from sqlalchemy.orm import joinedload
+from utils import keyset_page
+from controllers.balance_controller import BalanceController
+from controllers.rollup_controller import RollupController
+from controllers.inventory_controller import InventoryController
+
+# Column weights for bm25(): name, sku, part_number, brand, target_vehicle
+SEARCH_WEIGHTS = (10.0, 6.0, 6.0, 2.0, 1.0)
+_fts_available = {}
+
+
+def _has_product_fts():
+    """Whether the product_fts index (migration v0005) exists; checked once per engine."""
+    engine = db.engine
+    if engine not in _fts_available:
+        _fts_available[engine] = engine.dialect.name == 'sqlite' and inspect(engine).has_table('product_fts')
+    return _fts_available[engine]
+
 
 class ProductController:
     @staticmethod
     def get_all_products():
         return Product.query.filter_by(is_active=True).all()
 
+    @staticmethod
+    def get_products_page(cursor=None):
+        """Newest-first page of active products for the catalog: (products, next_cursor)."""
+        query = Product.query.options(joinedload(Product.distributor)).filter(Product.is_active.is_(True))
+        return keyset_page(query, Product.created_at, Product.id, cursor)
+
+    @staticmethod
+    def search_products(term, limit=20):
+        """Active products matching every word of `term` as a prefix, best match first."""
+        words = re.findall(r'\w+', (term or '').lower())
+        query = Product.query.options(joinedload(Product.distributor)).filter(Product.is_active.is_(True))
+        if not words:
+            return query.order_by(Product.name).limit(limit).all()
+
+        if not _has_product_fts():
+            columns = (Product.name, Product.sku, Product.part_number, Product.brand, Product.target_vehicle)
+            for word in words:
+                query = query.filter(or_(*(column.ilike(f'%{word}%') for column in columns)))
+            return query.order_by(Product.name).limit(limit).all()
+
+        weights = ', '.join(str(w) for w in SEARCH_WEIGHTS)
+        ids = db.session.execute(text(
+            'SELECT product_fts.rowid FROM product_fts JOIN product ON product.id = product_fts.rowid '
+            'WHERE product_fts MATCH :match AND product.is_active = 1 '
+            f'ORDER BY bm25(product_fts, {weights}) LIMIT :limit'
+        ), {'match': ' '.join(f'"{word}"*' for word in words), 'limit': limit}).scalars().all()
+        products = {p.id: p for p in query.filter(Product.id.in_(ids))} if ids else {}
+        return [products[pid] for pid in ids if pid in products]
+
+    @staticmethod
+    def search_payload(term, include_cost=False, limit=20):
+        """Compact JSON rows for the typeahead."""
+        results = []
+        for p in ProductController.search_products(term, limit):
+            row = {
+                'id': p.id,
+                'name': p.name,
+                'sku': p.sku,
+                'part_number': p.part_number,
+                'brand': p.brand,
+                'stock': p.stock_quantity or 0,
+                'price': float(p.selling_price or 0),
+            }
+            if include_cost:
+                row['cost'] = float(p.cost_price or 0)
+            results.append(row)
+        return results
+
     @staticmethod
     def get_all_distributors():
         return Distributor.query.all()
@@ -20,53 +88,61 @@ class ProductController:
         return None
 
     @staticmethod
-    def _handle_image_upload(product_name, files):
+    def _handle_image_upload(product, files):
+        """Point the product at an uploaded image's content-hashed name.
+
+        Nothing is written yet: returns the pending upload for _store_image once
+        the change is committed, so a save that fails leaves no file behind.
+        """
         if not files or 'image' not in files:
-            return
+            return None
             
         image_file = files.get('image')
         if not image_file or not image_file.filename:
-            return
+            return None
             
         import os
-        import glob
-        from flask import current_app
-        from werkzeug.utils import secure_filename
+        from utils import product_image_filename
         
         _, ext = os.path.splitext(image_file.filename)
-        base_name = f"{secure_filename(product_name)}_img"
-        filename = f"{base_name}{ext}"
-        
-        images_dir = os.path.join(current_app.static_folder, 'product_images')
-        os.makedirs(images_dir, exist_ok=True)
-        
-        pattern = os.path.join(images_dir, f"{base_name}.*")
-        for old_file in glob.glob(pattern):
-            try:
-                os.remove(old_file)
-            except OSError:
-                pass
-                
-        file_path = os.path.join(images_dir, filename)
-        image_file.save(file_path)
+        content = image_file.read()
+        filename = product_image_filename(product.name, content, ext)
+
+        previous = product.image_filename
+        product.image_filename = filename
+        return filename, content, previous
 
     @staticmethod
-    def _rename_product_image(old_name, new_name):
+    def _store_image(product, upload):
+        """Write a committed upload and remove the file it replaced.
+
+        If the file cannot be written the product goes back to its previous
+        image. Returns False in that case.
+        """
+        if upload is None:
+            return True
+
         import os
-        import glob
         from flask import current_app
-        from werkzeug.utils import secure_filename
-        
-        images_dir = os.path.join(current_app.static_folder, 'product_images')
-        old_base = f"{secure_filename(old_name)}_img"
-        new_base = f"{secure_filename(new_name)}_img"
-        
-        for old_file in glob.glob(os.path.join(images_dir, f"{old_base}.*")):
-            _, ext = os.path.splitext(old_file)
+        from utils import PRODUCT_IMAGE_DIR
+
+        filename, content, previous = upload
+        images_dir = os.path.join(current_app.static_folder, PRODUCT_IMAGE_DIR)
+        try:
+            os.makedirs(images_dir, exist_ok=True)
+            with open(os.path.join(images_dir, filename), 'wb') as f:
+                f.write(content)
+        except OSError:
+            product.image_filename = previous
+            db.session.commit()
+            return False
+
+        if previous and previous != filename:
             try:
-                os.rename(old_file, os.path.join(images_dir, f"{new_base}{ext}"))
+                os.remove(os.path.join(images_dir, previous))
             except OSError:
                 pass
+        return True
 
     @staticmethod
     def create_product(data, files=None):
@@ -120,7 +196,7 @@ class ProductController:
             db.session.add(product)
             db.session.flush()
 
-            ProductController._handle_image_upload(product.name, files)
+            upload = ProductController._handle_image_upload(product, files)
 
             po_id = None
             if product.stock_quantity > 0:
@@ -142,6 +218,7 @@ class ProductController:
                     db.session.add(po)
                     db.session.flush()
                     po_id = po.id
+                    RollupController.record_purchase(po, total_cost)
                     
                     po_item = PurchaseOrderItem(
                         purchase_order_id=po.id,
@@ -161,7 +238,7 @@ class ProductController:
                             reference=f"Initial Stock PO #{po.id}",
                             created_by=current_user.id
                         )
-                        db.session.add(ctx_purchase)
+                        BalanceController.post(ctx_purchase)
                         
                     stock_movement = StockMovement(
                         product_id=product.id,
@@ -185,6 +262,8 @@ class ProductController:
                     db.session.add(stock_movement)
 
             db.session.commit()
+            if not ProductController._store_image(product, upload):
+                return True, "Product added, but its image could not be saved.", po_id
             return True, "Product added successfully!", po_id
         except ValueError:
             return False, "Invalid numeric value provided for stock or price.", None
@@ -206,13 +285,8 @@ class ProductController:
              return False, "Product not found."
              
         try:
-            old_name = product.name
             product.name = data.get('name', product.name)
-            
-            if old_name != product.name:
-                ProductController._rename_product_image(old_name, product.name)
-                
-            ProductController._handle_image_upload(product.name, files)
+            upload = ProductController._handle_image_upload(product, files)
             
             desc = data.get('description', '')
             unit_type = data.get('unit_type')
@@ -230,17 +304,21 @@ class ProductController:
             stock_qty = int(data.get('stock', product.stock_quantity))
             
             if stock_qty != product.stock_quantity:
-                 qty_change = stock_qty - product.stock_quantity
+                 # Only overwrite the count the admin was looking at; a sale in between must not be lost
+                 counted = InventoryController.set_count(product.id, product.stock_quantity or 0, stock_qty)
+                 if counted is None:
+                     db.session.rollback()
+                     return False, "Stock changed while you were editing. Please reload and try again."
+                 qty_before, qty_after = counted
                  stock_movement = StockMovement(
                     product_id=product.id,
-                    quantity_change=qty_change,
-                    quantity_before=product.stock_quantity,
-                    quantity_after=stock_qty,
+                    quantity_change=qty_after - qty_before,
+                    quantity_before=qty_before,
+                    quantity_after=qty_after,
                     reference_type='manual_adjustment',
                     user_id=current_user.id
                 )
                  db.session.add(stock_movement)
-                 product.stock_quantity = stock_qty
 
             # New cost structure
             purchase_price = float(data.get('purchase_price', product.purchase_price or 0))
@@ -255,6 +333,8 @@ class ProductController:
             product.min_stock_level = int(data.get('min_stock', 5))
             
             db.session.commit()
+            if not ProductController._store_image(product, upload):
+                return True, "Product updated, but the new image could not be saved."
             return True, "Product updated successfully!"
         except (ValueError, TypeError):
              return False, "Invalid data provided."
@@ -284,25 +364,19 @@ class ProductController:
             amount_paid = float(data.get('amount_paid', 0))
             
             if qty_to_add > 0:
-                current_qty = product.stock_quantity
-                current_value = current_qty * float(product.cost_price or 0)
-                new_value = qty_to_add * new_cost
-                total_qty = current_qty + qty_to_add
-                
-                # Weighted Average Cost calculation
-                wac = (current_value + new_value) / total_qty if total_qty > 0 else new_cost
+                # Stock and Weighted Average Cost are updated together against the live row
+                current_qty, total_qty = InventoryController.put(
+                    {product.id: qty_to_add}, {product.id: qty_to_add * new_cost})[product.id]
                 
-                product.stock_quantity = total_qty
                 product.purchase_price = new_purchase_price
                 product.additional_expenses = new_additional
-                product.cost_price = wac
                 product.selling_price = new_sell
                 
                 stock_movement = StockMovement(
                     product_id=product.id,
                     quantity_change=qty_to_add,
                     quantity_before=current_qty,
-                    quantity_after=product.stock_quantity,
+                    quantity_after=total_qty,
                     reference_type='restock',
                     user_id=current_user.id
                 )
@@ -330,6 +404,7 @@ class ProductController:
                     db.session.add(po)
                     db.session.flush()
                     po_id = po.id
+                    RollupController.record_purchase(po, total_cost)
                     
                     po_item = PurchaseOrderItem(
                         purchase_order_id=po.id,
@@ -351,7 +426,7 @@ class ProductController:
                             reference=f"Direct Restock PO #{po.id}",
                             created_by=current_user.id
                         )
-                        db.session.add(ctx_purchase)
+                        BalanceController.post(ctx_purchase)
                         
                         if amount_paid > 0:
                             ctx_pay = SupplierTransaction(
@@ -362,7 +437,7 @@ class ProductController:
                                 reference=f"Payment for Restock PO #{po.id}",
                                 created_by=current_user.id
                             )
-                            db.session.add(ctx_pay)
+                            BalanceController.post(ctx_pay)
                             
                             cash_tx = CashTransaction(
                                 transaction_type='out',
@@ -1,18 +1,24 @@
-from models import PurchaseOrder, Distributor, Product, PurchaseOrderItem, SupplierTransaction, StockMovement, CashTransaction, PKT
+from models import (PurchaseOrder, Distributor, Product, PurchaseOrderItem, SupplierTransaction, StockMovement,
+                    CashTransaction, SupplierPaymentAllocation, PKT)
 from extensions import db
 from datetime import datetime
+from decimal import Decimal, InvalidOperation
 from flask_login import current_user
+from controllers.balance_controller import BalanceController
+from controllers.rollup_controller import RollupController
+from controllers.inventory_controller import InventoryController
+from controllers.allocation_controller import AllocationController
+from controllers.analytics_controller import AnalyticsController
+from utils import period_bounds, filter_period, keyset_page
 
 class PurchasesController:
     @staticmethod
-    def get_all_purchases(start_date=None, end_date=None):
+    def get_all_purchases(start_date=None, end_date=None, cursor=None):
+        """One page of purchase orders, newest first. Returns (purchases, next_cursor)."""
         query = PurchaseOrder.query
-        if start_date:
-            query = query.filter(PurchaseOrder.created_at >= datetime.strptime(start_date, '%Y-%m-%d'))
-        if end_date:
-            from datetime import timedelta
-            query = query.filter(PurchaseOrder.created_at <= datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1))
-        return query.order_by(PurchaseOrder.created_at.desc()).all()
+        start, end = period_bounds(start_date=start_date, end_date=end_date)
+        query = filter_period(query, PurchaseOrder.created_at, start, end)
+        return keyset_page(query, PurchaseOrder.created_at, PurchaseOrder.id, cursor)
 
     @staticmethod
     def create_purchase_order(data, current_user_id):
@@ -82,28 +88,26 @@ class PurchasesController:
             reference=f"Purchase Order #{purchase.id}",
             created_by=current_user.id
         )
-        db.session.add(payable_tx)
+        BalanceController.post(payable_tx)
 
+        # Add stock and re-average cost (Weighted Average Cost) in one relative UPDATE per receipt
+        quantities, costs = {}, {}
         for item in purchase.items:
-            product = db.session.get(Product, item.product_id, with_for_update={"of": Product})
-            if product:
-                qty_before = product.stock_quantity
-                
-                # Calculate Weighted Average Cost
-                current_value = qty_before * float(product.cost_price or 0)
-                new_value = item.total_cost
-                total_qty = qty_before + item.quantity
-                wac = (current_value + float(new_value)) / total_qty if total_qty > 0 else float(item.unit_cost)
-                
-                product.cost_price = wac
-                product.stock_quantity = total_qty
-                
-                # Write StockMovement log
+            quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+            costs[item.product_id] = costs.get(item.product_id, 0) + float(item.total_cost or 0)
+        changes = InventoryController.put(quantities, costs)
+
+        # Write StockMovement log
+        on_hand = {product_id: before for product_id, (before, _) in changes.items()}
+        for item in purchase.items:
+            if item.product_id in on_hand and item.quantity:
+                qty_before = on_hand[item.product_id]
+                on_hand[item.product_id] += item.quantity
                 stock_movement = StockMovement(
-                    product_id=product.id,
+                    product_id=item.product_id,
                     quantity_change=item.quantity,
                     quantity_before=qty_before,
-                    quantity_after=total_qty,
+                    quantity_after=on_hand[item.product_id],
                     reference_type='purchase_receipt',
                     reference_id=purchase.id,
                     user_id=current_user.id
@@ -112,6 +116,7 @@ class PurchasesController:
         
         purchase.status = 'received'
         purchase.received_at = datetime.now(PKT)
+        RollupController.record_purchase(purchase, purchase.total_amount)
         
         if purchase.amount_paid > 0:
             purchase.payment_status = 'partial' if purchase.remaining_amount > 0 else 'paid'
@@ -142,7 +147,8 @@ class PurchasesController:
             notes=data.get('notes', ''),
             created_by=current_user_id
         )
-        db.session.add(transaction)
+        BalanceController.post(transaction)
+        db.session.add(SupplierPaymentAllocation(transaction=transaction, purchase_order=purchase, amount=amount))
         
         # Log to Cash Book
         cash_tx = CashTransaction(
@@ -164,3 +170,97 @@ class PurchasesController:
         
         db.session.commit()
         return True, f"Payment of Rs. {amount:,.2f} recorded"
+
+    @staticmethod
+    def pay_distributor(distributor, amount, payment_method, notes, user_id):
+        """Post one payment to a distributor and allocate it FIFO to its oldest open purchase orders.
+
+        Writes one SupplierTransaction and one CashTransaction however many
+        purchase orders it settles. Nothing is committed.
+        Returns (transaction, amount allocated, purchase orders touched).
+        """
+        transaction = BalanceController.post(SupplierTransaction(
+            distributor_id=distributor.id,
+            transaction_type='payment',
+            amount=amount,
+            payment_method=payment_method,
+            reference="Account Payment (FIFO)",
+            notes=notes,
+            created_by=user_id
+        ))
+        db.session.add(CashTransaction(
+            transaction_type='out',
+            amount=amount,
+            source='supplier_payment',
+            description=f"Account Payment to {distributor.name}",
+            created_by=user_id
+        ))
+        db.session.flush()
+        allocated, purchases = AllocationController.allocate(transaction)
+        return transaction, allocated, purchases
+
+    @staticmethod
+    def add_distributor_payment(distributor_id, data, current_user_id):
+        distributor = db.session.get(Distributor, distributor_id)
+        if not distributor:
+            return False, "Distributor not found."
+        amount = _parse_amount(data.get('amount'))
+        if amount is None:
+            return False, "Invalid payment amount"
+
+        _, allocated, purchases = PurchasesController.pay_distributor(
+            distributor, amount, data.get('payment_method', 'cash'), data.get('notes', ''), current_user_id)
+        db.session.commit()
+        return True, (f"Payment of Rs. {amount:,.2f} recorded; "
+                      f"Rs. {allocated:,.2f} settled {purchases} purchase order(s)")
+
+    @staticmethod
+    def get_payment_run():
+        """Distributors with a balance and their open purchase orders, for the payment run screen."""
+        return AnalyticsController.get_creditors()
+
+    @staticmethod
+    def pay_distributors(data, current_user_id):
+        """Pay every distributor with an `amount_<id>` in the form, all in one transaction.
+
+        Every amount is checked before anything is posted; a bad one rejects
+        the whole run.
+        """
+        payments = []
+        for key, value in data.items():
+            if not key.startswith('amount_') or not (value or '').strip():
+                continue
+            distributor_id = key[len('amount_'):]
+            amount = _parse_amount(value)
+            if not distributor_id.isdigit() or amount is None:
+                return False, f"Invalid payment amount '{value}'"
+            payments.append((int(distributor_id), amount))
+        if not payments:
+            return False, "Enter an amount for at least one distributor"
+
+        distributors = {d.id: d for d in Distributor.query.filter(Distributor.id.in_([i for i, _ in payments]))}
+        missing = [str(i) for i, _ in payments if i not in distributors]
+        if missing:
+            return False, f"Distributor(s) not found: {', '.join(missing)}"
+
+        total = allocated = Decimal('0')
+        purchases = 0
+        for distributor_id, amount in sorted(payments):
+            _, applied, touched = PurchasesController.pay_distributor(
+                distributors[distributor_id], amount, data.get('payment_method', 'cash'), data.get('notes', ''),
+                current_user_id)
+            total += amount
+            allocated += applied
+            purchases += touched
+        db.session.commit()
+        return True, (f"Paid {len(payments)} distributor(s) Rs. {total:,.2f}; "
+                      f"Rs. {allocated:,.2f} settled {purchases} purchase order(s)")
+
+
+def _parse_amount(value):
+    """A positive amount rounded to paisa, or None."""
+    try:
+        amount = Decimal(str(value).replace(',', '').strip()).quantize(Decimal('0.01'))
+    except (InvalidOperation, TypeError):
+        return None
+    return amount if amount.is_finite() and amount > 0 else None
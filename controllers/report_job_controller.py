@@ -0,0 +1,189 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import update, or_
+from sqlalchemy.exc import IntegrityError
+from models import ReportJob, PKT
+from extensions import db
+from controllers.reports_controller import ReportsController
+from controllers.period_controller import PeriodController
+
+# Attempts before a job that keeps failing (or whose worker died) is given up on
+MAX_ATTEMPTS = 3
+# A running job not finished after this long is assumed lost with its worker
+STALE_AFTER = timedelta(minutes=10)
+
+MONTHLY_FORMATS = {
+    'pdf': ('pdf', 'application/pdf', ReportsController.generate_pdf),
+    'excel': ('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+              ReportsController.generate_excel),
+}
+
+
+def _now():
+    return datetime.now(PKT).replace(tzinfo=None)
+
+
+def _params_key(kind, params):
+    return hashlib.sha256(json.dumps([kind, params], sort_keys=True).encode()).hexdigest()
+
+
+def _render_monthly_report(params):
+    ext, mimetype, generate = MONTHLY_FORMATS[params['format']]
+    data = ReportsController.get_monthly_report(params['year'], params['month'])
+    content = generate(data).getvalue()
+    return content, f"report_{data['month_name']}_{params['year']}.{ext}", mimetype
+
+
+def _monthly_report_frozen_at(params):
+    close = PeriodController.get_close(params['year'], params['month'])
+    return close.closed_at if close else None
+
+
+# kind -> (renderer returning (bytes, filename, mimetype),
+#          when the output stopped being able to change, or None while it still can)
+KINDS = {
+    'monthly_report': (_render_monthly_report, _monthly_report_frozen_at),
+}
+
+
+class ReportJobController:
+    """Report rendering queued in the report_job table and run by background workers (jobs.py).
+
+    Outputs are stored under their SHA-256 in REPORT_ARTIFACT_DIR. A report for
+    a closed period cannot change, so asking for it again reuses an artifact
+    rendered after the close; identical requests already waiting share one job.
+    """
+
+    @staticmethod
+    def artifact_path(sha):
+        return os.path.join(current_app.config['REPORT_ARTIFACT_DIR'], sha[:2], sha)
+
+    @staticmethod
+    def store_artifact(content):
+        """Save `content` under its hash (once) and return the hash."""
+        sha = hashlib.sha256(content).hexdigest()
+        path = ReportJobController.artifact_path(sha)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+            os.replace(tmp, path)  # readers never see a partial file
+        return sha
+
+    @staticmethod
+    def request_report(kind, params, user_id=None):
+        """Return the job that will produce (or already holds) this report, queueing one if needed.
+
+        Returns (job, created).
+        """
+        key = _params_key(kind, params)
+        _, frozen_at = KINDS[kind]
+
+        since = frozen_at(params)
+        reusable = ReportJob.status.in_(('queued', 'running'))
+        if since is not None:
+            reusable = or_(reusable, (ReportJob.status == 'done') & (ReportJob.created_at >= since))
+
+        def existing():
+            for job in ReportJob.query.filter(ReportJob.params_key == key, reusable).order_by(ReportJob.id.desc()):
+                if job.status != 'done' or os.path.exists(ReportJobController.artifact_path(job.artifact_sha)):
+                    return job
+            return None
+
+        job = existing()
+        if job is not None:
+            return job, False
+        job = ReportJob(kind=kind, params=json.dumps(params, sort_keys=True), params_key=key,
+                        status='queued', created_by=user_id)
+        db.session.add(job)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another request queued the same report first (ux_report_job_active_params_key)
+            db.session.rollback()
+            return existing(), False
+        return job, True
+
+    @staticmethod
+    def get_job(job_id):
+        return db.session.get(ReportJob, job_id)
+
+    @staticmethod
+    def claim():
+        """Mark the oldest runnable job as running and return it, or None when there is none.
+
+        The status change is a compare-and-set UPDATE, so two workers can never
+        claim the same job. Jobs left running by a dead worker are retried.
+        """
+        now = _now()
+        stale = (ReportJob.status == 'running') & (ReportJob.started_at < now - STALE_AFTER)
+        db.session.execute(update(ReportJob).where(stale, ReportJob.attempts >= MAX_ATTEMPTS)
+                           .values(status='failed', error='Worker stopped before finishing', finished_at=now)
+                           .execution_options(synchronize_session=False))
+        db.session.commit()
+
+        runnable = or_(ReportJob.status == 'queued', stale)
+        for job_id, status in db.session.query(ReportJob.id, ReportJob.status).filter(runnable)\
+                .order_by(ReportJob.created_at, ReportJob.id).limit(5):
+            claimed = db.session.execute(
+                update(ReportJob).where(ReportJob.id == job_id, ReportJob.status == status, runnable)
+                .values(status='running', started_at=now, attempts=ReportJob.attempts + 1)
+                .execution_options(synchronize_session=False)).rowcount
+            db.session.commit()
+            if claimed:
+                return db.session.get(ReportJob, job_id, populate_existing=True)
+        return None
+
+    @staticmethod
+    def run(job):
+        """Render a claimed job and record the outcome."""
+        render, _ = KINDS[job.kind]
+        try:
+            content, filename, mimetype = render(json.loads(job.params))
+            job.artifact_sha = ReportJobController.store_artifact(content)
+            job.filename, job.mimetype = filename, mimetype
+            job.status, job.error = 'done', None
+        except Exception as exc:
+            db.session.rollback()
+            current_app.logger.exception('Report job %s failed', job.id)
+            job.error = f'{type(exc).__name__}: {exc}'
+            job.status = 'failed' if job.attempts >= MAX_ATTEMPTS else 'queued'
+        job.finished_at = _now()
+        db.session.commit()
+        return job.status
+
+    @staticmethod
+    def prune(days=30):
+        """Delete finished jobs older than `days` (keeping closed-period reports) and unreferenced artifacts.
+
+        Returns (jobs deleted, files deleted).
+        """
+        cutoff = _now() - timedelta(days=days)
+        jobs = 0
+        for job in ReportJob.query.filter(ReportJob.status.in_(('done', 'failed')), ReportJob.created_at < cutoff):
+            _, frozen_at = KINDS.get(job.kind, (None, lambda params: None))
+            since = frozen_at(json.loads(job.params)) if job.status == 'done' else None
+            if since is None or job.created_at < since:
+                db.session.delete(job)
+                jobs += 1
+        db.session.commit()
+
+        referenced = {sha for (sha,) in db.session.query(ReportJob.artifact_sha)
+                      .filter(ReportJob.artifact_sha.isnot(None))}
+        files = 0
+        root = current_app.config['REPORT_ARTIFACT_DIR']
+        settled = time.time() - STALE_AFTER.total_seconds()
+        for directory, _, names in os.walk(root):
+            for name in names:
+                path = os.path.join(directory, name)
+                # Leave files a worker may still be writing
+                if name not in referenced and os.path.getmtime(path) < settled:
+                    os.remove(path)
+                    files += 1
+        return jobs, files
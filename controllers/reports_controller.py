@@ -1,10 +1,13 @@
 import io
 import csv
+import json
 from datetime import datetime
-from models import (Order, PurchaseOrder, Expense, EmployeePayment,
-                     CustomerTransaction, PKT)
+from models import PKT
 from extensions import db
-from sqlalchemy import func, extract
+from utils import period_bounds
+from controllers.aggregation_controller import AggregationController
+from controllers.analytics_controller import AnalyticsController
+from controllers.period_controller import PeriodController
 
 
 class ReportsController:
@@ -14,50 +17,17 @@ class ReportsController:
         month_names = ['January', 'February', 'March', 'April', 'May', 'June',
                        'July', 'August', 'September', 'October', 'November', 'December']
 
-        # Sales
-        sales_q = Order.query.filter(
-            Order.status == 'approved',
-            extract('year', Order.created_at) == year,
-            extract('month', Order.created_at) == month)
-
-        total_revenue = float(sales_q.with_entities(func.sum(Order.total_amount)).scalar() or 0)
-        total_orders = sales_q.count()
-
-        cash_q = sales_q.filter(Order.order_type == 'sale')
-        credit_q = sales_q.filter(Order.order_type == 'credit_sale')
-
-        cash_sales = float(cash_q.with_entities(func.sum(Order.total_amount)).scalar() or 0)
-        credit_sales = float(credit_q.with_entities(func.sum(Order.total_amount)).scalar() or 0)
-
-        # Purchases
-        total_purchases = float(
-            PurchaseOrder.query.filter(
-                PurchaseOrder.status == 'received',
-                extract('year', PurchaseOrder.created_at) == year,
-                extract('month', PurchaseOrder.created_at) == month
-            ).with_entities(func.sum(PurchaseOrder.total_amount)).scalar() or 0)
-
-        # Expenses
-        total_expenses = float(
-            Expense.query.filter(
-                extract('year', Expense.expense_date) == year,
-                extract('month', Expense.expense_date) == month
-            ).with_entities(func.sum(Expense.amount)).scalar() or 0)
-
-        # Staff Expenses
-        total_staff_expenses = float(
-            EmployeePayment.query.filter(
-                extract('year', EmployeePayment.date) == year,
-                extract('month', EmployeePayment.date) == month
-            ).with_entities(func.sum(EmployeePayment.amount)).scalar() or 0)
-
-        # Receipts collected
-        receipts_collected = float(
-            CustomerTransaction.query.filter(
-                CustomerTransaction.transaction_type == 'payment',
-                extract('year', CustomerTransaction.created_at) == year,
-                extract('month', CustomerTransaction.created_at) == month
-            ).with_entities(func.sum(CustomerTransaction.amount)).scalar() or 0)
+        close = PeriodController.get_close(year, month)
+        totals = AggregationController.get_month_totals(year, month)
+
+        total_revenue = totals['total_revenue']
+        total_orders = totals['total_orders']
+        cash_sales = totals['cash_revenue']
+        credit_sales = totals['credit_revenue']
+        total_purchases = totals['total_purchases']
+        total_expenses = totals['total_expenses']
+        total_staff_expenses = totals['total_staff_expenses']
+        receipts_collected = totals['total_receipts']
 
         outstanding_credit = credit_sales - receipts_collected
         net_profit = total_revenue - total_expenses - total_staff_expenses
@@ -77,8 +47,29 @@ class ReportsController:
             'credit_sales': credit_sales,
             'receipts_collected': receipts_collected,
             'outstanding_credit': outstanding_credit,
+            'closed_at': close.closed_at if close else None,
         }
 
+    @staticmethod
+    def month_snapshot(year, month):
+        """Every report figure of a month, read from the rollups and raw rows, as JSON-ready values."""
+        start, end = period_bounds(year, month)
+        buckets = AggregationController.collect(start, end, frozen=False)
+        return {
+            'bucket': AggregationController.snapshot_bucket(buckets[(year, month)]),
+            'rankings': AnalyticsController.get_rankings(start, end),
+        }
+
+    @staticmethod
+    def close_month(year, month, user_id):
+        """Freeze a month's report figures and refuse further writes dated in it."""
+        close, error = PeriodController.begin_close(year, month, user_id)
+        if error:
+            return False, error
+        close.snapshot = json.dumps(ReportsController.month_snapshot(year, month))
+        db.session.commit()
+        return True, f"{close.period_start:%B %Y} is closed; its reports are now frozen."
+
     @staticmethod
     def generate_csv(data):
         """Return CSV string for the monthly report."""
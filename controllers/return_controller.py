@@ -1,11 +1,17 @@
 from models import Order, OrderItem, Product, StockMovement, CustomerTransaction, CashTransaction, PKT, PurchaseOrder, PurchaseOrderItem, SupplierTransaction
 from extensions import db
 from datetime import datetime
+from controllers.balance_controller import BalanceController
+from controllers.rollup_controller import RollupController
+from controllers.inventory_controller import InventoryController
+from utils import keyset_page
 
 class ReturnController:
     @staticmethod
-    def get_customer_returns():
-        return Order.query.filter_by(order_type='return').order_by(Order.created_at.desc()).all()
+    def get_customer_returns(cursor=None, per_page=10):
+        """One page of customer returns, newest first. Returns (returns, next_cursor)."""
+        return keyset_page(Order.query.filter_by(order_type='return'), Order.created_at, Order.id,
+                           cursor, per_page=per_page)
 
     @staticmethod
     def get_supplier_returns():
@@ -75,27 +81,30 @@ class ReturnController:
             order_id=return_order.id,
             product_id=product.id,
             quantity=qty_returned,
-            price=original_item.price
+            price=original_item.price,
+            cost_price=product.cost_price
         )
         db.session.add(return_item)
+        RollupController.record_order(return_order, [
+            (product.id, -qty_returned, -return_value, float(return_order.total_profit))])
         
         # Inventory Logic
-        qty_before = product.stock_quantity
         is_defective = reason == 'Defective Product'
         
         if not is_defective:
             # Add back to normal inventory
-            product.stock_quantity += qty_returned
+            qty_before, qty_after = InventoryController.put({product.id: qty_returned})[product.id]
             ref_type = 'customer_return'
         else:
             # Do NOT add back to inventory. It's defective.
+            qty_before = qty_after = product.stock_quantity
             ref_type = 'customer_return_defective'
             
         stock_movement = StockMovement(
             product_id=product.id,
             quantity_change=qty_returned, # Representing goods coming back
             quantity_before=qty_before,
-            quantity_after=product.stock_quantity, # Will be same as before if defective!
+            quantity_after=qty_after, # Will be same as before if defective!
             reference_type=ref_type,
             reference_id=return_order.id,
             user_id=current_user_id
@@ -114,7 +123,7 @@ class ReturnController:
                 reference=f"Return from Order #{original_order.id} - {reason}",
                 created_by=current_user_id
             )
-            db.session.add(customer_tx)
+            BalanceController.post(customer_tx)
             
         # Logging Audit
         from controllers.audit_controller import AuditController
@@ -191,15 +200,18 @@ class ReturnController:
         )
         db.session.add(return_item)
         
-        # Deduct from Inventory
-        qty_before = product.stock_quantity
-        product.stock_quantity -= qty_returned
+        # Deduct from Inventory; the guarded decrement re-checks stock at write time
+        changes, short_ids = InventoryController.take({product.id: qty_returned})
+        if short_ids:
+            db.session.rollback()
+            return False, "Not enough current stock to return to supplier.", None
+        qty_before, qty_after = changes[product.id]
         
         stock_movement = StockMovement(
             product_id=product.id,
             quantity_change=-qty_returned,
             quantity_before=qty_before,
-            quantity_after=product.stock_quantity,
+            quantity_after=qty_after,
             reference_type='supplier_return',
             reference_id=return_po.id,
             user_id=current_user_id
@@ -216,7 +228,7 @@ class ReturnController:
             notes=reason,
             created_by=current_user_id
         )
-        db.session.add(supplier_tx)
+        BalanceController.post(supplier_tx)
         
         db.session.commit()
         return True, f"Supplier return processed successfully. Reference #{return_po.id}", return_po.id
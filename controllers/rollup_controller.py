@@ -0,0 +1,244 @@
+from datetime import datetime, date, timedelta
+from sqlalchemy import func, case, delete
+from models import (Order, OrderItem, PurchaseOrder, Expense, EmployeePayment,
+                    CustomerTransaction, DailySummary, ProductDailySales, PKT)
+from extensions import db
+from controllers.period_controller import PeriodController
+
+
+# order_type -> (total column, profit column, count column) on DailySummary
+ORDER_TYPE_COLUMNS = {
+    'sale': ('sales_total', 'sales_profit', 'sales_count'),
+    'credit_sale': ('credit_sales_total', 'credit_sales_profit', 'credit_sales_count'),
+    'return': ('returns_total', 'returns_profit', 'returns_count'),
+}
+
+
+def _day(value):
+    value = value or datetime.now(PKT)
+    return value.date() if isinstance(value, datetime) else value
+
+
+def _as_date(value):
+    # func.date() yields 'YYYY-MM-DD' strings on SQLite and date objects elsewhere
+    return value if isinstance(value, date) else date.fromisoformat(str(value)[:10])
+
+
+def _upsert_add(model, key_names, rows):
+    """Insert rollup rows, adding to the existing counters when the key already exists."""
+    if not rows:
+        return
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        value_names = [k for k in rows[0] if k not in key_names]
+        stmt = insert(model).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=key_names,
+            set_={name: model.__table__.c[name] + stmt.excluded[name] for name in value_names})
+        db.session.execute(stmt)
+        return
+
+    for row in rows:
+        record = db.session.get(model, tuple(row[k] for k in key_names))
+        if record is None:
+            db.session.add(model(**row))
+        else:
+            for name, value in row.items():
+                if name not in key_names:
+                    setattr(record, name, (getattr(record, name) or 0) + value)
+
+
+class RollupController:
+    """Keeps DailySummary / ProductDailySales in step with the rows they summarise.
+
+    Every record_* helper is called inside the caller's transaction, so a
+    rollup change commits or rolls back together with the source row. A
+    change dated in a closed month is posted to today instead, so the closed
+    month keeps matching its snapshot; the order or purchase order remembers
+    that day in `posted_on`, so a rebuild books it there again.
+    """
+
+    @staticmethod
+    def _bump(day, **deltas):
+        _upsert_add(DailySummary, ['date'], [{'date': _day(PeriodController.posting_day(day)), **deltas}])
+
+    @staticmethod
+    def record_order(order, lines=()):
+        """Add an approved order and its (product_id, quantity, revenue, profit) lines."""
+        day = _day(PeriodController.posting_day(order.created_at))
+        if day != _day(order.created_at):
+            order.posted_on = day
+        columns = ORDER_TYPE_COLUMNS.get(order.order_type)
+        if columns:
+            total_col, profit_col, count_col = columns
+            RollupController._bump(day, **{
+                total_col: float(order.total_amount or 0),
+                profit_col: float(order.total_profit or 0),
+                count_col: 1,
+            })
+
+        merged = {}
+        for product_id, quantity, revenue, profit in lines:
+            q, r, p = merged.get(product_id, (0, 0.0, 0.0))
+            merged[product_id] = (q + quantity, r + float(revenue), p + float(profit))
+        _upsert_add(ProductDailySales, ['date', 'product_id'], [
+            {'date': day, 'product_id': pid, 'quantity': q, 'revenue': r, 'profit': p}
+            for pid, (q, r, p) in merged.items()])
+
+    @staticmethod
+    def record_expense(expense_date, amount):
+        RollupController._bump(expense_date, expenses_total=float(amount))
+
+    @staticmethod
+    def record_staff_payment(payment_date, amount):
+        RollupController._bump(payment_date, staff_expenses_total=float(amount))
+
+    @staticmethod
+    def record_purchase(purchase, amount):
+        """Add a received purchase order."""
+        day = _day(PeriodController.posting_day(purchase.created_at))
+        if day != _day(purchase.created_at):
+            purchase.posted_on = day
+        RollupController._bump(day, purchases_total=float(amount))
+
+    @staticmethod
+    def record_receipt(created_at, amount):
+        RollupController._bump(created_at, receipts_total=float(amount))
+
+    @staticmethod
+    def _raw_daily(start, end):
+        """Aggregate raw rows in [start, end) into {day: DailySummary values} and product rows.
+
+        Orders and purchase orders count on their `posted_on` day when they
+        have one (posted late, after their own month closed), otherwise on
+        the day they were created.
+        """
+        days = {}
+
+        def row(day):
+            return days.setdefault(_as_date(day), {})
+
+        def add(values, name, value):
+            values[name] = values.get(name, 0) + value
+
+        def by_posting_day(model):
+            """[(day expression, filters)] that put each row of `model` in [start, end) on its posting day."""
+            return [
+                (func.date(model.created_at),
+                 (model.posted_on.is_(None), model.created_at >= start, model.created_at < end)),
+                (model.posted_on, (model.posted_on >= start.date(), model.posted_on < end.date())),
+            ]
+
+        for day, filters in by_posting_day(Order):
+            orders = db.session.query(
+                day, Order.order_type,
+                func.sum(Order.total_amount), func.sum(Order.total_profit), func.count(Order.id))\
+                .filter(Order.status == 'approved', *filters).group_by(day, Order.order_type)
+            for d, order_type, total, profit, count in orders:
+                columns = ORDER_TYPE_COLUMNS.get(order_type)
+                if columns:
+                    values = row(d)
+                    for name, value in zip(columns, (float(total or 0), float(profit or 0), count)):
+                        add(values, name, value)
+
+        sources = [
+            ('expenses_total', func.date(Expense.expense_date), Expense.amount,
+             (Expense.expense_date >= start, Expense.expense_date < end)),
+            ('staff_expenses_total', func.date(EmployeePayment.date), EmployeePayment.amount,
+             (EmployeePayment.date >= start, EmployeePayment.date < end)),
+            ('receipts_total', func.date(CustomerTransaction.created_at), CustomerTransaction.amount,
+             (CustomerTransaction.transaction_type == 'payment',
+              CustomerTransaction.created_at >= start, CustomerTransaction.created_at < end)),
+        ] + [('purchases_total', day, PurchaseOrder.total_amount, (PurchaseOrder.status == 'received', *filters))
+             for day, filters in by_posting_day(PurchaseOrder)]
+        for name, day, amount_col, filters in sources:
+            for d, total in db.session.query(day, func.sum(amount_col)).filter(*filters).group_by(day):
+                add(row(d), name, float(total or 0))
+
+        # Product lines; profit uses the cost each line was approved at, as record_order did
+        sign = case((Order.order_type == 'return', -1), else_=1)
+        products = {}
+        for day, filters in by_posting_day(Order):
+            lines = db.session.query(
+                day, OrderItem.product_id,
+                func.sum(sign * OrderItem.quantity),
+                func.sum(sign * OrderItem.quantity * OrderItem.price),
+                func.sum(sign * (OrderItem.price - func.coalesce(OrderItem.cost_price, 0)) * OrderItem.quantity))\
+                .join(Order, Order.id == OrderItem.order_id)\
+                .filter(Order.status == 'approved', *filters)\
+                .group_by(day, OrderItem.product_id)
+            for d, pid, q, r, p in lines:
+                key = (_as_date(d), pid)
+                quantity, revenue, profit = products.get(key, (0, 0.0, 0.0))
+                products[key] = (quantity + int(q or 0), revenue + float(r or 0), profit + float(p or 0))
+        product_rows = [
+            {'date': d, 'product_id': pid, 'quantity': q, 'revenue': r, 'profit': p}
+            for (d, pid), (q, r, p) in products.items()]
+
+        return days, product_rows
+
+    @staticmethod
+    def first_activity_date():
+        candidates = [
+            db.session.query(func.min(Order.created_at)).scalar(),
+            db.session.query(func.min(Expense.expense_date)).scalar(),
+            db.session.query(func.min(EmployeePayment.date)).scalar(),
+            db.session.query(func.min(PurchaseOrder.created_at)).scalar(),
+            db.session.query(func.min(CustomerTransaction.created_at)).scalar(),
+        ]
+        candidates = [_day(c) for c in candidates if c is not None]
+        return min(candidates) if candidates else None
+
+    @staticmethod
+    def rebuild(start=None, end=None, chunk_days=31, progress=None):
+        """Recompute the rollups for [start, end) from raw rows, one committed chunk at a time.
+
+        `start` defaults to the earliest dated row and `end` to tomorrow.
+        Closed months are skipped: their reports come from the period snapshot.
+        Returns the number of days that have activity.
+        """
+        start = start or RollupController.first_activity_date()
+        if start is None:
+            return 0
+        end = end or (datetime.now(PKT).date() + timedelta(days=1))
+        closed = PeriodController.closed_ranges()
+
+        written = 0
+        cursor = start
+        while cursor < end:
+            skip = next((upper for lower, upper in closed if lower <= cursor < upper), None)
+            if skip is not None:
+                cursor = skip
+                continue
+            following = next((lower for lower, _ in closed if lower > cursor), end)
+            stop = min(cursor + timedelta(days=chunk_days), end, following)
+            lower = datetime.combine(cursor, datetime.min.time())
+            upper = datetime.combine(stop, datetime.min.time())
+
+            days, product_rows = RollupController._raw_daily(lower, upper)
+
+            db.session.execute(delete(DailySummary).where(
+                DailySummary.date >= cursor, DailySummary.date < stop))
+            db.session.execute(delete(ProductDailySales).where(
+                ProductDailySales.date >= cursor, ProductDailySales.date < stop))
+            if days:
+                db.session.execute(DailySummary.__table__.insert(), [
+                    {**{c: 0 for c in _SUMMARY_VALUE_COLUMNS}, 'date': d, **values}
+                    for d, values in days.items()])
+            if product_rows:
+                db.session.execute(ProductDailySales.__table__.insert(), product_rows)
+            db.session.commit()
+
+            written += len(days)
+            if progress:
+                progress(cursor, stop, len(days))
+            cursor = stop
+
+        return written
+
+
+_SUMMARY_VALUE_COLUMNS = [c.name for c in DailySummary.__table__.columns if c.name != 'date']
@@ -0,0 +1,323 @@
+from decimal import Decimal
+from datetime import datetime, timedelta
+from collections import defaultdict
+from sqlalchemy import case, delete, event, extract, func, insert, inspect, literal, select, tuple_, union_all
+from sqlalchemy.orm import Session
+from models import CashTransaction, CustomerTransaction, SupplierTransaction, BalanceCheckpoint, PKT
+from extensions import db
+from utils import period_bounds, keyset_page, PAGE_SIZE
+
+
+# ledger -> (model, account column, type that increases the balance, type that decreases it)
+LEDGERS = {
+    'cash': (CashTransaction, None, 'in', 'out'),
+    'customer': (CustomerTransaction, CustomerTransaction.customer_id, 'receivable', 'payment'),
+    'supplier': (SupplierTransaction, SupplierTransaction.distributor_id, 'payable', 'payment'),
+}
+MODEL_LEDGERS = {model: name for name, (model, *_) in LEDGERS.items()}
+
+# account_id of the whole-ledger checkpoints
+ALL = 0
+
+
+def _month_start(value):
+    return datetime(value.year, value.month, 1)
+
+
+def _next_month(value):
+    return datetime(value.year + value.month // 12, value.month % 12 + 1, 1)
+
+
+def _current_month_start():
+    return period_bounds(*datetime.now(PKT).timetuple()[:2])[0]
+
+
+def _account_filter(ledger, account_id):
+    _, account_column, _, _ = LEDGERS[ledger]
+    if account_id == ALL or account_column is None:
+        return True
+    return account_column == account_id
+
+
+class RunningBalanceController:
+    """Running balances for the cash book and the customer/supplier ledgers.
+
+    A page of rows gets its running balance from a SQL window function
+    (SUM() OVER (ORDER BY created_at, id)) added to the balance of everything
+    before it. That opening balance comes from the nearest month-start
+    BalanceCheckpoint plus the rows since, so it costs one checkpoint lookup and
+    an index range scan of at most about a month, however old the history is.
+    Reads never write checkpoints: the first ledger write after a month ends
+    adds them (see _checkpoint_closed_months), and so does the
+    refresh-balance-checkpoints command.
+    """
+
+    @staticmethod
+    def signed_amount(ledger):
+        """+amount for the increasing type, -amount for the decreasing one, 0 otherwise."""
+        model, _, increasing, decreasing = LEDGERS[ledger]
+        return case((model.transaction_type == increasing, model.amount),
+                    (model.transaction_type == decreasing, -model.amount),
+                    else_=0)
+
+    @staticmethod
+    def _split_sums(ledger):
+        model, _, increasing, decreasing = LEDGERS[ledger]
+        return (func.coalesce(func.sum(case((model.transaction_type == increasing, model.amount), else_=0)), 0),
+                func.coalesce(func.sum(case((model.transaction_type == decreasing, model.amount), else_=0)), 0))
+
+    @staticmethod
+    def totals_before(ledger, created_at, row_id=None, account_id=ALL):
+        """(increases, decreases) of every row before (created_at, row_id).
+
+        Without row_id, rows dated before `created_at`.
+        """
+        model = LEDGERS[ledger][0]
+        checkpoint = BalanceCheckpoint.query.filter(
+            BalanceCheckpoint.ledger == ledger,
+            BalanceCheckpoint.account_id == account_id,
+            BalanceCheckpoint.period_start <= created_at,
+        ).order_by(BalanceCheckpoint.period_start.desc()).first()
+
+        query = db.session.query(*RunningBalanceController._split_sums(ledger))\
+            .filter(_account_filter(ledger, account_id))
+        if checkpoint is not None:
+            query = query.filter(model.created_at >= checkpoint.period_start)
+        if row_id is None:
+            query = query.filter(model.created_at < created_at)
+        else:
+            query = query.filter(tuple_(model.created_at, model.id) < tuple_(created_at, row_id))
+        increases, decreases = (Decimal(str(value)) for value in query.one())
+
+        if checkpoint is not None:
+            increases += Decimal(str(checkpoint.increases))
+            decreases += Decimal(str(checkpoint.decreases))
+        return increases, decreases
+
+    @staticmethod
+    def balance_before(ledger, created_at, row_id=None, account_id=ALL, transaction_type=None):
+        """Signed balance before a position; with transaction_type, that type's running total only."""
+        increases, decreases = RunningBalanceController.totals_before(ledger, created_at, row_id, account_id)
+        _, _, increasing, decreasing = LEDGERS[ledger]
+        if transaction_type == increasing:
+            return increases
+        if transaction_type == decreasing:
+            return -decreases
+        return increases - decreases
+
+    @staticmethod
+    def ledger_totals(ledgers):
+        """{ledger: (increases, decreases)} over all time for whole ledgers.
+
+        Latest checkpoints plus one grouped aggregate over a UNION ALL of the
+        rows each ledger has had since its checkpoint.
+        """
+        latest = db.session.query(BalanceCheckpoint.ledger,
+                                  func.max(BalanceCheckpoint.period_start).label('period_start'))\
+            .filter(BalanceCheckpoint.ledger.in_(ledgers), BalanceCheckpoint.account_id == ALL)\
+            .group_by(BalanceCheckpoint.ledger).subquery()
+        checkpoints = {cp.ledger: cp for cp in BalanceCheckpoint.query.join(
+            latest, (BalanceCheckpoint.ledger == latest.c.ledger) &
+                    (BalanceCheckpoint.period_start == latest.c.period_start))
+            .filter(BalanceCheckpoint.account_id == ALL)}
+
+        arms = []
+        for ledger in ledgers:
+            model = LEDGERS[ledger][0]
+            arm = select(literal(ledger).label('ledger'), model.transaction_type, model.amount)
+            if ledger in checkpoints:
+                arm = arm.where(model.created_at >= checkpoints[ledger].period_start)
+            arms.append(arm)
+        rows = union_all(*arms).subquery()
+        grouped = db.session.execute(select(rows.c.ledger, rows.c.transaction_type, func.sum(rows.c.amount))
+                                     .group_by(rows.c.ledger, rows.c.transaction_type))
+
+        totals = {ledger: [Decimal('0'), Decimal('0')] for ledger in ledgers}
+        for ledger, cp in checkpoints.items():
+            totals[ledger] = [Decimal(str(cp.increases)), Decimal(str(cp.decreases))]
+        for ledger, transaction_type, amount in grouped:
+            _, _, increasing, decreasing = LEDGERS[ledger]
+            if transaction_type in (increasing, decreasing):
+                totals[ledger][transaction_type == decreasing] += Decimal(str(amount or 0))
+        return {ledger: tuple(values) for ledger, values in totals.items()}
+
+    @staticmethod
+    def running_balances(ledger, rows, account_id=ALL, transaction_type=None):
+        """{row id: running balance} for a contiguous slice of the ledger.
+
+        `rows` are ORM rows in any order that form one unbroken run of the
+        (optionally type-filtered) ledger, such as a keyset page. The window
+        function only reads the rows between the oldest and newest of them.
+        """
+        if not rows:
+            return {}
+        model = LEDGERS[ledger][0]
+        oldest = min(rows, key=lambda r: (r.created_at, r.id))
+        newest = max(rows, key=lambda r: (r.created_at, r.id))
+        opening = RunningBalanceController.balance_before(
+            ledger, oldest.created_at, oldest.id, account_id, transaction_type)
+
+        position = tuple_(model.created_at, model.id)
+        stmt = select(model.id, func.sum(RunningBalanceController.signed_amount(ledger))
+                      .over(order_by=(model.created_at, model.id)))\
+            .where(_account_filter(ledger, account_id),
+                   position >= tuple_(oldest.created_at, oldest.id),
+                   position <= tuple_(newest.created_at, newest.id))
+        if transaction_type:
+            stmt = stmt.where(model.transaction_type == transaction_type)
+        return {row_id: float(opening + Decimal(str(running or 0)))
+                for row_id, running in db.session.execute(stmt)}
+
+    @staticmethod
+    def account_page(ledger, account_id, cursor=None, per_page=None):
+        """One newest-first page of an account's ledger with running balances.
+
+        Returns (rows, next_cursor); each row gets a `running_balance` attribute.
+        """
+        model = LEDGERS[ledger][0]
+        page, next_cursor = keyset_page(model.query.filter(_account_filter(ledger, account_id)),
+                                        model.created_at, model.id, cursor, per_page or PAGE_SIZE)
+        balances = RunningBalanceController.running_balances(ledger, page, account_id)
+        for row in page:
+            row.running_balance = balances.get(row.id, 0.0)
+        return page, next_cursor
+
+    @staticmethod
+    def refresh_checkpoints(ledgers=None, through=None):
+        """Add month-start checkpoints up to `through` (default: the current month start).
+
+        Picks up after the newest existing checkpoint of each ledger, so a
+        regular run only sums the month that just closed. Returns rows written.
+        """
+        through = _month_start(through) if through else _current_month_start()
+        written = 0
+        for ledger in ledgers or LEDGERS:
+            written += RunningBalanceController._refresh(ledger, through)
+        db.session.commit()
+        return written
+
+    @staticmethod
+    def ensure_checkpoints(ledgers=None):
+        """Add checkpoints when a month has closed (or a backdated edit dropped some) since the last run.
+
+        Writes in the caller's transaction without committing. Returns rows written.
+        """
+        current = _current_month_start()
+        written = 0
+        for ledger in ledgers or LEDGERS:
+            last = db.session.query(func.max(BalanceCheckpoint.period_start))\
+                .filter(BalanceCheckpoint.ledger == ledger, BalanceCheckpoint.account_id == ALL).scalar()
+            if (last or datetime.min) < current:
+                written += RunningBalanceController._refresh(ledger, current)
+        return written
+
+    @staticmethod
+    def _refresh(ledger, through):
+        model, account_column, _, _ = LEDGERS[ledger]
+        last = db.session.query(func.max(BalanceCheckpoint.period_start)).filter(
+            BalanceCheckpoint.ledger == ledger, BalanceCheckpoint.account_id == ALL).scalar()
+        if last is not None and last >= through:
+            return 0
+
+        # Each account's totals as of `last`, to carry forward
+        totals = {}
+        if last is not None:
+            latest = db.session.query(BalanceCheckpoint.account_id,
+                                      func.max(BalanceCheckpoint.period_start).label('period_start'))\
+                .filter(BalanceCheckpoint.ledger == ledger, BalanceCheckpoint.period_start <= last)\
+                .group_by(BalanceCheckpoint.account_id).subquery()
+            checkpoints = BalanceCheckpoint.query.join(
+                latest, (BalanceCheckpoint.account_id == latest.c.account_id) &
+                        (BalanceCheckpoint.period_start == latest.c.period_start))\
+                .filter(BalanceCheckpoint.ledger == ledger)
+            for cp in checkpoints:
+                totals[cp.account_id] = (Decimal(str(cp.increases)), Decimal(str(cp.decreases)))
+
+        # Per-account sums of each month still to cover, in one grouped scan
+        account = account_column if account_column is not None else literal(ALL)
+        year, month = extract('year', model.created_at), extract('month', model.created_at)
+        query = db.session.query(account, year, month, *RunningBalanceController._split_sums(ledger))\
+            .filter(model.created_at < through)
+        if last is not None:
+            query = query.filter(model.created_at >= last)
+        by_month = defaultdict(dict)
+        for account_id, y, m, increases, decreases in query.group_by(account, year, month):
+            by_month[datetime(int(y), int(m), 1)][account_id or ALL] = (Decimal(str(increases)),
+                                                                        Decimal(str(decreases)))
+
+        # An account gets a checkpoint after each month it was active in; the
+        # whole ledger gets one every month so the next refresh starts from it.
+        rows = []
+        month = last or min(by_month, default=_month_start(through - timedelta(days=1)))
+        while month < through:
+            following = _next_month(month)
+            activity = by_month.get(month, {})
+            whole = list(totals.get(ALL, (Decimal('0'), Decimal('0'))))
+            for account_id, (increases, decreases) in activity.items():
+                whole[0] += increases
+                whole[1] += decreases
+                if account_id != ALL:
+                    before = totals.get(account_id, (Decimal('0'), Decimal('0')))
+                    totals[account_id] = (before[0] + increases, before[1] + decreases)
+                    rows.append((account_id, following, totals[account_id]))
+            totals[ALL] = tuple(whole)
+            rows.append((ALL, following, totals[ALL]))
+            month = following
+
+        db.session.execute(delete(BalanceCheckpoint).where(
+            BalanceCheckpoint.ledger == ledger, BalanceCheckpoint.period_start > (last or datetime.min)))
+        if rows:
+            # A Core insert, as this also runs from the after_flush hook
+            db.session.execute(insert(BalanceCheckpoint), [
+                {'ledger': ledger, 'account_id': account_id, 'period_start': period_start,
+                 'increases': increases, 'decreases': decreases}
+                for account_id, period_start, (increases, decreases) in rows])
+        return len(rows)
+
+    @staticmethod
+    def invalidate(ledger, since, account_id=None, connection=None):
+        """Drop checkpoints that include rows dated at or after `since`."""
+        stmt = delete(BalanceCheckpoint).where(BalanceCheckpoint.ledger == ledger,
+                                               BalanceCheckpoint.period_start > since)
+        if account_id:
+            stmt = stmt.where(BalanceCheckpoint.account_id.in_((account_id, ALL)))
+        (connection or db.session).execute(stmt)
+
+
+@event.listens_for(Session, 'before_flush')
+def _invalidate_backdated_checkpoints(session, flush_context, instances):
+    """Ledger rows added, edited or removed in a closed month make later checkpoints stale."""
+    current = None
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        ledger = MODEL_LEDGERS.get(type(obj))
+        if ledger is None:
+            continue
+        state = inspect(obj)
+        dates = [d for d in [obj.created_at, *state.attrs.created_at.history.deleted] if d is not None]
+        if not dates:
+            continue  # new rows default to now
+        current = current or _current_month_start()
+        since = min(d.replace(tzinfo=None) for d in dates)
+        if since >= current:
+            continue  # checkpoints never cover the open month
+
+        account_column = LEDGERS[ledger][1]
+        accounts = [None]
+        if account_column is not None:
+            history = state.attrs[account_column.key].history
+            accounts = [a for a in [getattr(obj, account_column.key), *history.deleted] if a is not None]
+        for account_id in accounts or [None]:
+            RunningBalanceController.invalidate(ledger, since, account_id, connection=session.connection())
+
+
+@event.listens_for(Session, 'after_flush')
+def _checkpoint_closed_months(session, flush_context):
+    """Ledger writes add the checkpoints of months closed since the last refresh, so ledger reads never write.
+
+    Runs after the rows are flushed, so checkpoints dropped by a backdated
+    edit in the same flush are rebuilt with that edit included.
+    """
+    ledgers = {MODEL_LEDGERS[type(obj)] for obj in (*session.new, *session.dirty, *session.deleted)
+               if type(obj) in MODEL_LEDGERS}
+    if ledgers:
+        RunningBalanceController.ensure_checkpoints(sorted(ledgers))
@@ -2,9 +2,82 @@ from models import Order, Product, OrderItem, CustomerTransaction, CashTransacti
 from extensions import db
 from datetime import datetime, timedelta, timezone
 from controllers.audit_controller import AuditController
+from controllers.balance_controller import BalanceController
+from controllers.rollup_controller import RollupController
+from controllers.inventory_controller import InventoryController
+from utils import period_bounds, filter_period, keyset_page
+from sqlalchemy import func, insert, update
 from flask_login import current_user
+import events
 
 class SalesController:
+    @staticmethod
+    def _load_products(product_ids, lock=False):
+        """{id: Product} for every id in one IN query.
+
+        With `lock`, rows are locked in ascending id order so concurrent
+        approvals always take their locks in the same order and cannot deadlock.
+        """
+        ids = sorted(set(product_ids))
+        if not ids:
+            return {}
+        query = Product.query.filter(Product.id.in_(ids)).order_by(Product.id)
+        if lock:
+            query = query.with_for_update(of=Product).populate_existing()
+        return {product.id: product for product in query}
+
+    @staticmethod
+    def _fulfil(order_id, lines, products, current_user_id):
+        """Check stock for (product_id, quantity, price) lines and take it out of inventory.
+
+        Every line is validated in memory against `products`, stock is taken with one guarded
+        UPDATE, then the stock movements are written with one bulk INSERT. Returns
+        (error, total, total_profit, rollup_lines); error is None on success.
+        """
+        needed = {}
+        for product_id, quantity, _ in lines:
+            needed[product_id] = needed.get(product_id, 0) + quantity
+        for product_id, quantity in needed.items():
+            product = products.get(product_id)
+            if product is None:
+                return f"Product #{product_id} no longer exists.", 0, 0, []
+            if product.stock_quantity < quantity:
+                return f"Not enough stock for {product.name}. Available: {product.stock_quantity}", 0, 0, []
+
+        # The guarded decrement is what actually protects stock; the check above only gives a friendly message
+        changes, short_ids = InventoryController.take(needed)
+        if short_ids:
+            db.session.rollback()
+            product = db.session.get(Product, short_ids[0])
+            return f"Not enough stock for {product.name}. Available: {product.stock_quantity}", 0, 0, []
+
+        total = 0
+        total_profit = 0
+        rollup_lines = []
+        movements = []
+        on_hand = {product_id: before for product_id, (before, _) in changes.items()}
+        for product_id, quantity, price in lines:
+            product = products[product_id]
+            total += price * quantity
+            profit = (price - float(product.cost_price or 0)) * quantity
+            total_profit += profit
+            rollup_lines.append((product_id, quantity, price * quantity, profit))
+
+            qty_before = on_hand[product_id]
+            on_hand[product_id] -= quantity
+            movements.append({
+                'product_id': product_id,
+                'quantity_change': -quantity,
+                'quantity_before': qty_before,
+                'quantity_after': on_hand[product_id],
+                'reference_type': 'sale',
+                'reference_id': order_id,
+                'user_id': current_user_id,
+            })
+
+        db.session.execute(insert(StockMovement), movements)
+        return None, total, total_profit, rollup_lines
+
     @staticmethod
     def create_order(data, current_user_id, is_admin=False):
         product_ids = data.getlist('product_id[]')
@@ -12,18 +85,24 @@ class SalesController:
         
         insufficient_stock = []
         parsed_items = []
+        requested = []
         
         for i in range(len(product_ids)):
             if product_ids[i] and quantities[i]:
                 pid = int(product_ids[i])
                 qty = int(quantities[i])
                 if qty > 0:
-                    product = db.session.get(Product, pid)
-                    if product:
-                        if qty > product.stock_quantity:
-                            insufficient_stock.append(f"{product.name} (available: {product.stock_quantity})")
-                        else:
-                            parsed_items.append((product, qty))
+                    requested.append((pid, qty))
+
+        # One IN query for every line; the admin path locks the rows it is about to decrement
+        products = SalesController._load_products([pid for pid, _ in requested], lock=is_admin)
+        for pid, qty in requested:
+            product = products.get(pid)
+            if product:
+                if qty > product.stock_quantity:
+                    insufficient_stock.append(f"{product.name} (available: {product.stock_quantity})")
+                else:
+                    parsed_items.append((product, qty))
 
         if insufficient_stock:
             return False, f"Insufficient stock for: {', '.join(insufficient_stock)}"
@@ -31,6 +110,16 @@ class SalesController:
         if not parsed_items:
             return False, "Order must contain at least one valid item."
 
+        prices = {}
+        for product, _ in parsed_items:
+            price_value = data.get(f'price_{product.id}')
+            prices[product.id] = float(price_value) if price_value else None
+
+        # Admin must provide prices via price_{product_id} fields
+        if is_admin and not all(prices.values()):
+            db.session.rollback()
+            return False, "All items must have a selling price set."
+
         order_type = data.get('order_type', 'sale')
         customer_id = data.get('customer_id') or None
         
@@ -60,49 +149,20 @@ class SalesController:
         db.session.add(new_order)
         db.session.flush()
 
-        for product, qty in parsed_items:
-            price_value = data.get(f'price_{product.id}')
-            item = OrderItem(
-                order_id=new_order.id,
-                product_id=product.id,
-                quantity=qty,
-                price=float(price_value) if price_value else None
-            )
-            db.session.add(item)
+        db.session.execute(insert(OrderItem), [
+            {'order_id': new_order.id, 'product_id': product.id, 'quantity': qty, 'price': prices[product.id],
+             'cost_price': product.cost_price}
+            for product, qty in parsed_items])
 
         # Admin direct-confirm: approve immediately
         if is_admin:
-            total = 0
-            total_profit = 0
-            
-            for item in new_order.items:
-                if not item.price:
-                    # Admin must provide prices via price_{product_id} fields
-                    db.session.rollback()
-                    return False, "All items must have a selling price set."
-                
-                product = db.session.get(Product, item.product_id, with_for_update={"of": Product})
-                if product.stock_quantity < item.quantity:
-                    db.session.rollback()
-                    return False, f"Not enough stock for {product.name}. Available: {product.stock_quantity}"
-                
-                total += float(item.price) * item.quantity
-                profit = (float(item.price) - float(product.cost_price or 0)) * item.quantity
-                total_profit += profit
-                
-                qty_before = product.stock_quantity
-                product.stock_quantity -= item.quantity
-                
-                stock_movement = StockMovement(
-                    product_id=product.id,
-                    quantity_change=-item.quantity,
-                    quantity_before=qty_before,
-                    quantity_after=product.stock_quantity,
-                    reference_type='sale',
-                    reference_id=new_order.id,
-                    user_id=current_user_id
-                )
-                db.session.add(stock_movement)
+            error, total, total_profit, lines = SalesController._fulfil(
+                new_order.id,
+                [(product.id, qty, prices[product.id]) for product, qty in parsed_items],
+                products, current_user_id)
+            if error:
+                db.session.rollback()
+                return False, error
             
             new_order.total_amount = total
             new_order.total_profit = total_profit
@@ -110,6 +170,7 @@ class SalesController:
             new_order.approved_by = current_user_id
             new_order.cam_number = data.get('cam_number')
             new_order.checked_by = data.get('checked_by')
+            RollupController.record_order(new_order, lines)
             
             try:
                 amount_paid = float(data.get('amount_paid', 0))
@@ -137,7 +198,7 @@ class SalesController:
                     reference=f"Invoice #{new_order.id}",
                     created_by=current_user_id
                 )
-                db.session.add(receivable_tx)
+                BalanceController.post(receivable_tx)
                 
                 if amount_paid > 0:
                     payment_tx = CustomerTransaction(
@@ -149,7 +210,7 @@ class SalesController:
                         reference=f"Payment for Order #{new_order.id}",
                         created_by=current_user_id
                     )
-                    db.session.add(payment_tx)
+                    BalanceController.post(payment_tx)
             
             if amount_paid > 0:
                 cash_tx = CashTransaction(
@@ -174,74 +235,78 @@ class SalesController:
             db.session.commit()
             return True, f"Order #{new_order.id} created and approved!", new_order.id
 
+        order_id = new_order.id
         db.session.commit()
+        events.publish('draft_order', {'order_id': order_id})
         return True, "Draft Order created successfully!"
 
     @staticmethod
     def get_order_by_id(order_id):
         return db.session.get(Order, order_id)
 
+    @staticmethod
+    def _not_approvable(status):
+        """Why an order in `status` (None when it no longer exists) cannot be approved."""
+        if status is None:
+            return "Order not found."
+        if status == 'approved':
+            return "Order is already approved. Cannot modify."
+        if status == 'cancelled':
+            return "Order has been cancelled. It cannot be approved."
+        return f"Only draft orders can be approved; this order is {status}."
+
     @staticmethod
     def approve_order(order_id, data, current_user_id):
-        # We process approval inside a database transaction explicitly handled by SQLAlchemy.
-        # But we could also use with_for_update() to lock the rows.
-        
         order = db.session.get(Order, order_id)
         if not order:
              return False, "Order not found."
              
-        if order.status == 'approved':
-             return False, "Order is already approved. Cannot modify."
+        if order.status != 'draft':
+             return False, SalesController._not_approvable(order.status)
              
-        total = 0
-        total_profit = 0
-
-        for item in order.items:
+        items = order.items
+        order_lines = []
+        for item in items:
             price_value = data.get(f'price_{item.id}')
             if not price_value:
                 return False, "All items must have a selling price set by Admin."
+            order_lines.append((item.product_id, item.quantity, float(price_value)))
 
-            price = float(price_value)
-            item.price = price
-            
-            # Lock the product row
-            product = db.session.get(Product, item.product_id, with_for_update={"of": Product})
+        try:
+            amount_paid = float(data.get('amount_paid', 0))
+            if amount_paid < 0:
+                return False, "Payment amount cannot be negative."
+        except (ValueError, TypeError):
+            amount_paid = 0.0
 
-            if product.stock_quantity < item.quantity:
-                db.session.rollback()
-                return False, f"Not enough stock for {product.name}. Available: {product.stock_quantity}"
+        # Claim the draft before touching stock: of two concurrent approvals only one
+        # matches status='draft', and the other stops here without taking anything.
+        claimed = db.session.execute(
+            update(Order).where(Order.id == order.id, Order.status == 'draft')
+            .values(status='approved').execution_options(synchronize_session=False)).rowcount
+        if claimed != 1:
+            # Someone else approved, cancelled or deleted it since it was read; say which
+            db.session.rollback()
+            status = db.session.query(Order.status).filter(Order.id == order_id).scalar()
+            return False, SalesController._not_approvable(status)
 
-            total += price * item.quantity
-            profit = (price - float(product.cost_price or 0)) * item.quantity
-            total_profit += profit
-            
-            # Stock reduction and movement log
-            qty_before = product.stock_quantity
-            product.stock_quantity -= item.quantity
-            
-            stock_movement = StockMovement(
-                product_id=product.id,
-                quantity_change=-item.quantity,
-                quantity_before=qty_before,
-                quantity_after=product.stock_quantity,
-                reference_type='sale',
-                reference_id=order.id,
-                user_id=current_user_id
-            )
-            db.session.add(stock_movement)
+        # Lock every product on the order with one IN query, then validate and decrement in memory
+        products = SalesController._load_products([item.product_id for item in items], lock=True)
+        error, total, total_profit, lines = SalesController._fulfil(
+            order.id, order_lines, products, current_user_id)
+        if error:
+            db.session.rollback()
+            return False, error
+
+        for item, (_, _, price) in zip(items, order_lines):
+            item.price = price
+            item.cost_price = products[item.product_id].cost_price
 
         order.total_amount = total
         order.total_profit = total_profit
         order.status = 'approved'
         order.approved_by = current_user_id
-        
-        # Handle payment from approval form
-        try:
-            amount_paid = float(data.get('amount_paid', 0))
-            if amount_paid < 0:
-                return False, "Payment amount cannot be negative."
-        except (ValueError, TypeError):
-            amount_paid = 0.0
+        RollupController.record_order(order, lines)
         
         payment_method = data.get('payment_method', 'cash')
         
@@ -268,7 +333,7 @@ class SalesController:
                 reference=f"Invoice #{order.id}",
                 created_by=current_user_id
             )
-            db.session.add(receivable_tx)
+            BalanceController.post(receivable_tx)
             
             if amount_paid > 0:
                 # Record payment against customer account
@@ -281,7 +346,7 @@ class SalesController:
                     reference=f"Payment for Order #{order.id}",
                     created_by=current_user_id
                 )
-                db.session.add(payment_tx)
+                BalanceController.post(payment_tx)
 
         if amount_paid > 0:
             # Add to Cash Book
@@ -333,7 +398,7 @@ class SalesController:
                 notes=data.get('notes', ''),
                 created_by=current_user_id
             )
-            db.session.add(transaction)
+            BalanceController.post(transaction)
             
         cash_tx = CashTransaction(
             transaction_type='in',
@@ -351,7 +416,7 @@ class SalesController:
         return True, f"Payment of Rs. {amount:,.2f} received"
 
     @staticmethod
-    def get_all_orders(order_type='all', start_date=None, end_date=None, status=None):
+    def get_all_orders(order_type='all', start_date=None, end_date=None, status=None, cursor=None):
         query = Order.query
         
         if order_type != 'all':
@@ -360,22 +425,22 @@ class SalesController:
         if status:
             query = query.filter_by(status=status)
         
-        if start_date:
-            query = query.filter(Order.created_at >= datetime.strptime(start_date, '%Y-%m-%d'))
-        if end_date:
-            query = query.filter(Order.created_at <= datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1))
-        
-        orders = query.order_by(Order.created_at.desc()).all()
-        
-        # Summary totals (from filtered approved orders only)
-        approved = [o for o in orders if o.status == 'approved']
-        cash_total = sum(float(o.total_amount) for o in approved if o.order_type == 'sale')
-        credit_total = sum(float(o.total_amount) for o in approved if o.order_type == 'credit_sale')
-        cash_count = sum(1 for o in approved if o.order_type == 'sale')
-        credit_count = sum(1 for o in approved if o.order_type == 'credit_sale')
+        start, end = period_bounds(start_date=start_date, end_date=end_date)
+        query = filter_period(query, Order.created_at, start, end)
         
+        orders, next_cursor = keyset_page(query, Order.created_at, Order.id, cursor)
+
+        # Summary totals over the whole filter (approved orders only), not just this page
+        totals = {order_type: (float(total or 0), count) for order_type, total, count in
+                  query.filter(Order.status == 'approved')
+                  .with_entities(Order.order_type, func.sum(Order.total_amount), func.count(Order.id))
+                  .group_by(Order.order_type)}
+        cash_total, cash_count = totals.get('sale', (0.0, 0))
+        credit_total, credit_count = totals.get('credit_sale', (0.0, 0))
+
         return {
             'orders': orders,
+            'next_cursor': next_cursor,
             'cash_total': cash_total,
             'credit_total': credit_total,
             'grand_total': cash_total + credit_total,
@@ -3,6 +3,8 @@ from extensions import db
 from datetime import datetime
 from flask_login import current_user
 from sqlalchemy import func, extract
+from controllers.rollup_controller import RollupController
+from utils import period_bounds, filter_period
 
 class StaffController:
     @staticmethod
@@ -49,6 +51,8 @@ class StaffController:
             created_by=current_user.id,
         )
         db.session.add(payment)
+        db.session.flush()
+        RollupController.record_staff_payment(payment.date, amount)
         db.session.commit()
         return True, f"Payment of Rs. {amount:.2f} recorded."
 
@@ -57,35 +61,28 @@ class StaffController:
         query = EmployeePayment.query.filter_by(employee_id=employee_id)
         if payment_type:
             query = query.filter_by(payment_type=payment_type)
-        if start_date:
-            query = query.filter(EmployeePayment.date >= datetime.strptime(start_date, '%Y-%m-%d'))
-        if end_date:
-            from datetime import timedelta
-            query = query.filter(EmployeePayment.date <= datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1))
+        start, end = period_bounds(start_date=start_date, end_date=end_date)
+        query = filter_period(query, EmployeePayment.date, start, end)
         return query.order_by(EmployeePayment.date.desc()).all()
 
     @staticmethod
     def get_salary_summary():
         """Returns monthly/yearly salary totals and employee count."""
         now = datetime.now(PKT)
-        month_total = db.session.query(func.sum(EmployeePayment.amount))\
-            .filter(extract('year', EmployeePayment.date) == now.year,
-                    extract('month', EmployeePayment.date) == now.month).scalar() or 0
-        year_total = db.session.query(func.sum(EmployeePayment.amount))\
-            .filter(extract('year', EmployeePayment.date) == now.year).scalar() or 0
+        start, end = period_bounds(now.year)
         emp_count = Employee.query.filter_by(is_active=True).count()
 
-        # Monthly breakdown for chart
-        monthly_data = []
-        for m in range(1, 13):
-            total = db.session.query(func.sum(EmployeePayment.amount))\
-                .filter(extract('year', EmployeePayment.date) == now.year,
-                        extract('month', EmployeePayment.date) == m).scalar() or 0
-            monthly_data.append(float(total))
+        # Monthly breakdown for chart, from one grouped query over this year's range
+        month = extract('month', EmployeePayment.date)
+        monthly_data = [0.0] * 12
+        rows = filter_period(db.session.query(month, func.sum(EmployeePayment.amount)),
+                             EmployeePayment.date, start, end).group_by(month)
+        for m, total in rows:
+            monthly_data[int(m) - 1] = float(total or 0)
 
         return {
-            'month_total': float(month_total),
-            'year_total': float(year_total),
+            'month_total': monthly_data[now.month - 1],
+            'year_total': sum(monthly_data),
             'emp_count': emp_count,
             'monthly_data': monthly_data,
         }
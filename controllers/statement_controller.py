@@ -0,0 +1,271 @@
+import os
+import tempfile
+import multiprocessing
+from decimal import Decimal
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from flask import current_app
+from sqlalchemy import case, func, select
+from models import Customer, CustomerTransaction, PKT
+from extensions import db
+from controllers.export_controller import ExportController, BATCH_SIZE, CHUNK_SIZE
+from controllers.running_balance_controller import RunningBalanceController
+from utils import period_bounds, filter_period
+
+STATEMENT_HEADERS = ['Date', 'Type', 'Reference', 'Order #', 'Debit', 'Credit', 'Balance']
+STATEMENT_FORMATS = {
+    'csv': ('csv', 'text/csv; charset=utf-8'),
+    'pdf': ('pdf', 'application/pdf'),
+}
+
+
+def _line_type(transaction_type, amount):
+    # Returns are posted as negative receivables (see ReturnController)
+    if transaction_type == 'payment':
+        return 'Payment'
+    return 'Return' if amount < 0 else 'Invoice'
+
+
+class StatementController:
+    """Customer account statements for a date range, as CSV or PDF.
+
+    The opening balance is the customer's running balance at the start date
+    (a balance checkpoint plus one aggregate); the period's lines are read
+    from a server-side cursor in date order and carry the running balance on
+    from there, so a statement never holds the customer's ledger in memory.
+    """
+
+    @staticmethod
+    def get_statement(customer_id, start, end):
+        """Opening/closing balances and period totals, with `lines` a generator over the period's entries.
+
+        `start`/`end` are half-open naive PKT bounds; either may be None.
+        Returns None for an unknown customer.
+        """
+        customer = db.session.get(Customer, customer_id)
+        if customer is None:
+            return None
+
+        opening = Decimal('0')
+        if start is not None:
+            opening = RunningBalanceController.balance_before('customer', start, account_id=customer_id)
+
+        receivable = CustomerTransaction.transaction_type == 'receivable'
+        totals = filter_period(db.session.query(
+            func.coalesce(func.sum(case((receivable & (CustomerTransaction.amount >= 0),
+                                         CustomerTransaction.amount), else_=0)), 0),
+            func.coalesce(func.sum(case((receivable & (CustomerTransaction.amount < 0),
+                                         -CustomerTransaction.amount), else_=0)), 0),
+            func.coalesce(func.sum(case((CustomerTransaction.transaction_type == 'payment',
+                                         CustomerTransaction.amount), else_=0)), 0),
+        ).filter(CustomerTransaction.customer_id == customer_id), CustomerTransaction.created_at, start, end).one()
+        receivables, returns, payments = (Decimal(str(value)) for value in totals)
+
+        return {
+            'customer': customer,
+            'start': start,
+            'end': end,
+            'opening': opening,
+            'receivables': receivables,
+            'returns': returns,
+            'payments': payments,
+            'closing': opening + receivables - returns - payments,
+            'lines': StatementController._lines(customer_id, start, end, opening),
+        }
+
+    @staticmethod
+    def _lines(customer_id, start, end, opening):
+        stmt = select(CustomerTransaction.created_at, CustomerTransaction.transaction_type,
+                      CustomerTransaction.amount, CustomerTransaction.reference, CustomerTransaction.order_id)\
+            .where(CustomerTransaction.customer_id == customer_id)
+        stmt = filter_period(stmt, CustomerTransaction.created_at, start, end)\
+            .order_by(CustomerTransaction.created_at, CustomerTransaction.id)
+
+        balance = opening
+        for created_at, transaction_type, amount, reference, order_id in \
+                db.session.execute(stmt, execution_options={'yield_per': BATCH_SIZE}):
+            amount = Decimal(str(amount or 0))
+            kind = _line_type(transaction_type, amount)
+            if kind == 'Invoice':
+                debit, credit = amount, None
+                balance += amount
+            else:
+                debit, credit = None, abs(amount)
+                balance -= credit
+            yield {'created_at': created_at, 'type': kind, 'reference': reference, 'order_id': order_id,
+                   'debit': debit, 'credit': credit, 'balance': balance}
+
+    @staticmethod
+    def iter_csv(statement):
+        """CSV chunks: an opening row, one row per entry, then the closing balance."""
+        def rows():
+            yield (statement['start'], 'Opening balance', None, None, None, None, statement['opening'])
+            for line in statement['lines']:
+                yield (line['created_at'], line['type'], line['reference'], line['order_id'],
+                       line['debit'], line['credit'], line['balance'])
+            yield (statement['end'], 'Closing balance', None, None, None, None, statement['closing'])
+
+        return ExportController.iter_csv(STATEMENT_HEADERS, rows())
+
+    @staticmethod
+    def write_pdf(statement, output):
+        """Draw the statement onto `output` (a binary file) one page at a time with a reportlab canvas.
+
+        Rows are drawn as they come off the cursor, so no table of the whole
+        period is built first.
+        """
+        from reportlab.lib.pagesizes import A4
+        from reportlab.lib import colors
+        from reportlab.lib.units import mm
+        from reportlab.pdfgen import canvas
+
+        width, height = A4
+        left, right, top, bottom = 15 * mm, width - 15 * mm, height - 15 * mm, 20 * mm
+        row_height = 5.5 * mm
+        # (x, right-aligned, characters kept) per column
+        columns = [(left, False, 16), (left + 30 * mm, False, 12), (left + 50 * mm, False, 36),
+                   (left + 112 * mm, False, 10), (left + 145 * mm, True, 16), (left + 166 * mm, True, 16),
+                   (right, True, 18)]
+        navy = colors.HexColor('#1F4E79')
+
+        def fmt(value):
+            return '' if value is None else f"{value:,.2f}"
+
+        first = statement['start'].strftime('%Y-%m-%d') if statement['start'] else 'the beginning'
+        last = statement['end'] - timedelta(days=1) if statement['end'] else datetime.now(PKT)
+        period = f"{first} to {last:%Y-%m-%d}"
+
+        pdf = canvas.Canvas(output, pagesize=A4)
+        pdf.setTitle(f"Statement - {statement['customer'].name}")
+        page = [0]
+
+        def start_page():
+            page[0] += 1
+            pdf.setFillColor(navy)
+            pdf.setFont('Helvetica-Bold', 15)
+            pdf.drawString(left, top, 'Account Statement')
+            pdf.setFillColor(colors.black)
+            pdf.setFont('Helvetica', 9)
+            pdf.drawString(left, top - 6 * mm, statement['customer'].name)
+            pdf.drawRightString(right, top, period)
+            pdf.drawRightString(right, top - 6 * mm, f"Page {page[0]}")
+            y = top - 15 * mm
+            pdf.setFillColor(navy)
+            pdf.rect(left - 1 * mm, y - 1.5 * mm, right - left + 2 * mm, row_height, stroke=0, fill=1)
+            pdf.setFillColor(colors.white)
+            draw_row(y, STATEMENT_HEADERS, bold=True)
+            pdf.setFillColor(colors.black)
+            return y - row_height
+
+        def draw_row(y, cells, bold=False):
+            pdf.setFont('Helvetica-Bold' if bold else 'Helvetica', 8)
+            for (x, align_right, size), value in zip(columns, cells):
+                text = str(value or '')[:size]
+                if align_right:
+                    pdf.drawRightString(x, y, text)
+                else:
+                    pdf.drawString(x, y, text)
+
+        y = start_page()
+        draw_row(y, ['', 'Opening balance', '', '', '', '', fmt(statement['opening'])], bold=True)
+        y -= row_height
+        for line in statement['lines']:
+            if y < bottom:
+                pdf.showPage()
+                y = start_page()
+            draw_row(y, [line['created_at'].strftime('%Y-%m-%d %H:%M'), line['type'], line['reference'],
+                         f"#{line['order_id']}" if line['order_id'] else '', fmt(line['debit']),
+                         fmt(line['credit']), fmt(line['balance'])])
+            y -= row_height
+
+        summary = [('Opening balance', statement['opening']), ('Invoices', statement['receivables']),
+                   ('Returns', -statement['returns']), ('Payments', -statement['payments']),
+                   ('Closing balance', statement['closing'])]
+        if y - row_height * (len(summary) + 1) < bottom:
+            pdf.showPage()
+            y = start_page()
+        y -= row_height
+        summary_left = columns[3][0]
+        pdf.line(summary_left, y + row_height - 1.5 * mm, right, y + row_height - 1.5 * mm)
+        for label, value in summary:
+            pdf.setFont('Helvetica-Bold' if label == 'Closing balance' else 'Helvetica', 9)
+            pdf.drawString(summary_left, y, label)
+            pdf.drawRightString(right, y, f"Rs. {value:,.2f}")
+            y -= row_height
+        pdf.save()
+
+    @staticmethod
+    def iter_pdf(statement):
+        """PDF byte chunks; the file is drawn into a temporary file and read back in chunks."""
+        with tempfile.TemporaryFile() as output:
+            StatementController.write_pdf(statement, output)
+            output.seek(0)
+            while chunk := output.read(CHUNK_SIZE):
+                yield chunk
+
+    @staticmethod
+    def write(statement, fmt, path):
+        """Write a statement to `path` atomically."""
+        directory = os.path.dirname(path)
+        fd, tmp = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'wb') as output:
+            if fmt == 'pdf':
+                StatementController.write_pdf(statement, output)
+            else:
+                for chunk in StatementController.iter_csv(statement):
+                    output.write(chunk.encode('utf-8'))
+        os.replace(tmp, path)
+
+    @staticmethod
+    def debtor_ids():
+        return [customer_id for (customer_id,) in
+                db.session.query(Customer.id).filter(Customer.balance > 0).order_by(Customer.id)]
+
+    @staticmethod
+    def render_batch(year, month, output_dir, fmt='pdf', workers=None, progress=None):
+        """Write the month's statement for every customer with a balance, across a pool of processes.
+
+        Each worker process builds its own app and database connections and
+        renders whole statements, so the CPU-bound PDF drawing runs in
+        parallel. Returns [(customer_id, path)] in customer order.
+        """
+        start, end = period_bounds(year, month)
+        ext, _ = STATEMENT_FORMATS[fmt]
+        os.makedirs(output_dir, exist_ok=True)
+        # Checkpoint writes happen here once, not in every worker
+        RunningBalanceController.refresh_checkpoints()
+        customer_ids = StatementController.debtor_ids()
+        db.session.remove()
+
+        overrides = {'SQLALCHEMY_DATABASE_URI': current_app.config['SQLALCHEMY_DATABASE_URI']}
+        paths = {}
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_worker, initargs=(overrides,)) as pool:
+            futures = [pool.submit(_render_statement, customer_id, start, end, fmt,
+                                   os.path.join(output_dir, f"statement_{customer_id}_{year}-{month:02d}.{ext}"))
+                       for customer_id in customer_ids]
+            for future in as_completed(futures):
+                customer_id, path = future.result()
+                paths[customer_id] = path
+                if progress:
+                    progress(customer_id, path)
+        return [(customer_id, paths[customer_id]) for customer_id in customer_ids]
+
+
+# Batch worker processes (see render_batch)
+_worker_app = None
+
+
+def _init_worker(overrides):
+    global _worker_app
+    from app import create_app
+    _worker_app = create_app(overrides)
+
+
+def _render_statement(customer_id, start, end, fmt, path):
+    with _worker_app.app_context():
+        try:
+            StatementController.write(StatementController.get_statement(customer_id, start, end), fmt, path)
+        finally:
+            db.session.remove()
+    return customer_id, path
@@ -0,0 +1,236 @@
+"""Publish/subscribe channel that pushes events to open browser tabs over SSE.
+
+The broker is picked by the EVENT_BROKER setting:
+
+    local            events stay inside one process (development server, waitress)
+    file:<path>      processes on the same host share an append-only file
+                     (gunicorn workers; set by gunicorn.conf.py)
+
+Subscribers wait on a condition variable or watch the file size, so an idle
+stream costs no database queries.
+"""
+import os
+import json
+import time
+import threading
+from collections import deque
+from flask import current_app
+
+
+# Control event streams publish when they open; never forwarded to the browser
+STREAM_OPENED = '_stream_opened'
+
+
+class LocalBroker:
+    """Keeps the most recent events in memory; ids are a per-process sequence."""
+
+    def __init__(self, history=200):
+        self._changed = threading.Condition()
+        self._events = deque(maxlen=history)
+        self._last_id = 0
+
+    def publish(self, event, data):
+        with self._changed:
+            self._last_id += 1
+            self._events.append((self._last_id, event, data))
+            self._changed.notify_all()
+
+    def last_id(self):
+        with self._changed:
+            return self._last_id
+
+    def wait(self, after_id, timeout):
+        """Return [(id, event, data)] newer than after_id, waiting up to `timeout` seconds."""
+        with self._changed:
+            self._changed.wait_for(lambda: self._last_id > after_id, timeout)
+            return [e for e in self._events if e[0] > after_id]
+
+
+class FileBroker:
+    """Events appended as JSON lines to a shared file.
+
+    The first line records the file's generation. Once the file is large a
+    publisher starts a new one with the next generation and keeps the old file
+    beside it as <path>.1. An event's id is its generation times ID_SPAN plus
+    its end offset, so ids keep increasing when the file starts over, and a
+    reader resuming from the previous generation finishes <path>.1 before
+    reading the new file from the top.
+    """
+
+    ID_SPAN = 1 << 32
+
+    def __init__(self, path, max_bytes=1024 * 1024, poll_interval=0.5):
+        if max_bytes >= self.ID_SPAN:
+            raise ValueError(f"FileBroker max_bytes must be below {self.ID_SPAN}")
+        self.path = path
+        self.max_bytes = max_bytes
+        self.poll_interval = poll_interval
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._append(b'')
+
+    @staticmethod
+    def _header(f):
+        """(generation, header length) of an open event file; (None, 0) if it has no header."""
+        line = f.readline()
+        try:
+            return int(json.loads(line)['generation']), len(line)
+        except (ValueError, KeyError, TypeError):
+            return None, 0
+
+    def _position(self):
+        """(generation, size) of the current file."""
+        try:
+            with open(self.path, 'rb') as f:
+                return self._header(f)[0], os.fstat(f.fileno()).st_size
+        except OSError:
+            return None, 0
+
+    def _append(self, line):
+        import fcntl  # FileBroker is only used under gunicorn, which needs a POSIX host
+        with open(self.path + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)  # released when the lock file closes
+            generation, size = self._position()
+            if generation is None or size + len(line) > self.max_bytes:
+                self._start_over(generation)
+            if line:
+                with open(self.path, 'ab') as f:
+                    f.write(line)
+
+    def _start_over(self, generation):
+        # Generations come from the clock so they keep moving forward even if
+        # the files are deleted between restarts
+        following = max(int(time.time()), (generation or 0) + 1)
+        with open(self.path + '.new', 'wb') as f:
+            f.write((json.dumps({'generation': following}) + '\n').encode())
+        if generation is not None:
+            # Link rather than rename so readers never find the path missing
+            previous = self.path + '.1'
+            if os.path.exists(previous + '.new'):
+                os.remove(previous + '.new')
+            os.link(self.path, previous + '.new')
+            os.replace(previous + '.new', previous)
+        os.replace(self.path + '.new', self.path)
+
+    def _events(self, f, after_id):
+        """[(id, event, data)] from an open file positioned at after_id's offset."""
+        events, offset = [], after_id % self.ID_SPAN
+        base = after_id - offset
+        for line in f.read().splitlines(keepends=True):
+            if not line.endswith(b'\n'):
+                break  # a publisher is still writing it
+            offset += len(line)
+            record = json.loads(line)
+            events.append((base + offset, record['event'], record['data']))
+        return events
+
+    def _read(self, after_id):
+        """(events newer than after_id, id to wait after next)."""
+        try:
+            f = open(self.path, 'rb')
+        except OSError:
+            return [], after_id
+        with f:
+            generation, header = self._header(f)
+            if generation is None:
+                return [], after_id
+            base = generation * self.ID_SPAN
+            if after_id < base:
+                # The file started over since after_id: finish the previous one first
+                earlier = self._read_previous(after_id)
+                if earlier:
+                    return earlier, after_id
+                after_id = base + header
+            elif after_id >= base + self.ID_SPAN:
+                # Newer than anything written here; wait for whatever comes next
+                return [], base + os.fstat(f.fileno()).st_size
+            after_id = max(after_id, base + header)
+            f.seek(after_id - base)
+            return self._events(f, after_id), after_id
+
+    def _read_previous(self, after_id):
+        try:
+            with open(self.path + '.1', 'rb') as f:
+                if self._header(f)[0] != after_id // self.ID_SPAN:
+                    return []  # more than one generation behind; those events are gone
+                f.seek(after_id % self.ID_SPAN)
+                return self._events(f, after_id)
+        except OSError:
+            return []
+
+    def publish(self, event, data):
+        self._append((json.dumps({'event': event, 'data': data}) + '\n').encode())
+
+    def last_id(self):
+        generation, size = self._position()
+        return (generation or 0) * self.ID_SPAN + size
+
+    def wait(self, after_id, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            events, after_id = self._read(after_id)
+            if events or time.monotonic() >= deadline:
+                return events
+            time.sleep(self.poll_interval)
+
+
+def make_broker(url):
+    if url.startswith('file:'):
+        return FileBroker(url[len('file:'):])
+    if url != 'local':
+        raise ValueError(f"Unknown EVENT_BROKER {url!r}; use 'local' or 'file:<path>'.")
+    return LocalBroker()
+
+
+def init_app(app):
+    app.extensions['events'] = make_broker(app.config.get('EVENT_BROKER', 'local'))
+
+
+def publish(event, data):
+    broker = current_app.extensions.get('events')
+    if broker is not None:  # apps built without init_app (scripts) have no listeners
+        broker.publish(event, data)
+
+
+def stream(last_event_id=None, session_id=None, heartbeat=5, lifetime=60):
+    """SSE body for events newer than `last_event_id` (or from now on).
+
+    Sends a comment every `heartbeat` seconds so a closed tab's connection is
+    noticed within that time, and ends after `lifetime` seconds; EventSource
+    reconnects with Last-Event-ID and nothing is missed. Each stream holds a
+    server thread, so a browser session keeps only one: opening a stream with
+    the same `session_id` (in any worker) ends the older one with a
+    `superseded` event, and that tab stays closed until it is shown again.
+    """
+    broker = current_app.extensions['events']
+    latest = broker.last_id()
+    try:
+        after = min(int(last_event_id), latest)
+    except (TypeError, ValueError):
+        after = latest
+    token = os.urandom(8).hex()
+    if session_id is not None:
+        broker.publish(STREAM_OPENED, {'session': session_id, 'token': token})
+
+    def superseded(event_id, event, data):
+        # Only streams opened after this one count; older ones are history being replayed
+        return (event == STREAM_OPENED and event_id > latest and data['session'] == session_id
+                and data['token'] != token)
+
+    def generate(after):
+        deadline = time.monotonic() + lifetime
+        yield 'retry: 3000\n\n'
+        while time.monotonic() < deadline:
+            events = broker.wait(after, min(heartbeat, max(deadline - time.monotonic(), 0)))
+            if not events:
+                yield ': keep-alive\n\n'
+                continue
+            for event_id, event, data in events:
+                after = event_id
+                if superseded(event_id, event, data):
+                    yield 'event: superseded\ndata: {}\n\n'
+                    return
+                if event == STREAM_OPENED:
+                    continue
+                yield f'id: {event_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n'
+
+    return generate(after)
@@ -0,0 +1,37 @@
+import os
+import sys
+import tempfile
+import subprocess
+
+bind = os.environ.get('BIND', '0.0.0.0:8080')
+# SQLite allows one writer at a time, so a few processes with several threads
+# each serve the counters better than many single-threaded workers.
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_class = 'gthread'
+# Each admin browser session holds one thread for its notification stream
+threads = int(os.environ.get('THREADS', 16))
+timeout = int(os.environ.get('WORKER_TIMEOUT', 60))
+accesslog = '-'
+
+# Workers are separate processes, so new-order events go through a shared file
+os.environ.setdefault('EVENT_BROKER', 'file:' + os.path.join(tempfile.gettempdir(), 'flask-pos-events.log'))
+
+
+def on_starting(server):
+    """Create tables, apply migrations and seed users once, before any worker starts."""
+    from app import create_app, initialize_database
+    initialize_database(create_app())
+
+
+def when_ready(server):
+    """Render PDF/Excel reports in a process of their own so they never hold up the web workers."""
+    command = [sys.executable, '-m', 'flask', '--app', 'wsgi', 'report-worker',
+               '--threads', os.environ.get('REPORT_WORKER_THREADS', '1')]
+    server.report_worker = subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)))
+
+
+def on_exit(server):
+    worker = getattr(server, 'report_worker', None)
+    if worker is not None:
+        worker.terminate()
+        worker.wait(timeout=30)
@@ -0,0 +1,62 @@
+"""Background workers for report jobs (see ReportJobController).
+
+The report_job table is the queue. Workers claim the oldest queued job with a
+compare-and-set UPDATE, render it and store the output in the artifact store,
+so PDF and Excel rendering never runs on a request thread.
+
+    REPORT_WORKER_THREADS=1      worker threads started by wsgi.py (waitress)
+                                 and app.py (development server)
+    flask --app app report-worker
+                                 a separate worker process; gunicorn.conf.py
+                                 starts one next to the web workers
+
+Requests wake the in-process workers; other processes notice new jobs within
+REPORT_JOB_POLL_SECONDS.
+"""
+import os
+import threading
+
+_wakeup = threading.Event()
+
+
+def wake():
+    """Tell this process's workers a job was queued."""
+    _wakeup.set()
+
+
+def run_worker(app, stop=None, poll_seconds=None, max_jobs=None):
+    """Claim and run jobs until `stop` is set (or `max_jobs` have run)."""
+    from extensions import db
+    from controllers.report_job_controller import ReportJobController
+
+    stop = stop or threading.Event()
+    poll_seconds = poll_seconds or app.config['REPORT_JOB_POLL_SECONDS']
+    done = 0
+    while not stop.is_set() and (max_jobs is None or done < max_jobs):
+        _wakeup.clear()  # a job queued from here on wakes the wait below
+        with app.app_context():
+            try:
+                job = ReportJobController.claim()
+                if job is not None:
+                    ReportJobController.run(job)
+                    done += 1
+            except Exception:
+                app.logger.exception('Report worker error')
+                job = None
+            finally:
+                db.session.remove()
+        if job is None:
+            _wakeup.wait(poll_seconds)
+    return done
+
+
+def init_app(app):
+    if not app.config.get('REPORT_ARTIFACT_DIR'):
+        app.config['REPORT_ARTIFACT_DIR'] = os.path.join(app.instance_path, 'report_artifacts')
+
+
+def start_workers(app, count=None):
+    """Run `count` (default REPORT_WORKER_THREADS) workers as daemon threads of this process."""
+    count = app.config['REPORT_WORKER_THREADS'] if count is None else count
+    for i in range(count):
+        threading.Thread(target=run_worker, args=(app,), name=f'report-worker-{i}', daemon=True).start()
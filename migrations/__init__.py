@@ -0,0 +1,91 @@
+"""Versioned schema migrations.
+
+`db.create_all()` only creates missing tables; it never adds columns or
+indexes to tables that already exist. Changes to an existing schema live
+here as modules named `vNNNN_<slug>.py`, each exposing `upgrade(conn)`,
+`backfill()`, or both. Applied versions are recorded in the `schema_migrations`
+table and each migration runs in its own transaction, so a failure leaves
+earlier ones in place and the next run resumes from the failed version.
+
+`backfill()` is a data step that needs the application (the ORM session and
+the controllers), such as filling a new table from existing rows. It runs
+after the migration's `upgrade(conn)` has committed, and the version is
+recorded only once it returns, so an interrupted backfill runs again on the
+next upgrade and must be safe to repeat.
+"""
+import re
+import pkgutil
+import importlib
+from datetime import datetime
+from sqlalchemy import text
+from extensions import db
+
+_MODULE_PATTERN = re.compile(r'^v(\d{4})_(\w+)$')
+
+
+def discover():
+    """Return [(version, name, module)] for every migration module, oldest first."""
+    found = []
+    for info in pkgutil.iter_modules(__path__):
+        match = _MODULE_PATTERN.match(info.name)
+        if match:
+            module = importlib.import_module(f'{__name__}.{info.name}')
+            found.append((int(match.group(1)), match.group(2), module))
+    return sorted(found, key=lambda m: m[0])
+
+
+def _ensure_version_table(conn):
+    conn.execute(text(
+        'CREATE TABLE IF NOT EXISTS schema_migrations ('
+        'version INTEGER PRIMARY KEY, '
+        'name VARCHAR(100) NOT NULL, '
+        'applied_at DATETIME NOT NULL)'
+    ))
+
+
+def applied_versions(engine=None):
+    engine = engine or db.engine
+    with engine.begin() as conn:
+        _ensure_version_table(conn)
+        return {row[0] for row in conn.execute(text('SELECT version FROM schema_migrations'))}
+
+
+def status(engine=None):
+    """Return [(version, name, applied)] for every known migration."""
+    applied = applied_versions(engine)
+    return [(version, name, version in applied) for version, name, _ in discover()]
+
+
+def _record(conn, version, name):
+    conn.execute(
+        text('INSERT INTO schema_migrations (version, name, applied_at) '
+             'VALUES (:version, :name, :applied_at)'),
+        {'version': version, 'name': name, 'applied_at': datetime.now()})
+
+
+def upgrade(engine=None, progress=None):
+    """Apply every pending migration in version order. Returns the versions applied.
+
+    Backfills run through `db.session`, so call this inside an app context.
+    """
+    engine = engine or db.engine
+    applied = applied_versions(engine)
+    done = []
+    for version, name, module in discover():
+        if version in applied:
+            continue
+        backfill = getattr(module, 'backfill', None)
+        with engine.begin() as conn:
+            if hasattr(module, 'upgrade'):
+                module.upgrade(conn)
+            if backfill is None:
+                _record(conn, version, name)
+        if backfill is not None:
+            backfill()
+            db.session.commit()
+            with engine.begin() as conn:
+                _record(conn, version, name)
+        done.append(version)
+        if progress:
+            progress(version, name)
+    return done
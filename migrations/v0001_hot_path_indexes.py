@@ -0,0 +1,55 @@
+"""Composite indexes for the dashboard, history, aging and ledger filters."""
+from sqlalchemy import text
+
+# (index name, table, columns) — kept in step with the models' __table_args__
+INDEXES = [
+    ('ix_product_active_stock', 'product', ('is_active', 'stock_quantity')),
+
+    ('ix_order_created_at', 'order', ('created_at',)),
+    ('ix_order_status_created_at', 'order', ('status', 'created_at')),
+    ('ix_order_type_created_at', 'order', ('order_type', 'created_at')),
+    ('ix_order_customer_created_at', 'order', ('customer_id', 'created_at')),
+    ('ix_order_status_type_due_date', 'order', ('status', 'order_type', 'due_date')),
+    ('ix_order_created_by_created_at', 'order', ('created_by', 'created_at')),
+
+    ('ix_order_item_order_id', 'order_item', ('order_id',)),
+    ('ix_order_item_product_id', 'order_item', ('product_id',)),
+
+    ('ix_purchase_order_status_created_at', 'purchase_order', ('status', 'created_at')),
+    ('ix_purchase_order_payment_status_created_at', 'purchase_order', ('payment_status', 'created_at')),
+    ('ix_purchase_order_distributor_created_at', 'purchase_order', ('distributor_id', 'created_at')),
+
+    ('ix_purchase_order_item_purchase_order_id', 'purchase_order_item', ('purchase_order_id',)),
+    ('ix_purchase_order_item_product_id', 'purchase_order_item', ('product_id',)),
+
+    ('ix_customer_transaction_customer_created_at', 'customer_transaction', ('customer_id', 'created_at')),
+    ('ix_customer_transaction_customer_type', 'customer_transaction', ('customer_id', 'transaction_type')),
+    ('ix_customer_transaction_type_created_at', 'customer_transaction', ('transaction_type', 'created_at')),
+    ('ix_customer_transaction_created_at', 'customer_transaction', ('created_at',)),
+
+    ('ix_supplier_transaction_distributor_created_at', 'supplier_transaction', ('distributor_id', 'created_at')),
+    ('ix_supplier_transaction_distributor_type', 'supplier_transaction', ('distributor_id', 'transaction_type')),
+    ('ix_supplier_transaction_type_created_at', 'supplier_transaction', ('transaction_type', 'created_at')),
+    ('ix_supplier_transaction_created_at', 'supplier_transaction', ('created_at',)),
+
+    ('ix_cash_transaction_created_at', 'cash_transaction', ('created_at',)),
+    ('ix_cash_transaction_type_created_at', 'cash_transaction', ('transaction_type', 'created_at')),
+
+    ('ix_stock_movement_product_timestamp', 'stock_movement', ('product_id', 'timestamp')),
+    ('ix_stock_movement_reference_timestamp', 'stock_movement', ('reference_type', 'timestamp')),
+    ('ix_stock_movement_timestamp', 'stock_movement', ('timestamp',)),
+
+    ('ix_expense_expense_date', 'expense', ('expense_date',)),
+
+    ('ix_employee_payment_date', 'employee_payment', ('date',)),
+    ('ix_employee_payment_employee_date', 'employee_payment', ('employee_id', 'date')),
+]
+
+
+def upgrade(conn):
+    quote = conn.dialect.identifier_preparer.quote
+    for name, table, columns in INDEXES:
+        conn.execute(text(
+            f'CREATE INDEX IF NOT EXISTS {quote(name)} ON {quote(table)} '
+            f'({", ".join(quote(c) for c in columns)})'
+        ))
@@ -0,0 +1,24 @@
+"""Stored customer/distributor balances for databases created before they existed."""
+from sqlalchemy import inspect, text
+
+# table, ledger table, ledger foreign key, transaction type that increases the balance
+ACCOUNTS = [
+    ('customer', 'customer_transaction', 'customer_id', 'receivable'),
+    ('distributor', 'supplier_transaction', 'distributor_id', 'payable'),
+]
+
+
+def upgrade(conn):
+    inspector = inspect(conn)
+    for table, ledger, foreign_key, increasing in ACCOUNTS:
+        columns = {c['name'] for c in inspector.get_columns(table)}
+        if 'balance' not in columns:
+            conn.execute(text(
+                f'ALTER TABLE {table} ADD COLUMN balance NUMERIC(12, 2) NOT NULL DEFAULT 0'))
+            conn.execute(text(
+                f'UPDATE {table} SET balance = COALESCE(('
+                f'SELECT SUM(CASE WHEN l.transaction_type = :increasing THEN l.amount '
+                f"WHEN l.transaction_type = 'payment' THEN -l.amount ELSE 0 END) "
+                f'FROM {ledger} l WHERE l.{foreign_key} = {table}.id), 0)'
+            ), {'increasing': increasing})
+        conn.execute(text(f'CREATE INDEX IF NOT EXISTS ix_{table}_balance ON {table} (balance)'))
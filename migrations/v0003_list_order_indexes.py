@@ -0,0 +1,17 @@
+"""Indexes backing the newest-first keyset pagination of purchase orders and customers."""
+from sqlalchemy import text
+
+# (index name, table, columns) — kept in step with the models' __table_args__
+INDEXES = [
+    ('ix_purchase_order_created_at', 'purchase_order', ('created_at',)),
+    ('ix_customer_created_at', 'customer', ('created_at',)),
+]
+
+
+def upgrade(conn):
+    quote = conn.dialect.identifier_preparer.quote
+    for name, table, columns in INDEXES:
+        conn.execute(text(
+            f'CREATE INDEX IF NOT EXISTS {quote(name)} ON {quote(table)} '
+            f'({", ".join(quote(c) for c in columns)})'
+        ))
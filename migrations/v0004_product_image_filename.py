@@ -0,0 +1,51 @@
+"""Store each product's image file name instead of globbing static/product_images per access.
+
+Existing `<name>_img.<ext>` files are renamed to their content-hashed name and
+recorded on the product, so they get the same long-lived URLs as new uploads.
+Safe to run again after an interrupted run: a file already under its hashed
+name hashes to that same name and is recorded as it is, and a file that is
+gone or unreadable is skipped.
+"""
+import os
+import glob
+import hashlib
+from sqlalchemy import inspect, text
+from werkzeug.utils import secure_filename
+
+IMAGES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'static', 'product_images')
+
+
+def _hashed_name(path, base_name):
+    # Same scheme as utils.product_image_filename
+    with open(path, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()[:12]
+    return f"{base_name}.{digest}{os.path.splitext(path)[1].lower()}"
+
+
+def upgrade(conn):
+    columns = {c['name'] for c in inspect(conn).get_columns('product')}
+    if 'image_filename' not in columns:
+        conn.execute(text('ALTER TABLE product ADD COLUMN image_filename VARCHAR(255)'))
+
+    if not os.path.isdir(IMAGES_DIR):
+        return
+    products = conn.execute(text('SELECT id, name FROM product WHERE image_filename IS NULL')).all()
+    for product_id, name in products:
+        base_name = f"{secure_filename(name)}_img"
+        filename = None
+        for path in sorted(glob.glob(os.path.join(IMAGES_DIR, f"{glob.escape(base_name)}.*"))):
+            try:
+                filename = _hashed_name(path, base_name)
+            except OSError:
+                continue  # removed since the glob, or unreadable
+            target = os.path.join(IMAGES_DIR, filename)
+            if not os.path.exists(target):
+                try:
+                    os.replace(path, target)
+                except OSError:
+                    filename = os.path.basename(path)
+            break
+        if filename is None:
+            continue
+        conn.execute(text('UPDATE product SET image_filename = :filename WHERE id = :id'),
+                     {'filename': filename, 'id': product_id})
@@ -0,0 +1,42 @@
+"""Full-text index over the product catalog for the typeahead search.
+
+`product_fts` is an external-content FTS5 table: it stores only the index and
+reads column values from `product`. Triggers keep it in step with inserts,
+deletes and edits of the searchable columns (stock and price updates do not
+touch it). Builds of SQLite without FTS5 skip it and search falls back to LIKE.
+"""
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+COLUMNS = ('name', 'sku', 'part_number', 'brand', 'target_vehicle')
+
+
+def upgrade(conn):
+    conn.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_product_active_created_at ON product (is_active, created_at)'))
+    if conn.dialect.name != 'sqlite':
+        return
+
+    columns = ', '.join(COLUMNS)
+    new_values = ', '.join(f'new.{c}' for c in COLUMNS)
+    old_values = ', '.join(f'old.{c}' for c in COLUMNS)
+    try:
+        with conn.begin_nested():
+            conn.execute(text(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS product_fts USING fts5("
+                f"{columns}, content='product', content_rowid='id', "
+                f"tokenize='unicode61 remove_diacritics 2', prefix='2 3')"))
+    except OperationalError:
+        return  # no FTS5 in this SQLite build
+
+    conn.execute(text(
+        f"CREATE TRIGGER IF NOT EXISTS product_fts_ai AFTER INSERT ON product BEGIN "
+        f"INSERT INTO product_fts(rowid, {columns}) VALUES (new.id, {new_values}); END"))
+    conn.execute(text(
+        f"CREATE TRIGGER IF NOT EXISTS product_fts_ad AFTER DELETE ON product BEGIN "
+        f"INSERT INTO product_fts(product_fts, rowid, {columns}) VALUES ('delete', old.id, {old_values}); END"))
+    conn.execute(text(
+        f"CREATE TRIGGER IF NOT EXISTS product_fts_au AFTER UPDATE OF {columns} ON product BEGIN "
+        f"INSERT INTO product_fts(product_fts, rowid, {columns}) VALUES ('delete', old.id, {old_values}); "
+        f"INSERT INTO product_fts(rowid, {columns}) VALUES (new.id, {new_values}); END"))
+    conn.execute(text("INSERT INTO product_fts(product_fts) VALUES ('rebuild')"))
@@ -0,0 +1,18 @@
+"""Indexed prefix lookup of customers by name and by normalized phone number."""
+from sqlalchemy import inspect, text
+from models import normalize_phone
+
+
+def upgrade(conn):
+    columns = {c['name'] for c in inspect(conn).get_columns('customer')}
+    if 'phone_normalized' not in columns:
+        conn.execute(text('ALTER TABLE customer ADD COLUMN phone_normalized VARCHAR(20)'))
+
+    rows = conn.execute(text(
+        'SELECT id, phone FROM customer WHERE phone IS NOT NULL AND phone_normalized IS NULL')).all()
+    if rows:
+        conn.execute(text('UPDATE customer SET phone_normalized = :phone WHERE id = :id'),
+                     [{'id': row_id, 'phone': normalize_phone(phone)} for row_id, phone in rows])
+
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_customer_name_lower ON customer (lower(name))'))
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_customer_phone_normalized ON customer (phone_normalized)'))
@@ -0,0 +1,10 @@
+"""Month-start ledger totals that running balances start from.
+
+The table is filled by the `refresh-balance-checkpoints` command, or by the
+first ledger write after a month closes.
+"""
+from models import BalanceCheckpoint
+
+
+def upgrade(conn):
+    BalanceCheckpoint.__table__.create(conn, checkfirst=True)
@@ -0,0 +1,6 @@
+"""Queue table for PDF/Excel reports rendered by background workers (jobs.py)."""
+from models import ReportJob
+
+
+def upgrade(conn):
+    ReportJob.__table__.create(conn, checkfirst=True)
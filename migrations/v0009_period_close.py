@@ -0,0 +1,6 @@
+"""Closed months and the frozen report figures served for them."""
+from models import PeriodClose
+
+
+def upgrade(conn):
+    PeriodClose.__table__.create(conn, checkfirst=True)
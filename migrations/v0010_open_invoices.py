@@ -0,0 +1,29 @@
+"""Generated balance_due / is_open columns and open-invoice partial indexes."""
+from sqlalchemy import inspect, text
+from models import Order, PurchaseOrder, BALANCE_DUE_SQL, ORDER_OPEN_SQL, PURCHASE_ORDER_OPEN_SQL
+
+# model, is_open expression
+INVOICES = [
+    (Order, ORDER_OPEN_SQL),
+    (PurchaseOrder, PURCHASE_ORDER_OPEN_SQL),
+]
+
+
+def upgrade(conn):
+    quote = conn.dialect.identifier_preparer.quote
+    # SQLite can only add VIRTUAL generated columns to an existing table (they
+    # can still be indexed); PostgreSQL only has STORED ones. Both compute the
+    # value for every existing row as the column is added, which is the backfill.
+    kind = 'VIRTUAL' if conn.dialect.name == 'sqlite' else 'STORED'
+    for model, open_sql in INVOICES:
+        table = model.__tablename__
+        columns = {c['name'] for c in inspect(conn).get_columns(table)}
+        if 'balance_due' not in columns:
+            conn.execute(text(f'ALTER TABLE {quote(table)} ADD COLUMN balance_due NUMERIC(12, 2) '
+                              f'GENERATED ALWAYS AS ({BALANCE_DUE_SQL}) {kind}'))
+        if 'is_open' not in columns:
+            conn.execute(text(f'ALTER TABLE {quote(table)} ADD COLUMN is_open BOOLEAN '
+                              f'GENERATED ALWAYS AS ({open_sql}) {kind}'))
+        for index in model.__table__.indexes:
+            if index.name.startswith(f'ix_{table}_open_'):
+                index.create(conn, checkfirst=True)
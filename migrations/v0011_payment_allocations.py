@@ -0,0 +1,6 @@
+"""Links from customer payments to the invoices they settled."""
+from models import PaymentAllocation
+
+
+def upgrade(conn):
+    PaymentAllocation.__table__.create(conn, checkfirst=True)
@@ -0,0 +1,6 @@
+"""Links from supplier payments to the purchase orders they settled."""
+from models import SupplierPaymentAllocation
+
+
+def upgrade(conn):
+    SupplierPaymentAllocation.__table__.create(conn, checkfirst=True)
@@ -0,0 +1,14 @@
+"""posted_on on orders and purchase orders, so rollup rebuilds replay figures posted late."""
+from sqlalchemy import inspect, text
+from models import Order, PurchaseOrder
+
+
+def upgrade(conn):
+    quote = conn.dialect.identifier_preparer.quote
+    for model in (Order, PurchaseOrder):
+        table = model.__tablename__
+        if 'posted_on' not in {c['name'] for c in inspect(conn).get_columns(table)}:
+            conn.execute(text(f'ALTER TABLE {quote(table)} ADD COLUMN posted_on DATE'))
+        for index in model.__table__.indexes:
+            if index.name == f'ix_{table}_posted_on':
+                index.create(conn, checkfirst=True)
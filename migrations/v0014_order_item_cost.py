@@ -0,0 +1,16 @@
+"""cost_price on order lines, so rollup rebuilds use the cost a line was sold at.
+
+Lines sold before this column existed get the product's current cost price,
+which is what the dashboards showed for them until now; from here on a
+change in cost (weighted-average receiving) no longer rewrites their profit.
+"""
+from sqlalchemy import inspect, text
+
+
+def upgrade(conn):
+    if 'cost_price' not in {c['name'] for c in inspect(conn).get_columns('order_item')}:
+        conn.execute(text('ALTER TABLE order_item ADD COLUMN cost_price NUMERIC(12, 2)'))
+    conn.execute(text(
+        'UPDATE order_item SET cost_price = '
+        '(SELECT product.cost_price FROM product WHERE product.id = order_item.product_id) '
+        'WHERE cost_price IS NULL'))
@@ -0,0 +1,12 @@
+"""Fill the daily rollups from the orders, purchases, expenses and payments already stored.
+
+`create_all` adds the daily_summary and product_daily_sales tables empty, so
+on a database with history every dashboard, monthly report and top-product
+list read zero for the past until someone ran `rebuild-rollups`. A fresh
+database has nothing to rebuild. Closed months keep their snapshot.
+"""
+from controllers.rollup_controller import RollupController
+
+
+def backfill():
+    RollupController.rebuild()
@@ -1,10 +1,35 @@
+import re
 from flask_login import UserMixin
 from datetime import datetime, timezone, timedelta
+from sqlalchemy.orm import validates
 from extensions import db
 
 # Pakistan Standard Time (UTC+5)
 PKT = timezone(timedelta(hours=5))
 
+# Purchase order payment states that still carry an unpaid balance
+OPEN_PAYMENT_STATUSES = ('pending', 'partial')
+
+# Open invoices: the database keeps `balance_due` and `is_open` on orders and
+# purchase orders (generated columns), and the partial indexes below cover only
+# open rows, so outstanding/aging/reminder queries never scan settled invoices.
+# Filter with `Model.is_open == True` so the query matches the index predicate.
+# The indexes repeat is_open as a key column: without ANALYZE statistics SQLite
+# otherwise ties them with the full indexes on the same leading columns.
+BALANCE_DUE_SQL = 'total_amount - COALESCE(amount_paid, 0)'
+ORDER_OPEN_SQL = "status = 'approved' AND total_amount > COALESCE(amount_paid, 0)"
+PURCHASE_ORDER_OPEN_SQL = f"payment_status IN {OPEN_PAYMENT_STATUSES!r} AND total_amount > COALESCE(amount_paid, 0)"
+OPEN_ONLY = {'sqlite_where': db.text('is_open = 1'), 'postgresql_where': db.text('is_open')}
+
+
+def normalize_phone(phone):
+    """Digits only, with a +92 / 0092 country code folded to the local 0 prefix."""
+    digits = re.sub(r'\D', '', phone or '')
+    for prefix in ('0092', '92'):
+        if digits.startswith(prefix) and len(digits) - len(prefix) == 10:
+            return '0' + digits[len(prefix):]
+    return digits or None
+
 class User(db.Model, UserMixin):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(150), unique=True, nullable=False)
@@ -29,6 +54,8 @@ class Distributor(db.Model):
     email = db.Column(db.String(200))
     address = db.Column(db.Text)
     payment_terms = db.Column(db.Integer, default=30)  # Days
+    # Payables minus payments, maintained by BalanceController alongside every SupplierTransaction
+    balance = db.Column(db.Numeric(12, 2), nullable=False, default=0, server_default='0', index=True)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(PKT))
     
     # Relationships
@@ -36,49 +63,46 @@ class Distributor(db.Model):
     purchase_orders = db.relationship('PurchaseOrder', back_populates='distributor', lazy=True)
     transactions = db.relationship('SupplierTransaction', back_populates='distributor', lazy=True)
     
-    @property
-    def balance(self):
-        """Get current balance with this distributor"""
-        credit = db.session.query(db.func.sum(SupplierTransaction.amount))\
-            .filter(SupplierTransaction.distributor_id == self.id,
-                   SupplierTransaction.transaction_type == 'payable').scalar() or 0
-        debit = db.session.query(db.func.sum(SupplierTransaction.amount))\
-            .filter(SupplierTransaction.distributor_id == self.id,
-                   SupplierTransaction.transaction_type == 'payment').scalar() or 0
-        return credit - debit
-    
     def __repr__(self):
         return f'<Distributor {self.name}>'
 
 class Customer(db.Model):
+    __table_args__ = (
+        db.Index('ix_customer_created_at', 'created_at'),
+        db.Index('ix_customer_name_lower', db.func.lower(db.text('name'))),
+        db.Index('ix_customer_phone_normalized', 'phone_normalized'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
     phone = db.Column(db.String(20))
+    phone_normalized = db.Column(db.String(20))  # kept in step with phone; see normalize_phone
     address = db.Column(db.Text)
     email = db.Column(db.String(200), nullable=True)
     credit_limit = db.Column(db.Numeric(12, 2), default=0.0)
     credit_days = db.Column(db.Integer, default=30)  # Payment term in days
+    # Receivables minus payments, maintained by BalanceController alongside every CustomerTransaction
+    balance = db.Column(db.Numeric(12, 2), nullable=False, default=0, server_default='0', index=True)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(PKT))
     
     # Relationships
     orders = db.relationship('Order', back_populates='customer', lazy=True)
     transactions = db.relationship('CustomerTransaction', back_populates='customer', lazy=True)
-    
-    @property
-    def balance(self):
-        """Get current balance for this customer"""
-        receivable = db.session.query(db.func.sum(CustomerTransaction.amount))\
-            .filter(CustomerTransaction.customer_id == self.id,
-                   CustomerTransaction.transaction_type == 'receivable').scalar() or 0
-        payment = db.session.query(db.func.sum(CustomerTransaction.amount))\
-            .filter(CustomerTransaction.customer_id == self.id,
-                   CustomerTransaction.transaction_type == 'payment').scalar() or 0
-        return receivable - payment
+
+    @validates('phone')
+    def _normalize_phone(self, key, phone):
+        self.phone_normalized = normalize_phone(phone)
+        return phone
         
     def __repr__(self):
         return f'<Customer {self.name}>'
 
 class Product(db.Model):
+    __table_args__ = (
+        db.Index('ix_product_active_stock', 'is_active', 'stock_quantity'),
+        db.Index('ix_product_active_created_at', 'is_active', 'created_at'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text)
@@ -93,6 +117,7 @@ class Product(db.Model):
     distributor_id = db.Column(db.Integer, db.ForeignKey('distributor.id'), nullable=True)
     part_number = db.Column(db.String(100))  # Original part number
     min_stock_level = db.Column(db.Integer, default=5)
+    image_filename = db.Column(db.String(255))  # content-hashed file in static/product_images
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(PKT))
     
@@ -104,8 +129,9 @@ class Product(db.Model):
     
     @property
     def image_url(self):
-        from utils import get_product_image_url
-        return get_product_image_url(self.name)
+        if self.image_filename:
+            return f"product_images/{self.image_filename}"
+        return None
     
     @property
     def unit_info(self):
@@ -128,6 +154,19 @@ class Product(db.Model):
         return f'<Product {self.name}>'
 
 class Order(db.Model):
+    __table_args__ = (
+        db.Index('ix_order_created_at', 'created_at'),
+        db.Index('ix_order_status_created_at', 'status', 'created_at'),
+        db.Index('ix_order_type_created_at', 'order_type', 'created_at'),
+        db.Index('ix_order_customer_created_at', 'customer_id', 'created_at'),
+        db.Index('ix_order_status_type_due_date', 'status', 'order_type', 'due_date'),
+        db.Index('ix_order_created_by_created_at', 'created_by', 'created_at'),
+        db.Index('ix_order_open_created_at', 'is_open', 'created_at', **OPEN_ONLY),
+        db.Index('ix_order_open_customer_created_at', 'customer_id', 'is_open', 'created_at', **OPEN_ONLY),
+        db.Index('ix_order_open_type_due_date', 'order_type', 'is_open', 'due_date', **OPEN_ONLY),
+        db.Index('ix_order_posted_on', 'posted_on'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     created_by = db.Column(db.Integer, db.ForeignKey('user.id'))
     approved_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
@@ -145,6 +184,10 @@ class Order(db.Model):
     amount_paid = db.Column(db.Numeric(12, 2), default=0.0)
     due_date = db.Column(db.DateTime, nullable=True)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(PKT))
+    # Day the rollups booked it on when its own month was already closed (see RollupController.record_order)
+    posted_on = db.Column(db.Date, nullable=True)
+    balance_due = db.Column(db.Numeric(12, 2), db.Computed(BALANCE_DUE_SQL, persisted=True))
+    is_open = db.Column(db.Boolean, db.Computed(ORDER_OPEN_SQL, persisted=True))  # approved and not fully paid
     
     # Relationships
     customer = db.relationship('Customer', back_populates='orders', lazy=True)
@@ -152,6 +195,7 @@ class Order(db.Model):
     creator = db.relationship('User', foreign_keys=[created_by], back_populates='created_orders')
     approver = db.relationship('User', foreign_keys=[approved_by], back_populates='approved_orders')
     transactions = db.relationship('CustomerTransaction', back_populates='order', lazy=True)
+    allocations = db.relationship('PaymentAllocation', back_populates='order', lazy=True)
     
     @property
     def remaining_amount(self):
@@ -161,11 +205,17 @@ class Order(db.Model):
         return f'<Order {self.id}>'
 
 class OrderItem(db.Model):
+    __table_args__ = (
+        db.Index('ix_order_item_order_id', 'order_id'),
+        db.Index('ix_order_item_product_id', 'product_id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     order_id = db.Column(db.Integer, db.ForeignKey('order.id', ondelete='CASCADE'))
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'))
     quantity = db.Column(db.Integer)
     price = db.Column(db.Numeric(12, 2), nullable=True)  # Selling price at time of order
+    cost_price = db.Column(db.Numeric(12, 2), nullable=True)  # Product cost when approved; rollups rebuild from it
     
     # Relationships
     order = db.relationship('Order', back_populates='items')
@@ -176,6 +226,17 @@ class OrderItem(db.Model):
 
 class PurchaseOrder(db.Model):
     """Purchase orders from distributors"""
+    __table_args__ = (
+        db.Index('ix_purchase_order_status_created_at', 'status', 'created_at'),
+        db.Index('ix_purchase_order_payment_status_created_at', 'payment_status', 'created_at'),
+        db.Index('ix_purchase_order_distributor_created_at', 'distributor_id', 'created_at'),
+        db.Index('ix_purchase_order_created_at', 'created_at'),
+        db.Index('ix_purchase_order_open_created_at', 'is_open', 'created_at', **OPEN_ONLY),
+        db.Index('ix_purchase_order_open_distributor_created_at', 'distributor_id', 'is_open', 'created_at',
+                 **OPEN_ONLY),
+        db.Index('ix_purchase_order_posted_on', 'posted_on'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     distributor_id = db.Column(db.Integer, db.ForeignKey('distributor.id'))
     created_by = db.Column(db.Integer, db.ForeignKey('user.id'))
@@ -189,12 +250,16 @@ class PurchaseOrder(db.Model):
     notes = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(PKT))
     received_at = db.Column(db.DateTime, nullable=True)
+    posted_on = db.Column(db.Date, nullable=True)  # as Order.posted_on, for receipts of POs from closed months
+    balance_due = db.Column(db.Numeric(12, 2), db.Computed(BALANCE_DUE_SQL, persisted=True))
+    is_open = db.Column(db.Boolean, db.Computed(PURCHASE_ORDER_OPEN_SQL, persisted=True))  # unpaid or partly paid
     
     # Relationships
     distributor = db.relationship('Distributor', back_populates='purchase_orders')
     creator = db.relationship('User', foreign_keys=[created_by], back_populates='created_purchases')
     items = db.relationship('PurchaseOrderItem', back_populates='purchase_order', lazy=True, cascade='all, delete-orphan')
     transactions = db.relationship('SupplierTransaction', back_populates='purchase_order', lazy=True)
+    allocations = db.relationship('SupplierPaymentAllocation', back_populates='purchase_order', lazy=True)
     
     @property
     def remaining_amount(self):
@@ -204,6 +269,11 @@ class PurchaseOrder(db.Model):
         return f'<PurchaseOrder {self.id}>'
 
 class PurchaseOrderItem(db.Model):
+    __table_args__ = (
+        db.Index('ix_purchase_order_item_purchase_order_id', 'purchase_order_id'),
+        db.Index('ix_purchase_order_item_product_id', 'product_id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     purchase_order_id = db.Column(db.Integer, db.ForeignKey('purchase_order.id', ondelete='CASCADE'))
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'))
@@ -220,6 +290,13 @@ class PurchaseOrderItem(db.Model):
 
 class CustomerTransaction(db.Model):
     """Accounts Receivable Ledger"""
+    __table_args__ = (
+        db.Index('ix_customer_transaction_customer_created_at', 'customer_id', 'created_at'),
+        db.Index('ix_customer_transaction_customer_type', 'customer_id', 'transaction_type'),
+        db.Index('ix_customer_transaction_type_created_at', 'transaction_type', 'created_at'),
+        db.Index('ix_customer_transaction_created_at', 'created_at'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     customer_id = db.Column(db.Integer, db.ForeignKey('customer.id'))
     order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=True)
@@ -235,9 +312,58 @@ class CustomerTransaction(db.Model):
     customer = db.relationship('Customer', back_populates='transactions')
     order = db.relationship('Order', back_populates='transactions')
     creator = db.relationship('User', foreign_keys=[created_by])
+    allocations = db.relationship('PaymentAllocation', back_populates='transaction', lazy=True)
+
+
+class PaymentAllocation(db.Model):
+    """The part of a customer payment applied to one invoice (see AllocationController)."""
+    __table_args__ = (
+        db.Index('ix_payment_allocation_transaction_id', 'transaction_id'),
+        db.Index('ix_payment_allocation_order_id', 'order_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    transaction_id = db.Column(db.Integer, db.ForeignKey('customer_transaction.id'), nullable=False)
+    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False)
+    amount = db.Column(db.Numeric(12, 2), nullable=False)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(PKT))
+
+    transaction = db.relationship('CustomerTransaction', back_populates='allocations')
+    order = db.relationship('Order', back_populates='allocations')
+
+    def __repr__(self):
+        return f'<PaymentAllocation {self.transaction_id}->{self.order_id} {self.amount}>'
+
+
+class SupplierPaymentAllocation(db.Model):
+    """The part of a supplier payment applied to one purchase order (see AllocationController)."""
+    __table_args__ = (
+        db.Index('ix_supplier_payment_allocation_transaction_id', 'transaction_id'),
+        db.Index('ix_supplier_payment_allocation_purchase_order_id', 'purchase_order_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    transaction_id = db.Column(db.Integer, db.ForeignKey('supplier_transaction.id'), nullable=False)
+    purchase_order_id = db.Column(db.Integer, db.ForeignKey('purchase_order.id'), nullable=False)
+    amount = db.Column(db.Numeric(12, 2), nullable=False)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(PKT))
+
+    transaction = db.relationship('SupplierTransaction', back_populates='allocations')
+    purchase_order = db.relationship('PurchaseOrder', back_populates='allocations')
+
+    def __repr__(self):
+        return f'<SupplierPaymentAllocation {self.transaction_id}->{self.purchase_order_id} {self.amount}>'
+
 
 class SupplierTransaction(db.Model):
     """Accounts Payable Ledger"""
+    __table_args__ = (
+        db.Index('ix_supplier_transaction_distributor_created_at', 'distributor_id', 'created_at'),
+        db.Index('ix_supplier_transaction_distributor_type', 'distributor_id', 'transaction_type'),
+        db.Index('ix_supplier_transaction_type_created_at', 'transaction_type', 'created_at'),
+        db.Index('ix_supplier_transaction_created_at', 'created_at'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     distributor_id = db.Column(db.Integer, db.ForeignKey('distributor.id'))
     purchase_order_id = db.Column(db.Integer, db.ForeignKey('purchase_order.id'), nullable=True)
@@ -253,9 +379,15 @@ class SupplierTransaction(db.Model):
     distributor = db.relationship('Distributor', back_populates='transactions')
     purchase_order = db.relationship('PurchaseOrder', back_populates='transactions')
     creator = db.relationship('User', foreign_keys=[created_by])
+    allocations = db.relationship('SupplierPaymentAllocation', back_populates='transaction', lazy=True)
 
 class CashTransaction(db.Model):
     """Cash Book Ledger (Inflows and Outflows)"""
+    __table_args__ = (
+        db.Index('ix_cash_transaction_created_at', 'created_at'),
+        db.Index('ix_cash_transaction_type_created_at', 'transaction_type', 'created_at'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     transaction_type = db.Column(db.String(20)) # in, out
     amount = db.Column(db.Numeric(12, 2))
@@ -270,6 +402,12 @@ class CashTransaction(db.Model):
 
 class StockMovement(db.Model):
     """Audit log for all stock changes"""
+    __table_args__ = (
+        db.Index('ix_stock_movement_product_timestamp', 'product_id', 'timestamp'),
+        db.Index('ix_stock_movement_reference_timestamp', 'reference_type', 'timestamp'),
+        db.Index('ix_stock_movement_timestamp', 'timestamp'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'))
     quantity_change = db.Column(db.Integer)
@@ -289,6 +427,10 @@ class StockMovement(db.Model):
 
 class Expense(db.Model):
     """Track extra expenses like salaries and bills"""
+    __table_args__ = (
+        db.Index('ix_expense_expense_date', 'expense_date'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     category = db.Column(db.String(100), nullable=False)
     amount = db.Column(db.Numeric(12, 2), nullable=False)
@@ -340,6 +482,11 @@ class Employee(db.Model):
 
 class EmployeePayment(db.Model):
     """Salary, bonus, advance, and other payments to employees"""
+    __table_args__ = (
+        db.Index('ix_employee_payment_date', 'date'),
+        db.Index('ix_employee_payment_employee_date', 'employee_id', 'date'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     employee_id = db.Column(db.Integer, db.ForeignKey('employee.id'), nullable=False)
     payment_type = db.Column(db.String(50), nullable=False)  # salary, bonus, advance, other
@@ -355,3 +502,99 @@ class EmployeePayment(db.Model):
     
     def __repr__(self):
         return f'<EmployeePayment {self.payment_type} Rs. {self.amount}>'
+
+
+class DailySummary(db.Model):
+    """Pre-aggregated daily sales, profit and cash-flow figures (maintained by RollupController)"""
+    date = db.Column(db.Date, primary_key=True)
+    sales_total = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    sales_profit = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    sales_count = db.Column(db.Integer, nullable=False, default=0)
+    credit_sales_total = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    credit_sales_profit = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    credit_sales_count = db.Column(db.Integer, nullable=False, default=0)
+    returns_total = db.Column(db.Numeric(14, 2), nullable=False, default=0)  # Negative, as stored on return orders
+    returns_profit = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    returns_count = db.Column(db.Integer, nullable=False, default=0)
+    expenses_total = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    staff_expenses_total = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    purchases_total = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    receipts_total = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<DailySummary {self.date}>'
+
+class ProductDailySales(db.Model):
+    """Per-product daily sales rollup; returns are recorded as negative quantities"""
+    date = db.Column(db.Date, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    profit = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+
+    # Relationships
+    product = db.relationship('Product')
+
+    def __repr__(self):
+        return f'<ProductDailySales {self.date} {self.product_id}>'
+
+class BalanceCheckpoint(db.Model):
+    """Ledger totals of every row dated before `period_start` (maintained by RunningBalanceController).
+
+    One row per ledger ('cash', 'customer', 'supplier'), account and month start;
+    account_id 0 holds the totals of the whole ledger.
+    """
+    ledger = db.Column(db.String(20), primary_key=True)
+    account_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    period_start = db.Column(db.DateTime, primary_key=True)
+    increases = db.Column(db.Numeric(14, 2), nullable=False, default=0)  # in / receivable / payable
+    decreases = db.Column(db.Numeric(14, 2), nullable=False, default=0)  # out / payment
+
+    def __repr__(self):
+        return f'<BalanceCheckpoint {self.ledger}:{self.account_id} {self.period_start:%Y-%m}>'
+
+
+class ReportJob(db.Model):
+    """A report rendered in the background (see jobs.py); the output lives in the artifact store."""
+    __table_args__ = (
+        db.Index('ix_report_job_status_created_at', 'status', 'created_at'),
+        db.Index('ix_report_job_params_key_status', 'params_key', 'status'),
+        # At most one waiting job per report, so simultaneous requests cannot queue duplicates
+        db.Index('ux_report_job_active_params_key', 'params_key', unique=True,
+                 sqlite_where=db.text("status IN ('queued', 'running')"),
+                 postgresql_where=db.text("status IN ('queued', 'running')")),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)  # monthly_report
+    params = db.Column(db.Text, nullable=False)  # JSON
+    params_key = db.Column(db.String(64), nullable=False)  # sha256 of kind + params
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, done, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    artifact_sha = db.Column(db.String(64), nullable=True)
+    filename = db.Column(db.String(200), nullable=True)
+    mimetype = db.Column(db.String(100), nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(PKT))
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f'<ReportJob {self.id} {self.kind} {self.status}>'
+
+
+class PeriodClose(db.Model):
+    """A closed month (see PeriodController): its report figures are frozen in `snapshot`."""
+    id = db.Column(db.Integer, primary_key=True)
+    period_start = db.Column(db.DateTime, nullable=False, unique=True)
+    period_end = db.Column(db.DateTime, nullable=False)
+    snapshot = db.Column(db.Text, nullable=False)  # JSON; see ReportsController.month_snapshot
+    closed_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    closed_at = db.Column(db.DateTime, default=lambda: datetime.now(PKT))
+
+    # Relationships
+    closer = db.relationship('User')
+
+    def __repr__(self):
+        return f'<PeriodClose {self.period_start:%Y-%m}>'
@@ -1,11 +1,17 @@
-from flask import Blueprint, render_template, request, Response, send_file
-from flask_login import login_required
-from utils import role_required
+import os
+import json
+from flask import (Blueprint, render_template, request, Response, send_file, stream_with_context, abort,
+                   redirect, url_for, jsonify, flash)
+from flask_login import login_required, current_user
+from utils import role_required, period_bounds, filter_period
 from datetime import datetime
-from controllers.analytics_controller import AnalyticsController
+from controllers.analytics_controller import AnalyticsController, AGING_BUCKETS, AGING_SIDES
 from controllers.reports_controller import ReportsController
-from models import CashTransaction, StockMovement
+from controllers.export_controller import ExportController, XLSX_MIMETYPE
+from controllers.report_job_controller import ReportJobController, MONTHLY_FORMATS
+from models import CashTransaction, StockMovement, PKT
 from extensions import db
+import jobs
 
 analytics_bp = Blueprint('analytics', __name__)
 
@@ -14,7 +20,7 @@ analytics_bp = Blueprint('analytics', __name__)
 @login_required
 @role_required('admin')
 def dashboard():
-    year = request.args.get('year', datetime.now().year, type=int)
+    year = request.args.get('year', datetime.now(PKT).year, type=int)
     month = request.args.get('month', None, type=int)
 
     metrics = AnalyticsController.get_dashboard_metrics(year, month)
@@ -32,7 +38,7 @@ def dashboard():
 @login_required
 @role_required('admin')
 def monthly_report():
-    now = datetime.now()
+    now = datetime.now(PKT)
     year = request.args.get('year', now.year, type=int)
     month = request.args.get('month', now.month, type=int)
 
@@ -40,6 +46,7 @@ def monthly_report():
 
     return render_template('monthly_report.html',
                            report=data,
+                           can_close=not data['closed_at'] and (year, month) < (now.year, now.month),
                            selected_year=year,
                            selected_month=month,
                            years=range(2020, now.year + 2),
@@ -48,41 +55,102 @@ def monthly_report():
                                         'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'])
 
 
+@analytics_bp.route('/monthly-report/close', methods=['POST'])
+@login_required
+@role_required('admin')
+def close_month():
+    year = request.form.get('year', type=int)
+    month = request.form.get('month', type=int)
+    if not year or not month or not 1 <= month <= 12:
+        abort(400)
+    success, message = ReportsController.close_month(year, month, current_user.id)
+    flash(message, 'success' if success else 'danger')
+    return redirect(url_for('analytics.monthly_report', year=year, month=month))
+
+
 @analytics_bp.route('/monthly-report/download')
 @login_required
 @role_required('admin')
 def download_report():
-    year = request.args.get('year', datetime.now().year, type=int)
-    month = request.args.get('month', datetime.now().month, type=int)
+    year = request.args.get('year', datetime.now(PKT).year, type=int)
+    month = request.args.get('month', datetime.now(PKT).month, type=int)
     fmt = request.args.get('format', 'csv')
 
-    data = ReportsController.get_monthly_report(year, month)
-    filename_base = f"report_{data['month_name']}_{year}"
-
     if fmt == 'csv':
+        data = ReportsController.get_monthly_report(year, month)
         csv_output = ReportsController.generate_csv(data)
         return Response(
             csv_output,
             mimetype='text/csv',
-            headers={'Content-Disposition': f'attachment; filename={filename_base}.csv'})
+            headers={'Content-Disposition': f"attachment; filename=report_{data['month_name']}_{year}.csv"})
+
+    if fmt not in MONTHLY_FORMATS:
+        return 'Invalid format', 400
+
+    # PDF and Excel are rendered by a background worker; closed months come straight from the artifact store
+    job, created = ReportJobController.request_report(
+        'monthly_report', {'year': year, 'month': month, 'format': fmt}, current_user.id)
+    if created:
+        jobs.wake()
+    if job.status == 'done':
+        return redirect(url_for('analytics.report_job_download', job_id=job.id))
+    return redirect(url_for('analytics.report_job', job_id=job.id))
+
+
+@analytics_bp.route('/jobs/<int:job_id>')
+@login_required
+@role_required('admin')
+def report_job(job_id):
+    job = ReportJobController.get_job(job_id) or abort(404)
+    return render_template('report_job.html', job=job, params=json.loads(job.params))
+
 
-    elif fmt == 'excel':
-        excel_output = ReportsController.generate_excel(data)
-        return send_file(
-            excel_output,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            as_attachment=True,
-            download_name=f'{filename_base}.xlsx')
+@analytics_bp.route('/jobs/<int:job_id>/status')
+@login_required
+@role_required('admin')
+def report_job_status(job_id):
+    job = ReportJobController.get_job(job_id) or abort(404)
+    return jsonify({
+        'id': job.id,
+        'status': job.status,
+        'error': job.error if job.status == 'failed' else None,
+        'download_url': url_for('analytics.report_job_download', job_id=job.id) if job.status == 'done' else None,
+    })
 
-    elif fmt == 'pdf':
-        pdf_output = ReportsController.generate_pdf(data)
-        return send_file(
-            pdf_output,
-            mimetype='application/pdf',
-            as_attachment=True,
-            download_name=f'{filename_base}.pdf')
 
-    return 'Invalid format', 400
+@analytics_bp.route('/jobs/<int:job_id>/download')
+@login_required
+@role_required('admin')
+def report_job_download(job_id):
+    job = ReportJobController.get_job(job_id) or abort(404)
+    if job.status != 'done':
+        return redirect(url_for('analytics.report_job', job_id=job.id))
+    path = ReportJobController.artifact_path(job.artifact_sha)
+    if not os.path.exists(path):
+        abort(410)
+    return send_file(path, mimetype=job.mimetype, as_attachment=True, download_name=job.filename,
+                     etag=job.artifact_sha)
+
+
+@analytics_bp.route('/export/<dataset>')
+@login_required
+@role_required('admin')
+def export(dataset):
+    """Stream a row-level export, filtered with the same query args as the page it comes from."""
+    fmt = request.args.get('format', 'csv')
+    exported = ExportController.get_dataset(dataset, request.args)
+    if exported is None or fmt not in ('csv', 'xlsx'):
+        abort(404)
+
+    title, headers, rows = exported
+    filename = '_'.join([dataset, request.args.get('start_date') or 'all',
+                         request.args.get('end_date') or datetime.now(PKT).strftime('%Y-%m-%d')])
+    if fmt == 'csv':
+        body, mimetype = ExportController.iter_csv(headers, rows), 'text/csv; charset=utf-8'
+    else:
+        body, mimetype = ExportController.iter_xlsx(title, headers, rows), XLSX_MIMETYPE
+    return Response(stream_with_context(body), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={filename}.{fmt}'})
 
 
 @analytics_bp.route('/receivables')
@@ -97,7 +165,6 @@ def receivables():
 @login_required
 @role_required('admin')
 def payables():
-    from models import PKT
     data = AnalyticsController.get_payables_data()
     return render_template('payables.html', **data, now=datetime.now(PKT))
 
@@ -109,9 +176,11 @@ def ledger():
     transaction_type = request.args.get('type', 'all')
     start_date = request.args.get('start_date')
     end_date = request.args.get('end_date')
-    data = AnalyticsController.get_ledger_entries(transaction_type, start_date, end_date)
+    data = AnalyticsController.get_ledger_entries(transaction_type, start_date, end_date,
+                                                  request.args.get('cursor'))
     return render_template('ledger.html',
                            transactions=data['transactions'],
+                           next_cursor=data['next_cursor'],
                            total_receivables=data['total_receivables'],
                            total_payables=data['total_payables'],
                            transaction_type=transaction_type,
@@ -127,26 +196,50 @@ def cashbook():
     start_date = request.args.get('start_date')
     end_date = request.args.get('end_date')
 
-    transactions = AnalyticsController.get_ledger_data(transaction_type, start_date, end_date)
-    metrics = AnalyticsController.get_dashboard_metrics(datetime.now().year, None)
+    transactions, next_cursor = AnalyticsController.get_ledger_data(
+        transaction_type, start_date, end_date, cursor=request.args.get('cursor'))
+    outstanding = AnalyticsController.get_outstanding_totals()
 
     return render_template('cashbook.html',
-                           transactions=list(transactions),
+                           transactions=transactions,
+                           next_cursor=next_cursor,
                            transaction_type=transaction_type,
                            start_date=start_date,
                            end_date=end_date,
-                           total_receivables=metrics.get('total_receivables', 0),
-                           total_payables=metrics.get('total_payables', 0))
+                           total_receivables=outstanding['total_receivables'],
+                           total_payables=outstanding['total_payables'])
 
 
 @analytics_bp.route('/aging-report')
 @login_required
 @role_required('admin')
 def aging_report():
-    aging_receivables, aging_payables = AnalyticsController.get_aging_data()
+    aging = AnalyticsController.get_aging_data()
     return render_template('aging_report.html',
-                           aging_receivables=aging_receivables,
-                           aging_payables=aging_payables)
+                           aging_receivables=aging['receivables'],
+                           aging_payables=aging['payables'],
+                           buckets=AGING_BUCKETS)
+
+
+@analytics_bp.route('/aging-report/<side>')
+@login_required
+@role_required('admin')
+def aging_bucket(side):
+    bucket = request.args.get('bucket', '')
+    if side not in AGING_SIDES or bucket not in AGING_BUCKETS:
+        abort(404)
+    party_id = request.args.get('party', type=int)
+    party_name = request.args.get('name') or None
+    invoices, next_cursor = AnalyticsController.get_aging_bucket(side, bucket, party_id, party_name,
+                                                                 request.args.get('cursor'))
+    return render_template('aging_bucket.html',
+                           side=side,
+                           bucket=bucket,
+                           invoices=invoices,
+                           next_cursor=next_cursor,
+                           party_id=party_id,
+                           party_name=party_name,
+                           today=datetime.now(PKT).date())
 
 
 @analytics_bp.route('/stock-movements')
@@ -168,11 +261,8 @@ def stock_movements():
         )
     if movement_type:
         query = query.filter(StockMovement.reference_type == movement_type)
-    if start_date:
-        query = query.filter(StockMovement.timestamp >= datetime.strptime(start_date, '%Y-%m-%d'))
-    if end_date:
-        from datetime import timedelta
-        query = query.filter(StockMovement.timestamp <= datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1))
+    start, end = period_bounds(start_date=start_date, end_date=end_date)
+    query = filter_period(query, StockMovement.timestamp, start, end)
 
     movements = query.order_by(StockMovement.timestamp.desc()).limit(300).all()
     return render_template('stock_movements.html',
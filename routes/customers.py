@@ -1,7 +1,11 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash
-from flask_login import login_required
-from utils import role_required
+from datetime import datetime
+from flask import (Blueprint, render_template, request, redirect, url_for, flash, jsonify, abort, Response,
+                   stream_with_context)
+from flask_login import login_required, current_user
+from utils import role_required, period_bounds
+from models import PKT
 from controllers.customer_controller import CustomerController
+from controllers.statement_controller import StatementController, STATEMENT_FORMATS
 
 customers_bp = Blueprint('customers', __name__)
 
@@ -14,8 +18,20 @@ def index():
         flash(message, 'success' if success else 'danger')
         return redirect(url_for('customers.index'))
         
-    customers = CustomerController.get_all_customers()
-    return render_template('customers.html', customers=customers)
+    customers, next_cursor = CustomerController.get_all_customers(request.args.get('cursor'))
+    return render_template('customers.html', customers=customers, next_cursor=next_cursor)
+
+@customers_bp.route('/api/search')
+@login_required
+def api_search():
+    # Customer picker on the order form (staff and admin)
+    customers, next_cursor = CustomerController.search_customers(request.args.get('q', ''),
+                                                                 request.args.get('cursor'))
+    return jsonify({
+        'results': [{'id': c.id, 'name': c.name, 'phone': c.phone or '', 'address': c.address or '',
+                     'email': c.email or ''} for c in customers],
+        'next_cursor': next_cursor,
+    })
 
 @customers_bp.route('/<int:customer_id>')
 @login_required
@@ -25,10 +41,46 @@ def detail(customer_id):
     if not customer:
         flash("Customer not found", "danger")
         return redirect(url_for('customers.index'))
-    analytics = CustomerController.get_customer_analytics(customer_id)
+    transactions, next_cursor = CustomerController.get_transactions_page(customer_id, request.args.get('cursor'))
     from controllers.product_controller import ProductController
     distributors = ProductController.get_all_distributors()
-    return render_template('customer_detail.html', customer=customer, analytics=analytics, distributors=distributors)
+    return render_template('customer_detail.html', customer=customer, distributors=distributors,
+                           transactions=transactions, next_cursor=next_cursor)
+
+@customers_bp.route('/<int:customer_id>/analytics')
+@login_required
+@role_required('admin')
+def analytics(customer_id):
+    # Loaded by the detail page after it renders, so a long purchase history never delays the ledger
+    analytics = CustomerController.get_customer_analytics(customer_id)
+    if analytics is None:
+        return jsonify({'error': 'Customer not found'}), 404
+    return jsonify(analytics)
+
+@customers_bp.route('/<int:customer_id>/statement')
+@login_required
+@role_required('admin')
+def statement(customer_id):
+    """Stream the customer's statement for ?start_date=&end_date= as ?format=pdf|csv."""
+    fmt = request.args.get('format', 'pdf')
+    if fmt not in STATEMENT_FORMATS:
+        abort(404)
+    start_date, end_date = request.args.get('start_date'), request.args.get('end_date')
+    try:
+        start, end = period_bounds(start_date=start_date, end_date=end_date)
+    except ValueError:
+        flash('Invalid statement dates', 'danger')
+        return redirect(url_for('customers.detail', customer_id=customer_id))
+    statement = StatementController.get_statement(customer_id, start, end)
+    if statement is None:
+        abort(404)
+
+    ext, mimetype = STATEMENT_FORMATS[fmt]
+    body = StatementController.iter_pdf(statement) if fmt == 'pdf' else StatementController.iter_csv(statement)
+    filename = '_'.join(['statement', str(customer_id), start_date or 'all',
+                         end_date or datetime.now(PKT).strftime('%Y-%m-%d')])
+    return Response(stream_with_context(body), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={filename}.{ext}'})
 
 @customers_bp.route('/<int:customer_id>/payment', methods=['POST'])
 @login_required
@@ -65,6 +117,19 @@ def account_payment(customer_id):
         
     return redirect(url_for('customers.detail', customer_id=customer_id))
 
+@customers_bp.route('/deposits/import', methods=['POST'])
+@login_required
+@role_required('admin')
+def import_deposits():
+    """Apply a bank deposit file of customer payments; the file goes in whole or not at all."""
+    file = request.files.get('deposit_file')
+    if not file or not file.filename:
+        flash('Choose a deposit file to import', 'danger')
+        return redirect(url_for('customers.index'))
+    success, message = CustomerController.import_deposits(file.stream, current_user.id)
+    flash(message, 'success' if success else 'danger')
+    return redirect(url_for('customers.index'))
+
 @customers_bp.route('/settlement_receipt/<int:txn_id>')
 @login_required
 @role_required('admin')
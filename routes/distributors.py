@@ -1,7 +1,8 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash
-from flask_login import login_required
+from flask_login import login_required, current_user
 from utils import role_required
 from controllers.distributors_controller import DistributorsController
+from controllers.purchases_controller import PurchasesController
 
 distributors_bp = Blueprint('distributors', __name__)
 
@@ -10,7 +11,8 @@ distributors_bp = Blueprint('distributors', __name__)
 @role_required('admin')
 def list_distributors():
     all_distributors = DistributorsController.get_all_distributors()
-    return render_template('distributors.html', distributors=all_distributors)
+    return render_template('distributors.html', distributors=all_distributors,
+                           product_counts=DistributorsController.get_product_counts())
 
 @distributors_bp.route('/add', methods=['GET', 'POST'])
 @login_required
@@ -28,7 +30,8 @@ def add_distributor():
 @login_required
 @role_required('admin')
 def distributor_detail(id):
-    success, message, distributor, products, purchase_orders, transactions = DistributorsController.get_distributor_details(id)
+    success, message, distributor, products, purchase_orders, transactions, next_cursor = \
+        DistributorsController.get_distributor_details(id, request.args.get('cursor'))
     if not success:
         flash(message, "danger")
         return redirect(url_for('distributors.list_distributors'))
@@ -37,13 +40,35 @@ def distributor_detail(id):
                          distributor=distributor,
                          products=products,
                          purchase_orders=purchase_orders,
-                         transactions=transactions)
+                         transactions=transactions,
+                         next_cursor=next_cursor)
+
+@distributors_bp.route('/<int:id>/payment', methods=['POST'])
+@login_required
+@role_required('admin')
+def distributor_payment(id):
+    success, message = PurchasesController.add_distributor_payment(id, request.form, current_user.id)
+    flash(message, "success" if success else "danger")
+    if "not found" in message:
+        return redirect(url_for('distributors.list_distributors'))
+    return redirect(url_for('distributors.distributor_detail', id=id))
+
+@distributors_bp.route('/payments', methods=['GET', 'POST'])
+@login_required
+@role_required('admin')
+def payment_run():
+    """Pay several distributors at once; each payment settles its oldest purchase orders first."""
+    if request.method == 'POST':
+        success, message = PurchasesController.pay_distributors(request.form, current_user.id)
+        flash(message, "success" if success else "danger")
+        return redirect(url_for('distributors.payment_run'))
+    return render_template('distributor_payments.html', rows=PurchasesController.get_payment_run())
 
 @distributors_bp.route('/edit/<int:id>', methods=['GET', 'POST'])
 @login_required
 @role_required('admin')
 def edit_distributor(id):
-    success, message, distributor, products, purchase_orders, transactions = DistributorsController.get_distributor_details(id)
+    success, message, distributor, *_ = DistributorsController.get_distributor_details(id)
     if not success:
         flash(message, "danger")
         return redirect(url_for('distributors.list_distributors'))
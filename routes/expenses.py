@@ -9,8 +9,8 @@ expenses_bp = Blueprint('expenses', __name__)
 @login_required
 @role_required('admin')
 def list_expenses():
-    expenses, total_expenses = ExpensesController.get_all_expenses()
-    return render_template('expenses.html', expenses=expenses, total=total_expenses)
+    expenses, total_expenses, next_cursor = ExpensesController.get_all_expenses(request.args.get('cursor'))
+    return render_template('expenses.html', expenses=expenses, total=total_expenses, next_cursor=next_cursor)
 
 @expenses_bp.route('/add', methods=['POST'])
 @login_required
@@ -1,7 +1,9 @@
-from flask import Blueprint, render_template
+import os
+from flask import Blueprint, render_template, request, Response, session
 from flask_login import login_required, current_user
 from utils import role_required
 from controllers.main_controller import MainController
+import events
 
 main_bp = Blueprint('main', __name__)
 
@@ -29,6 +31,17 @@ def pending_pos():
     orders = MainController.get_pending_orders()
     return render_template('pending_pos.html', orders=orders)
 
+@main_bp.route('/api/events')
+@login_required
+@role_required('admin')
+def api_events():
+    # Server-sent events: new draft orders are pushed as they are committed. One
+    # stream per browser session; opening another ends the older one.
+    session_id = session.setdefault('events_session', os.urandom(8).hex())
+    return Response(events.stream(request.headers.get('Last-Event-ID'), session_id),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @main_bp.route('/api/check-new-orders')
 def api_check_new_orders():
     from flask import jsonify, request
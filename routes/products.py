@@ -1,4 +1,4 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 from flask_login import login_required, current_user
 from utils import role_required
 from controllers.product_controller import ProductController
@@ -8,9 +8,24 @@ products_bp = Blueprint('products', __name__)
 @products_bp.route('/')
 @login_required
 def products():
-    all_products = ProductController.get_all_products()
-    distributors = ProductController.get_all_distributors()
-    return render_template('products.html', products=all_products, distributors=distributors)
+    q = request.args.get('q', '').strip()
+    if q:
+        products, next_cursor = ProductController.search_products(q, limit=100), None
+    else:
+        products, next_cursor = ProductController.get_products_page(request.args.get('cursor'))
+    return render_template('products.html', products=products, next_cursor=next_cursor, q=q)
+
+@products_bp.route('/api/search')
+@login_required
+def api_search():
+    # Typeahead for the order and purchase forms; cost prices are for admins only
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), 50)
+    except ValueError:
+        limit = 20
+    results = ProductController.search_payload(request.args.get('q', ''),
+                                                include_cost=current_user.role == 'admin', limit=limit)
+    return jsonify({'results': results})
 
 @products_bp.route('/admin', methods=['GET', 'POST'])
 @login_required
@@ -1,6 +1,6 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash
 from flask_login import login_required, current_user
-from models import Distributor, Product
+from models import Distributor
 from utils import role_required
 from controllers.purchases_controller import PurchasesController
 
@@ -12,8 +12,10 @@ purchases_bp = Blueprint('purchases', __name__)
 def purchase_orders():
     start_date = request.args.get('start_date')
     end_date = request.args.get('end_date')
-    purchases = PurchasesController.get_all_purchases(start_date=start_date, end_date=end_date)
-    return render_template('purchase_orders.html', purchases=purchases, start_date=start_date or '', end_date=end_date or '')
+    cursor = request.args.get('cursor')
+    purchases, next_cursor = PurchasesController.get_all_purchases(start_date=start_date, end_date=end_date, cursor=cursor)
+    return render_template('purchase_orders.html', purchases=purchases, next_cursor=next_cursor,
+                           start_date=start_date or '', end_date=end_date or '')
 
 @purchases_bp.route('/create', methods=['GET', 'POST'])
 @login_required
@@ -28,8 +30,7 @@ def create_purchase_order():
              flash(message, "danger")
     
     distributors = Distributor.query.all()
-    products = Product.query.all()
-    return render_template('create_purchase_order.html', distributors=distributors, products=products)
+    return render_template('create_purchase_order.html', distributors=distributors)
 
 @purchases_bp.route('/<int:id>')
 @login_required
@@ -1,14 +1,26 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash
 from flask_login import login_required, current_user
-from utils import role_required
+from utils import role_required, period_bounds, filter_period
 from models import Order, PurchaseOrder, Product
 from controllers.return_controller import ReturnController
 
 from extensions import db
-from datetime import datetime
 
 returns_bp = Blueprint('returns', __name__)
 
+def _date_bounds(start_date, end_date):
+    """period_bounds for the list filters, parsing each side on its own so a mistyped date only drops itself."""
+    start = end = None
+    try:
+        start, _ = period_bounds(start_date=start_date)
+    except ValueError:
+        pass
+    try:
+        _, end = period_bounds(end_date=end_date)
+    except ValueError:
+        pass
+    return start, end
+
 @returns_bp.route('/customer')
 @login_required
 @role_required('admin')
@@ -29,24 +41,13 @@ def customer_returns():
             )
         )
 
-    if start_date:
-        try:
-            start_dt = datetime.strptime(start_date, '%Y-%m-%d')
-            orders_q = orders_q.filter(Order.created_at >= start_dt)
-        except ValueError:
-            pass
-
-    if end_date:
-        try:
-            # Include the entire end day
-            end_dt = datetime.strptime(end_date, '%Y-%m-%d').replace(hour=23, minute=59, second=59)
-            orders_q = orders_q.filter(Order.created_at <= end_dt)
-        except ValueError:
-            pass
+    # Bounds cover the entire end day
+    orders_q = filter_period(orders_q, Order.created_at, *_date_bounds(start_date, end_date))
 
     orders = orders_q.order_by(Order.created_at.desc()).all()
-    past_returns = ReturnController.get_customer_returns()
-    return render_template('customer_returns.html', orders=orders, past_returns=past_returns, q=query, start_date=start_date, end_date=end_date)
+    past_returns, next_cursor = ReturnController.get_customer_returns(request.args.get('returns_cursor'))
+    return render_template('customer_returns.html', orders=orders, past_returns=past_returns, next_cursor=next_cursor,
+                           q=query, start_date=start_date, end_date=end_date)
 
 @returns_bp.route('/supplier')
 @login_required
@@ -66,19 +67,7 @@ def supplier_returns():
             )
         )
 
-    if start_date:
-        try:
-            start_dt = datetime.strptime(start_date, '%Y-%m-%d')
-            pos_q = pos_q.filter(PurchaseOrder.created_at >= start_dt)
-        except ValueError:
-            pass
-
-    if end_date:
-        try:
-            end_dt = datetime.strptime(end_date, '%Y-%m-%d').replace(hour=23, minute=59, second=59)
-            pos_q = pos_q.filter(PurchaseOrder.created_at <= end_dt)
-        except ValueError:
-            pass
+    pos_q = filter_period(pos_q, PurchaseOrder.created_at, *_date_bounds(start_date, end_date))
 
     pos = pos_q.order_by(PurchaseOrder.created_at.desc()).all()
     past_returns = ReturnController.get_supplier_returns()
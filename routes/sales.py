@@ -1,6 +1,5 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash
 from flask_login import login_required, current_user
-from models import Product, Customer
 from utils import role_required
 from controllers.sales_controller import SalesController
 
@@ -9,10 +8,7 @@ sales_bp = Blueprint('sales', __name__)
 @sales_bp.route('/create', methods=['GET', 'POST'])
 @login_required
 def create_order():
-    all_products = Product.query.filter_by(is_active=True).all()
-    all_customers = Customer.query.order_by(Customer.name.asc()).all()
-    customers_data = {c.id: {'name': c.name, 'phone': c.phone or '', 'address': c.address or '', 'email': c.email or ''} for c in all_customers}
-    
+    # Products and customers are looked up by the page through the search APIs
     if request.method == 'POST':
         is_admin = current_user.role == 'admin'
         result = SalesController.create_order(request.form, current_user.id, is_admin=is_admin)
@@ -35,7 +31,7 @@ def create_order():
                 flash(message, "danger" if "Insufficient" in message else "warning")
                 return redirect(url_for('sales.create_order'))
     
-    return render_template('create_order.html', products=all_products, customers=all_customers, customers_data=customers_data)
+    return render_template('create_order.html')
 
 @sales_bp.route('/orders/<int:order_id>', methods=['GET', 'POST'])
 @login_required
@@ -96,7 +92,8 @@ def sales_history():
     status = request.args.get('status')
     start_date = request.args.get('start_date')
     end_date = request.args.get('end_date')
-    data = SalesController.get_all_orders(order_type, start_date, end_date, status)
+    cursor = request.args.get('cursor')
+    data = SalesController.get_all_orders(order_type, start_date, end_date, status, cursor=cursor)
     return render_template('sales_history.html', **data,
                            order_type=order_type,
                            start_date=start_date or '',
@@ -0,0 +1,175 @@
+"""Benchmark the analytics dashboard aggregation: per-month queries vs. the rollup engine.
+
+Seeds a throwaway SQLite database (and backfills its daily rollups) and reports
+query count and latency for the legacy query pattern and for
+AggregationController-backed metrics.
+
+    python scripts/bench_dashboard.py --orders 500000
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import event, func, extract, insert
+from extensions import db
+from models import (Order, OrderItem, Product, PurchaseOrder, Expense, EmployeePayment,
+                    CustomerTransaction, Distributor, Employee, User)
+from controllers.analytics_controller import AnalyticsController
+from controllers.rollup_controller import RollupController
+
+
+def legacy_dashboard_metrics(year, month):
+    """The pre-engine query pattern: one aggregate per card plus five per chart month."""
+    def period(query, column):
+        if month:
+            query = query.filter(extract('year', column) == year, extract('month', column) == month)
+        return query
+
+    sales = period(Order.query.filter(Order.status == 'approved'), Order.created_at)
+    for q in (sales, sales.filter(Order.order_type == 'sale'), sales.filter(Order.order_type == 'credit_sale')):
+        q.with_entities(func.sum(Order.total_amount)).scalar()
+        q.with_entities(func.sum(Order.total_profit)).scalar()
+        q.count()
+    returns = sales.filter(Order.order_type == 'return')
+    returns.with_entities(func.sum(func.abs(Order.total_amount))).scalar()
+    returns.count()
+    period(Expense.query, Expense.expense_date).with_entities(func.sum(Expense.amount)).scalar()
+    period(EmployeePayment.query, EmployeePayment.date).with_entities(func.sum(EmployeePayment.amount)).scalar()
+    period(PurchaseOrder.query.filter(PurchaseOrder.status == 'received'), PurchaseOrder.created_at)\
+        .with_entities(func.sum(PurchaseOrder.total_amount)).scalar()
+    period(CustomerTransaction.query.filter(CustomerTransaction.transaction_type == 'payment'),
+           CustomerTransaction.created_at).with_entities(func.sum(CustomerTransaction.amount)).scalar()
+
+    AnalyticsController.get_outstanding_totals()
+    period(db.session.query(Product.id, func.sum(OrderItem.quantity)).join(OrderItem).join(Order)
+           .filter(Order.status == 'approved'), Order.created_at).group_by(Product.id).limit(10).all()
+    period(db.session.query(Distributor.id, func.sum(PurchaseOrder.total_amount)).join(PurchaseOrder)
+           .filter(PurchaseOrder.status == 'received'), PurchaseOrder.created_at).group_by(Distributor.id).limit(5).all()
+    period(db.session.query(Expense.category, func.sum(Expense.amount)), Expense.expense_date)\
+        .group_by(Expense.category).all()
+
+    for m in range(1, 13):
+        base = db.session.query(func.sum(Order.total_amount)).filter(
+            Order.status == 'approved',
+            extract('year', Order.created_at) == year,
+            extract('month', Order.created_at) == m)
+        base.filter(Order.order_type == 'sale').scalar()
+        base.filter(Order.order_type == 'credit_sale').scalar()
+        base.with_entities(func.sum(Order.total_profit)).scalar()
+        db.session.query(func.sum(Expense.amount)).filter(
+            extract('year', Expense.expense_date) == year,
+            extract('month', Expense.expense_date) == m).scalar()
+        db.session.query(func.sum(EmployeePayment.amount)).filter(
+            extract('year', EmployeePayment.date) == year,
+            extract('month', EmployeePayment.date) == m).scalar()
+
+
+def seed(orders, years):
+    random.seed(42)
+    now = datetime.now()
+    start = datetime(now.year - years + 1, 1, 1)
+    span = int((now - start).total_seconds())
+
+    def when():
+        return start + timedelta(seconds=random.randint(0, span))
+
+    db.session.add(User(username='bench', password_hash='-', role='admin'))
+    db.session.add(Distributor(name='Bench Distributor'))
+    db.session.add(Employee(nickname='bench', full_name='Bench Employee'))
+    db.session.commit()
+
+    batch = []
+    for i in range(orders):
+        order_type = random.choice(('sale', 'sale', 'credit_sale', 'return'))
+        amount = random.randint(500, 50000) * (-1 if order_type == 'return' else 1)
+        batch.append({
+            'created_by': 1, 'status': 'approved' if i % 10 else 'draft', 'order_type': order_type,
+            'total_amount': amount, 'total_profit': amount / 5, 'amount_paid': amount,
+            'created_at': when(),
+        })
+        if len(batch) == 20000:
+            db.session.execute(insert(Order), batch)
+            batch = []
+    if batch:
+        db.session.execute(insert(Order), batch)
+
+    side_rows = max(orders // 20, 1)
+    db.session.execute(insert(Expense), [
+        {'category': 'bills', 'amount': random.randint(100, 9000), 'expense_date': when()}
+        for _ in range(side_rows)])
+    db.session.execute(insert(EmployeePayment), [
+        {'employee_id': 1, 'payment_type': 'salary', 'amount': random.randint(100, 9000), 'date': when()}
+        for _ in range(side_rows)])
+    db.session.execute(insert(PurchaseOrder), [
+        {'distributor_id': 1, 'status': 'received', 'total_amount': random.randint(100, 90000),
+         'amount_paid': 0, 'payment_status': 'pending', 'created_at': when()}
+        for _ in range(side_rows)])
+    db.session.execute(insert(CustomerTransaction), [
+        {'customer_id': None, 'transaction_type': 'payment', 'amount': random.randint(100, 9000),
+         'created_at': when()}
+        for _ in range(side_rows)])
+    db.session.commit()
+
+
+def measure(label, fn, repeat):
+    counter = {'n': 0}
+
+    def count(*_):
+        counter['n'] += 1
+
+    event.listen(db.engine, 'before_cursor_execute', count)
+    try:
+        timings = []
+        for _ in range(repeat):
+            counter['n'] = 0
+            started = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - started)
+            db.session.rollback()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', count)
+
+    best = min(timings) * 1000
+    print(f"{label:<32} queries={counter['n']:<5} best={best:>9.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--orders', type=int, default=500000)
+    parser.add_argument('--years', type=int, default=3)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--db', help='Reuse an existing benchmark database file instead of seeding a new one.')
+    args = parser.parse_args()
+
+    path = args.db or os.path.join(tempfile.mkdtemp(), 'bench.db')
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+    db.init_app(app)
+
+    with app.app_context():
+        if not args.db or not os.path.exists(path):
+            db.create_all()
+            started = time.perf_counter()
+            seed(args.orders, args.years)
+            print(f"Seeded {args.orders:,} orders into {path} in {time.perf_counter() - started:.1f}s")
+            started = time.perf_counter()
+            days = RollupController.rebuild(chunk_days=92)
+            print(f"Backfilled {days:,} rollup days in {time.perf_counter() - started:.1f}s")
+
+        year = datetime.now().year
+        month = datetime.now().month
+        for label, m in (('year view', None), ('month view', month)):
+            print(f"-- {label} ({year}{'-%02d' % m if m else ''})")
+            measure('before: per-month queries', lambda: legacy_dashboard_metrics(year, m), args.repeat)
+            measure('after: rollup engine', lambda: AnalyticsController.get_dashboard_metrics(year, m), args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""Check the SQL aging report against the per-invoice Python bucketing it replaced.
+
+Seeds a throwaway SQLite database with open, partly paid and settled credit
+orders and purchase orders on and around every bucket edge (including walk-in
+customers with no account), then compares every counterparty's bucket totals
+and counts with a Python pass over the invoices, walks every drill-down page,
+and checks the report takes the same number of queries however many invoices
+are open. Exits non-zero on any mismatch.
+
+    python scripts/check_aging.py [--invoices 2000]
+"""
+import os
+import sys
+import random
+import argparse
+import tempfile
+from decimal import Decimal
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import event
+from extensions import db
+from models import Order, PurchaseOrder, Customer, Distributor, User, PKT, OPEN_PAYMENT_STATUSES
+from controllers.analytics_controller import AnalyticsController, AGING_BUCKETS
+
+CUSTOMERS = 25
+DISTRIBUTORS = 8
+WALK_IN_NAMES = ('Ali', 'Bilal', 'Counter sale')
+
+
+def bucket_of(created_at, today):
+    days = (today - created_at.date()).days
+    return '0-30' if days <= 30 else '31-60' if days <= 60 else '61-90' if days <= 90 else '90+'
+
+
+def seed_accounts():
+    db.session.add(User(username='aging', password_hash='-', role='admin'))
+    db.session.add_all([Customer(name=f'Customer {i}') for i in range(CUSTOMERS)])
+    db.session.add_all([Distributor(name=f'Distributor {i}') for i in range(DISTRIBUTORS)])
+    db.session.commit()
+
+
+def seed_invoices(invoices, rng_seed):
+    random.seed(rng_seed)
+    now = datetime.now(PKT).replace(tzinfo=None)
+    today = now.date()
+    edges = [datetime.combine(today - timedelta(days=d), datetime.min.time()) for d in (0, 30, 31, 60, 61, 90, 91)]
+
+    def when():
+        if random.random() < 0.3:
+            return random.choice(edges) + random.choice((timedelta(0), timedelta(hours=23, minutes=59)))
+        return now - timedelta(minutes=random.randint(0, 200 * 24 * 60))
+
+    for _ in range(invoices):
+        total = Decimal(random.randint(100, 90000))
+        paid = random.choice((Decimal(0), total / 2, total))
+        walk_in = random.random() < 0.15
+        db.session.add(Order(created_by=1, status=random.choice(('approved', 'approved', 'draft')),
+                             order_type='credit_sale', total_amount=total, amount_paid=paid,
+                             customer_id=None if walk_in else random.randint(1, CUSTOMERS),
+                             customer_name=random.choice(WALK_IN_NAMES) if walk_in else None,
+                             created_at=when()))
+        total = Decimal(random.randint(100, 90000))
+        paid = random.choice((Decimal(0), (total / 3).quantize(Decimal('0.01')), total))
+        db.session.add(PurchaseOrder(distributor_id=random.randint(1, DISTRIBUTORS), status='received',
+                                     total_amount=total, amount_paid=paid,
+                                     payment_status='paid' if paid == total else 'partial' if paid else 'pending',
+                                     created_at=when()))
+    db.session.commit()
+
+
+def expected_aging(today):
+    """{side: {party key: {bucket: [amount, count]}}} from the invoices, bucketed in Python."""
+    result = {'receivables': defaultdict(lambda: {b: [0.0, 0] for b in AGING_BUCKETS}),
+              'payables': defaultdict(lambda: {b: [0.0, 0] for b in AGING_BUCKETS})}
+    for order in Order.query.filter(Order.status == 'approved', Order.total_amount > Order.amount_paid):
+        key = order.customer_id if order.customer_id else order.customer_name
+        cell = result['receivables'][key][bucket_of(order.created_at, today)]
+        cell[0] += float(order.total_amount - order.amount_paid)
+        cell[1] += 1
+    for po in PurchaseOrder.query.filter(PurchaseOrder.payment_status.in_(OPEN_PAYMENT_STATUSES),
+                                         PurchaseOrder.total_amount > PurchaseOrder.amount_paid):
+        cell = result['payables'][po.distributor_id][bucket_of(po.created_at, today)]
+        cell[0] += float(po.total_amount - po.amount_paid)
+        cell[1] += 1
+    return result
+
+
+def count_queries(fn):
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    fn()
+    event.remove(db.engine, 'before_cursor_execute', listener)
+    return len(statements)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--invoices', type=int, default=2000)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'aging.db')
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+    db.init_app(app)
+    mismatches = []
+
+    with app.app_context():
+        db.create_all()
+        seed_accounts()
+        seed_invoices(args.invoices // 4, 19)
+        small_queries = count_queries(AnalyticsController.get_aging_data)
+        seed_invoices(args.invoices - args.invoices // 4, 20)
+        large_queries = count_queries(AnalyticsController.get_aging_data)
+        print(f"Aging report: {small_queries} queries with {args.invoices // 4} invoices per side, "
+              f"{large_queries} with {args.invoices}")
+        if small_queries != large_queries:
+            mismatches.append(f"query count grew from {small_queries} to {large_queries}")
+
+        today = datetime.now(PKT).date()
+        expected = expected_aging(today)
+        aging = AnalyticsController.get_aging_data()
+        for side in ('receivables', 'payables'):
+            parties = aging[side]['parties']
+            if len(parties) != len(expected[side]):
+                mismatches.append(f"{side}: {len(parties)} parties, expected {len(expected[side])}")
+            for party in parties:
+                key = party['id'] if party['id'] is not None else party['name']
+                for bucket in AGING_BUCKETS:
+                    amount, count = expected[side][key][bucket]
+                    got = party['buckets'][bucket]
+                    if abs(got['amount'] - amount) > 0.005 or got['count'] != count:
+                        mismatches.append(f"{side} {party['name']} {bucket}: {got}, expected {amount:.2f}/{count}")
+
+                    # Drill down into the party's bucket and walk every page
+                    if not count:
+                        continue
+                    party_id, name = (party['id'], None) if party['id'] is not None else (None, party['name'])
+                    seen, total, cursor = set(), 0.0, None
+                    while True:
+                        invoices, cursor = AnalyticsController.get_aging_bucket(side, bucket, party_id, name, cursor)
+                        for invoice in invoices:
+                            seen.add(invoice.id)
+                            total += float(invoice.total_amount - invoice.amount_paid)
+                        if not cursor:
+                            break
+                    if len(seen) != count or abs(total - amount) > 0.005:
+                        mismatches.append(f"{side} {party['name']} {bucket} drill-down: {len(seen)} invoices "
+                                          f"for {total:.2f}, expected {count} for {amount:.2f}")
+
+            for bucket in AGING_BUCKETS:
+                amount = sum(p[bucket][0] for p in expected[side].values())
+                if abs(aging[side]['buckets'][bucket]['amount'] - amount) > 0.005:
+                    mismatches.append(f"{side} {bucket} total: {aging[side]['buckets'][bucket]['amount']:.2f}, "
+                                      f"expected {amount:.2f}")
+
+    for line in mismatches:
+        print('MISMATCH', line)
+    if mismatches:
+        sys.exit(1)
+    print('SQL aging matches the per-invoice bucketing for every party, bucket and drill-down.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,362 @@
+"""Check the SQL FIFO payment allocation against a Python allocation of the same payments.
+
+Seeds a throwaway SQLite database with open, partly paid and settled credit
+invoices and purchase orders (including cent amounts and invoices sharing a
+timestamp), applies a stream of customer and distributor payments of every
+size and compares each payment's allocation rows and the invoices'
+amount_paid (and purchase orders' payment_status) with a Python FIFO pass,
+including orders already loaded in the session before the payment.
+Checks the allocation statements are the same however many invoices a payment
+settles, that no invoice is over-allocated or left open by a rounding
+remainder, and that a bank deposit import or supplier payment run with a bad
+line applies nothing while a good one applies every line in one transaction.
+Exits non-zero on any mismatch.
+
+    python scripts/check_allocations.py [--invoices 3000] [--payments 200] [--deposits 400] [--distributors 35]
+"""
+import io
+import os
+import sys
+import random
+import argparse
+import tempfile
+from decimal import Decimal
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event, func
+from extensions import db
+from models import (Customer, CustomerTransaction, Order, PaymentAllocation, Distributor, PurchaseOrder,
+                    SupplierTransaction, SupplierPaymentAllocation, CashTransaction, PKT)
+from app import create_app, initialize_database
+from controllers.customer_controller import CustomerController
+from controllers.allocation_controller import AllocationController
+from controllers.purchases_controller import PurchasesController
+from controllers.running_balance_controller import RunningBalanceController
+
+CUSTOMERS = 12
+CENT = Decimal('0.01')
+
+
+def seed_customers():
+    db.session.add_all([Customer(name=f'Allocation Customer {i}', phone=f'0300-{i:07d}') for i in range(CUSTOMERS)])
+    db.session.commit()
+
+
+def seed_invoices(invoices):
+    now = datetime.now(PKT).replace(tzinfo=None)
+    for _ in range(invoices):
+        total = Decimal(random.randint(100, 9000000)) / 100
+        paid = random.choice((Decimal(0), Decimal(0), (total / 3).quantize(CENT), total))
+        # Whole-hour stamps so plenty of invoices share a created_at and fall back to id order
+        created_at = (now - timedelta(hours=random.randint(1, 400 * 24))).replace(minute=0, second=0, microsecond=0)
+        db.session.add(Order(created_by=1, status=random.choice(('approved', 'approved', 'approved', 'draft')),
+                             order_type='credit_sale', total_amount=total, amount_paid=paid,
+                             customer_id=random.randint(1, CUSTOMERS), created_at=created_at))
+    db.session.commit()
+
+
+def seed_purchase_orders(distributors, purchase_orders):
+    db.session.add_all([Distributor(name=f'Allocation Distributor {i}', payment_terms=random.choice((15, 30, 60)))
+                        for i in range(distributors)])
+    db.session.commit()
+    first = db.session.query(db.func.min(Distributor.id)).filter(Distributor.name.like('Allocation%')).scalar()
+    now = datetime.now(PKT).replace(tzinfo=None)
+    for _ in range(purchase_orders):
+        total = Decimal(random.randint(100, 9000000)) / 100
+        paid = random.choice((Decimal(0), Decimal(0), (total / 3).quantize(CENT), total))
+        created_at = (now - timedelta(hours=random.randint(1, 400 * 24))).replace(minute=0, second=0, microsecond=0)
+        db.session.add(PurchaseOrder(distributor_id=random.randint(first, first + distributors - 1), created_by=1,
+                                     status=random.choice(('received', 'received', 'pending')), total_amount=total,
+                                     amount_paid=paid, created_at=created_at,
+                                     payment_status='paid' if paid == total else 'partial' if paid else 'pending'))
+    db.session.commit()
+    db.session.execute(db.text(
+        "UPDATE distributor SET balance = (SELECT COALESCE(SUM(total_amount - amount_paid), 0) "
+        "FROM purchase_order WHERE distributor_id = distributor.id)"))
+    db.session.commit()
+    return list(range(first, first + distributors))
+
+
+def open_invoices(customer_id, ledger='customer'):
+    """[(invoice_id, balance due)] oldest first, read straight off the invoice columns."""
+    if ledger == 'customer':
+        rows = Order.query.filter(Order.customer_id == customer_id, Order.status == 'approved')\
+            .order_by(Order.created_at, Order.id)
+    else:
+        rows = PurchaseOrder.query.filter(PurchaseOrder.distributor_id == customer_id,
+                                          PurchaseOrder.payment_status.in_(('pending', 'partial')))\
+            .order_by(PurchaseOrder.created_at, PurchaseOrder.id)
+    return [(o.id, (Decimal(str(o.total_amount)) - Decimal(str(o.amount_paid or 0))).quantize(CENT))
+            for o in rows if Decimal(str(o.total_amount)) > Decimal(str(o.amount_paid or 0))]
+
+
+def expected_allocation(customer_id, amount, ledger='customer'):
+    remaining, result = amount, []
+    for order_id, due in open_invoices(customer_id, ledger):
+        if remaining <= 0:
+            break
+        take = min(due, remaining)
+        result.append((order_id, take))
+        remaining -= take
+    return result
+
+
+def count_statements(fn):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        result = fn()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+    return result, len(statements)
+
+
+def check_payments(payments, failures):
+    statement_counts = set()
+    for i in range(payments):
+        customer = db.session.get(Customer, random.randint(1, CUSTOMERS))
+        outstanding = sum((due for _, due in open_invoices(customer.id)), Decimal(0))
+        amount = random.choice((Decimal(random.randint(1, 500000)) / 100, outstanding,
+                                outstanding + Decimal('123.45'), Decimal(random.randint(1, 99)) / 100))
+        if amount <= 0:
+            continue
+        expected = expected_allocation(customer.id, amount)
+        before = {order_id: Decimal(str(db.session.get(Order, order_id).amount_paid or 0)) for order_id, _ in expected}
+
+        (transaction, allocated, invoices), statements = count_statements(
+            lambda: CustomerController.record_payment(customer, amount, 'cash', None, 1))
+        # The orders read above are still in the session and must show the payment before any commit
+        stale = [order_id for order_id, take in expected
+                 if Decimal(str(db.session.get(Order, order_id).amount_paid or 0)).quantize(CENT)
+                 != (before[order_id] + take).quantize(CENT)]
+        if stale:
+            failures.append(f"payment {i}: orders {stale[:5]} loaded in the session kept their old amount_paid")
+        db.session.commit()
+        statement_counts.add(statements)
+
+        got = [(a.order_id, Decimal(str(a.amount)).quantize(CENT)) for a in PaymentAllocation.query
+               .filter_by(transaction_id=transaction.id).join(Order)
+               .order_by(Order.created_at, Order.id)]
+        if got != expected:
+            failures.append(f"payment {i} of {amount} for customer {customer.id}: {got[:5]}, expected {expected[:5]}")
+            continue
+        if allocated != sum((take for _, take in expected), Decimal(0)) or invoices != len(expected):
+            failures.append(f"payment {i}: reported {allocated} over {invoices} invoice(s)")
+        if allocated > amount:
+            failures.append(f"payment {i}: allocated {allocated} of a {amount} payment")
+        for order_id, take in expected:
+            order = db.session.get(Order, order_id)
+            paid = Decimal(str(order.amount_paid)).quantize(CENT)
+            if paid != (before[order_id] + take).quantize(CENT) or paid > Decimal(str(order.total_amount)):
+                failures.append(f"payment {i}: order {order_id} paid {paid}, expected {before[order_id] + take}")
+            settled = paid == Decimal(str(order.total_amount))
+            if bool(order.is_open) == settled:
+                failures.append(f"payment {i}: order {order_id} is_open={order.is_open} with {paid} of "
+                                f"{order.total_amount} paid")
+    if len(statement_counts) > 1:
+        failures.append(f"a payment takes {sorted(statement_counts)} statements depending on the invoices it settles")
+    return statement_counts
+
+
+def check_plan(failures):
+    for ledger, index in (('customer', 'ix_order_open_customer_created_at'),
+                          ('supplier', 'ix_purchase_order_open_distributor_created_at')):
+        sql = AllocationController.plan(ledger, 1, Decimal('5000'))\
+            .compile(db.engine, compile_kwargs={'literal_binds': True})
+        with db.engine.connect() as conn:
+            plan = [row[-1] for row in conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {sql}')]
+        if not any(index in line for line in plan):
+            failures.append(f"{ledger} allocation plan does not use {index}: {plan}")
+
+
+def deposit_file(rows):
+    lines = ['Date,Customer_ID,Phone,Amount,Reference'] + [','.join(row) for row in rows]
+    return io.BytesIO('\n'.join(lines).encode('utf-8'))
+
+
+def check_deposits(deposits, failures):
+    today = datetime.now(PKT).replace(tzinfo=None)
+    rows = []
+    for i in range(deposits):
+        customer_id = random.randint(1, CUSTOMERS)
+        by_phone = i % 3 == 0
+        rows.append([(today - timedelta(days=random.randint(0, 5))).strftime('%d/%m/%Y'),
+                     '' if by_phone else str(customer_id),
+                     f'+92 300 {customer_id - 1:07d}' if by_phone else '',
+                     str(Decimal(random.randint(100, 2000000)) / 100), f'DEP-{i}'])
+    total = sum((Decimal(row[3]) for row in rows), Decimal(0))
+
+    def counts():
+        return (db.session.query(func.count(CustomerTransaction.id)).scalar(),
+                db.session.query(func.count(PaymentAllocation.id)).scalar(),
+                db.session.query(func.sum(Customer.balance)).scalar())
+
+    # Fresh invoices, so the deposits have something left to settle after the payment stream
+    seed_invoices(deposits * 2)
+    baseline = counts()
+    bad = rows[:deposits // 2] + [[today.strftime('%Y-%m-%d'), '9999', '', '10', 'nobody'],
+                                  ['not a date', '1', '', '10', 'x']] + rows[deposits // 2:]
+    success, message = CustomerController.import_deposits(deposit_file(bad), 1)
+    db.session.rollback()
+    if success or counts() != baseline or 'Line' not in message:
+        failures.append(f"deposit file with bad lines: {success}, {message!r}; counts {baseline} -> {counts()}")
+
+    (success, message), statements = count_statements(lambda: CustomerController.import_deposits(deposit_file(rows), 1))
+    payments = CustomerTransaction.query.filter(CustomerTransaction.reference.like('DEP-%')).all()
+    if not success or len(payments) != deposits:
+        failures.append(f"deposit import: {success}, {message!r}, {len(payments)} payment(s) of {deposits}")
+        return
+    if sum((Decimal(str(p.amount)) for p in payments), Decimal(0)) != total:
+        failures.append("deposit import total differs from the file")
+    if not any(payment.allocations for payment in payments):
+        failures.append("no deposit settled any invoice")
+    if abs(Decimal(str(baseline[2])) - Decimal(str(counts()[2])) - total) > CENT:
+        failures.append("customer balances did not fall by the deposit total")
+    for payment in payments:
+        allocated = sum((Decimal(str(a.amount)) for a in payment.allocations), Decimal(0))
+        if allocated > Decimal(str(payment.amount)):
+            failures.append(f"deposit {payment.reference} over-allocated: {allocated} of {payment.amount}")
+    print(f"Deposit import: {message} ({statements} statements)")
+
+
+def check_supplier_payments(distributor_ids, payments, failures):
+    statement_counts = set()
+    for i in range(payments):
+        distributor = db.session.get(Distributor, random.choice(distributor_ids))
+        outstanding = sum((due for _, due in open_invoices(distributor.id, 'supplier')), Decimal(0))
+        amount = random.choice((Decimal(random.randint(1, 500000)) / 100, outstanding,
+                                outstanding + Decimal('99.99'), Decimal(random.randint(1, 99)) / 100))
+        if amount <= 0:
+            continue
+        expected = expected_allocation(distributor.id, amount, 'supplier')
+        before = {po_id: Decimal(str(db.session.get(PurchaseOrder, po_id).amount_paid or 0)) for po_id, _ in expected}
+        ledger_rows = (db.session.query(func.count(SupplierTransaction.id)).scalar(),
+                       db.session.query(func.count(CashTransaction.id)).scalar())
+
+        (transaction, allocated, purchases), statements = count_statements(
+            lambda: PurchasesController.pay_distributor(distributor, amount, 'bank_transfer', None, 1))
+        db.session.commit()
+        statement_counts.add(statements)
+
+        got = [(a.purchase_order_id, Decimal(str(a.amount)).quantize(CENT)) for a in SupplierPaymentAllocation.query
+               .filter_by(transaction_id=transaction.id).join(PurchaseOrder)
+               .order_by(PurchaseOrder.created_at, PurchaseOrder.id)]
+        if got != expected:
+            failures.append(f"supplier payment {i} of {amount} to {distributor.id}: {got[:5]}, expected {expected[:5]}")
+            continue
+        if allocated != sum((take for _, take in expected), Decimal(0)) or purchases != len(expected):
+            failures.append(f"supplier payment {i}: reported {allocated} over {purchases} purchase order(s)")
+        after = (db.session.query(func.count(SupplierTransaction.id)).scalar(),
+                 db.session.query(func.count(CashTransaction.id)).scalar())
+        if after != (ledger_rows[0] + 1, ledger_rows[1] + 1):
+            failures.append(f"supplier payment {i} wrote {after[0] - ledger_rows[0]} ledger and "
+                            f"{after[1] - ledger_rows[1]} cash row(s)")
+        for po_id, take in expected:
+            purchase = db.session.get(PurchaseOrder, po_id)
+            paid = Decimal(str(purchase.amount_paid)).quantize(CENT)
+            settled = paid == Decimal(str(purchase.total_amount))
+            if paid != (before[po_id] + take).quantize(CENT):
+                failures.append(f"supplier payment {i}: PO {po_id} paid {paid}, expected {before[po_id] + take}")
+            if purchase.payment_status != ('paid' if settled else 'partial') or bool(purchase.is_open) == settled:
+                failures.append(f"supplier payment {i}: PO {po_id} is {purchase.payment_status} "
+                                f"(open={purchase.is_open}) with {paid} of {purchase.total_amount} paid")
+    if len(statement_counts) > 1:
+        failures.append(f"a supplier payment takes {sorted(statement_counts)} statements")
+    return statement_counts
+
+
+def check_payment_run(client, distributor_ids, failures):
+    page = client.get('/distributors/payments')
+    if page.status_code != 200 or b'amount_' not in page.data:
+        failures.append(f"payment run page: {page.status_code}")
+
+    def totals():
+        return (db.session.query(func.count(SupplierTransaction.id)).scalar(),
+                db.session.query(func.sum(Distributor.balance)).scalar())
+
+    amounts = {f'amount_{distributor_id}': str(Decimal(random.randint(100, 5000000)) / 100)
+               for distributor_id in distributor_ids[:30]}
+    baseline = totals()
+    client.post('/distributors/payments', data=dict(amounts, amount_999999='1', payment_method='cheque'))
+    client.post('/distributors/payments', data=dict(amounts, **{f'amount_{distributor_ids[-1]}': 'abc'},
+                                                    payment_method='cheque'))
+    db.session.expire_all()
+    if totals() != baseline:
+        failures.append(f"payment run with a bad line changed the ledger: {baseline} -> {totals()}")
+
+    expected = {int(key[len('amount_'):]): expected_allocation(int(key[len('amount_'):]), Decimal(value), 'supplier')
+                for key, value in amounts.items()}
+    client.post('/distributors/payments', data=dict(amounts, payment_method='cheque', notes='weekly run'))
+    db.session.expire_all()
+    paid = totals()
+    total = sum((Decimal(value) for value in amounts.values()), Decimal(0))
+    if paid[0] != baseline[0] + len(amounts) or \
+            abs(Decimal(str(baseline[1])) - Decimal(str(paid[1])) - total) > CENT:
+        failures.append(f"payment run of {len(amounts)} wrote {paid[0] - baseline[0]} payment(s)")
+    for distributor_id, allocation in expected.items():
+        payment = SupplierTransaction.query.filter_by(distributor_id=distributor_id, transaction_type='payment')\
+            .order_by(SupplierTransaction.id.desc()).first()
+        got = sorted((a.purchase_order_id, Decimal(str(a.amount)).quantize(CENT)) for a in payment.allocations)
+        if got != sorted(allocation):
+            failures.append(f"payment run allocated {got[:3]} for {distributor_id}, expected {allocation[:3]}")
+    print(f"Payment run: {len(amounts)} distributors paid Rs. {total:,.2f} in one transaction")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--invoices', type=int, default=3000)
+    parser.add_argument('--payments', type=int, default=200)
+    parser.add_argument('--deposits', type=int, default=400)
+    parser.add_argument('--distributors', type=int, default=35)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp()
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(root, 'allocations.db')}",
+                      'WTF_CSRF_ENABLED': False})
+    initialize_database(app)
+    failures = []
+
+    with app.app_context():
+        random.seed(23)
+        seed_customers()
+        seed_invoices(args.invoices)
+        distributor_ids = seed_purchase_orders(args.distributors, args.invoices)
+        # Otherwise the month's first ledger write also adds the balance checkpoints
+        RunningBalanceController.refresh_checkpoints()
+        check_plan(failures)
+        statement_counts = check_payments(args.payments, failures)
+        print(f"{args.payments} payments allocated with {sorted(statement_counts)} statement(s) each")
+
+        # The payment form goes through the same allocation
+        client = app.test_client()
+        client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+        expected = expected_allocation(2, Decimal('1500.50'))
+        client.post('/customers/2/payment', data={'amount': '1500.50', 'payment_method': 'cash'})
+        db.session.expire_all()
+        latest = CustomerTransaction.query.filter_by(customer_id=2, transaction_type='payment')\
+            .order_by(CustomerTransaction.id.desc()).first()
+        got = sorted((a.order_id, Decimal(str(a.amount)).quantize(CENT)) for a in latest.allocations)
+        if got != sorted(expected):
+            failures.append(f"payment form allocated {got}, expected {expected}")
+
+        check_deposits(args.deposits, failures)
+
+        statement_counts = check_supplier_payments(distributor_ids, args.payments, failures)
+        print(f"{args.payments} supplier payments allocated with {sorted(statement_counts)} statement(s) each")
+        check_payment_run(client, distributor_ids, failures)
+
+    for line in failures[:20]:
+        print('MISMATCH', line)
+    if failures:
+        sys.exit(1)
+    print('Allocations match a FIFO pass over the open invoices.')
+
+
+if __name__ == '__main__':
+    main()
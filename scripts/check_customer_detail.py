@@ -0,0 +1,134 @@
+"""Check that a customer's detail page costs the same however long their history is.
+
+Seeds a throwaway SQLite database with one wholesale customer carrying a long
+ledger and order history and a new customer with a few entries, then renders
+both detail pages and checks that they run the same number of queries, that
+neither reads the order history (the analytics load separately) and that the
+big customer's page shows only one page of ledger rows. Also checks the lazily
+loaded analytics endpoint against totals summed in Python. Exits non-zero on
+any failure.
+
+    python scripts/check_customer_detail.py [--rows 30000]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+from decimal import Decimal
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event, insert
+from extensions import db
+from models import Customer, CustomerTransaction, Order, OrderItem, Product, PKT
+from app import create_app, initialize_database
+from utils import PAGE_SIZE
+
+
+def seed(rows):
+    random.seed(21)
+    db.session.add_all([Customer(name='Wholesale Customer'), Customer(name='New Customer')])
+    db.session.add_all([Product(name=f'Product {i}', sku=f'CD{i}', selling_price=100, cost_price=80,
+                                stock_quantity=0) for i in range(40)])
+    db.session.commit()
+
+    now = datetime.now(PKT).replace(tzinfo=None)
+    # A month or more back, so the rows are covered by balance checkpoints
+    when = [now - timedelta(days=35, minutes=random.randint(0, 4 * 365 * 24 * 60)) for _ in range(rows)]
+    db.session.execute(insert(CustomerTransaction), [{
+        'customer_id': 1 if i > 2 else 2, 'transaction_type': random.choice(('receivable', 'payment')),
+        'amount': Decimal(random.randint(100, 90000)), 'created_by': 1, 'created_at': at,
+    } for i, at in enumerate(when)])
+    orders = rows // 3
+    db.session.execute(insert(Order), [{
+        'created_by': 1, 'customer_id': 1, 'status': random.choice(('approved', 'approved', 'draft')),
+        'order_type': 'credit_sale', 'total_amount': 0, 'amount_paid': 0, 'created_at': when[i],
+    } for i in range(orders)])
+    db.session.execute(insert(OrderItem), [{
+        'order_id': random.randint(1, orders), 'product_id': random.randint(1, 40),
+        'quantity': random.randint(1, 5), 'price': Decimal(random.randint(50, 500)),
+    } for _ in range(orders * 2)])
+    db.session.execute(db.text(
+        'UPDATE "order" SET total_amount = COALESCE('
+        '(SELECT SUM(price * quantity) FROM order_item WHERE order_id = "order".id), 0)'))
+    db.session.execute(db.text(
+        "UPDATE customer SET balance = (SELECT COALESCE(SUM(CASE WHEN transaction_type = 'receivable' "
+        "THEN amount ELSE -amount END), 0) FROM customer_transaction WHERE customer_id = customer.id)"))
+    db.session.commit()
+
+
+def expected_analytics(customer_id):
+    orders = Order.query.filter_by(customer_id=customer_id, status='approved').all()
+    products = {}
+    for order in orders:
+        for item in order.items:
+            products[item.product.name] = products.get(item.product.name, 0.0) + float(item.price * item.quantity)
+    return {
+        'total_purchases': sum(float(o.total_amount) for o in orders),
+        'total_orders': len(orders),
+        'top_product': max(products.items(), key=lambda p: p[1])[0] if products else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=30000)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'customers.db')
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}', 'WTF_CSRF_ENABLED': False})
+    initialize_database(app)
+    failures = []
+
+    with app.app_context():
+        seed(args.rows)
+        client = app.test_client()
+        client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+        client.get('/customers/2')  # first ledger view writes the month-start checkpoints
+
+        pages = {}
+        for customer_id in (1, 2):
+            statements = []
+            listener = lambda conn, cursor, statement, *a: statements.append(statement)
+            event.listen(db.engine, 'before_cursor_execute', listener)
+            started = time.perf_counter()
+            response = client.get(f'/customers/{customer_id}')
+            elapsed = time.perf_counter() - started
+            event.remove(db.engine, 'before_cursor_execute', listener)
+            pages[customer_id] = (len(statements), response)
+            print(f"Customer {customer_id}: {len(statements)} queries, {elapsed * 1000:.0f}ms")
+            if any('order_item' in s or '"order"' in s for s in statements):
+                failures.append(f"customer {customer_id} page read the order history")
+            if response.status_code != 200:
+                failures.append(f"customer {customer_id} page returned {response.status_code}")
+
+        if pages[1][0] != pages[2][0]:
+            failures.append(f"the big customer's page ran {pages[1][0]} queries, the new customer's {pages[2][0]}")
+        rows = pages[1][1].get_data(as_text=True).count('rounded-pill">Receivable') + \
+            pages[1][1].get_data(as_text=True).count('rounded-pill">Payment')
+        if rows != PAGE_SIZE:
+            failures.append(f"the big customer's page showed {rows} ledger rows, expected {PAGE_SIZE}")
+
+        for customer_id in (1, 2):
+            analytics = client.get(f'/customers/{customer_id}/analytics').get_json()
+            expected = expected_analytics(customer_id)
+            top = analytics['products'][0]['name'] if analytics['products'] else None
+            if abs(analytics['total_purchases'] - expected['total_purchases']) > 0.005 or \
+                    analytics['total_orders'] != expected['total_orders'] or top != expected['top_product']:
+                failures.append(f"customer {customer_id} analytics {analytics['total_purchases']:.2f}/"
+                                f"{analytics['total_orders']}/{top}, expected {expected}")
+        if client.get('/customers/999/analytics').status_code != 404:
+            failures.append('analytics for a missing customer did not return 404')
+
+    for line in failures:
+        print('FAILED', line)
+    if failures:
+        sys.exit(1)
+    print('Customer pages cost the same regardless of history, and the analytics match.')
+
+
+if __name__ == '__main__':
+    main()
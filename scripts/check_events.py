@@ -0,0 +1,124 @@
+"""Check the shared-file event broker keeps ids increasing when its file starts over.
+
+Publishes from several processes into a small FileBroker file so it starts
+over many times while a reader follows it, then checks the reader saw every
+event once with increasing ids. Also reconnects a stream whose Last-Event-ID
+points past the end of the new, shorter file and checks the events published
+since are delivered, and checks that a second stream opened by the same
+session through another worker's broker ends the first one promptly while a
+stream for another session keeps running. Exits non-zero on any failure.
+
+    python scripts/check_events.py [--processes 3] [--events 150]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from events import FileBroker, stream
+
+MAX_BYTES = 2000
+
+
+def publish(path, worker, count):
+    broker = FileBroker(path, max_bytes=MAX_BYTES)
+    for n in range(count):
+        broker.publish('draft_order', {'worker': worker, 'n': n})
+        time.sleep(0.003)
+
+
+def follow(broker, after, seen, stop):
+    while not stop.is_set():
+        for event_id, _, data in broker.wait(after, 0.05):
+            seen.append((event_id, data['worker'], data['n']))
+            after = event_id
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--processes', type=int, default=3)
+    parser.add_argument('--events', type=int, default=150)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'events.log')
+    reader = FileBroker(path, max_bytes=MAX_BYTES, poll_interval=0.002)
+    failures = []
+
+    seen, stop = [], threading.Event()
+    follower = threading.Thread(target=follow, args=(reader, reader.last_id(), seen, stop))
+    follower.start()
+    workers = [multiprocessing.Process(target=publish, args=(path, w, args.events)) for w in range(args.processes)]
+    for p in workers:
+        p.start()
+    for p in workers:
+        p.join()
+    time.sleep(0.2)
+    stop.set()
+    follower.join()
+
+    ids = [event_id for event_id, _, _ in seen]
+    if any(b <= a for a, b in zip(ids, ids[1:])):
+        failures.append("event ids went backwards")
+    received = {(w, n) for _, w, n in seen}
+    if len(received) != len(seen):
+        failures.append("an event was delivered twice")
+    missing = args.processes * args.events - len(received)
+    if missing:
+        failures.append(f"{missing} events never reached the reader")
+    generations = len({event_id // FileBroker.ID_SPAN for event_id in ids})
+    print(f"{len(seen)} events over {generations} file generations")
+    if generations < 2:
+        failures.append("the file never started over; raise --events")
+
+    # A tab that last saw an event near the end of a full file reconnects after the
+    # file started over and holds fewer bytes than its old offset
+    line = len(json.dumps({'event': 'draft_order', 'data': {'worker': -2, 'n': 0}})) + 1
+    while reader._position()[1] + line <= MAX_BYTES:
+        reader.publish('draft_order', {'worker': -1, 'n': 0})
+    stale = reader.last_id()
+    for n in range(3):
+        reader.publish('draft_order', {'worker': -2, 'n': n})
+    if reader._position()[1] >= stale % FileBroker.ID_SPAN:
+        failures.append("the file did not start over before the reconnect")
+    resumed = [data['n'] for _, _, data in reader.wait(stale, 1) if data['worker'] == -2]
+    if resumed != [0, 1, 2]:
+        failures.append(f"reconnect after truncation delivered {resumed}, expected [0, 1, 2]")
+
+    # Two workers share the file; the same session opens a stream in each
+    path = os.path.join(tempfile.mkdtemp(), 'streams.log')
+    workers = []
+    for _ in range(2):
+        worker = Flask(__name__)
+        worker.extensions['events'] = FileBroker(path, poll_interval=0.01)
+        workers.append(worker)
+    with workers[0].app_context():
+        first = stream(session_id='tab-owner', heartbeat=0.2, lifetime=5)
+        other = stream(session_id='someone-else', heartbeat=0.2, lifetime=5)
+    next(first), next(other)
+    with workers[1].app_context():
+        second = stream(session_id='tab-owner', heartbeat=0.2, lifetime=5)
+    started = time.monotonic()
+    ended = [chunk for chunk in first]
+    if not ended or not ended[-1].startswith('event: superseded') or time.monotonic() - started > 1:
+        failures.append(f"the older stream of a session was not ended by the newer one: {ended}")
+    workers[1].extensions['events'].publish('draft_order', {'worker': 0, 'n': 0})
+    if 'event: draft_order' not in next(other) or 'event: draft_order' not in (next(second) + next(second)):
+        failures.append("a stream of another session, or the newer stream, missed an event")
+
+    for line in failures:
+        print('FAIL', line)
+    if failures:
+        sys.exit(1)
+    print('Event ids increase as the file starts over, reconnecting readers miss nothing '
+          'and a session keeps one stream.')
+
+
+if __name__ == '__main__':
+    main()
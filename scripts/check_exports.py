@@ -0,0 +1,157 @@
+"""Check that row-level exports stream in constant memory.
+
+Seeds a throwaway SQLite database with a year of orders and line items, then
+downloads every export as CSV and XLSX through the app and checks the row
+counts, that CSV downloads start before the export has been read (XLSX is a
+zip, sent once the write-only workbook is saved), and that peak Python memory
+(tracemalloc) stays flat when the data grows --growth times. Exits non-zero
+on any failure.
+
+    python scripts/check_exports.py [--orders 3000] [--growth 4]
+"""
+import io
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import insert, func
+from extensions import db
+from models import (Order, OrderItem, Product, Distributor, Customer, StockMovement, CashTransaction,
+                    CustomerTransaction, SupplierTransaction, PKT)
+from app import create_app, initialize_database
+
+ITEMS_PER_ORDER = 3
+DATASETS = {
+    'sales': Order,
+    'order-items': OrderItem,
+    'stock-movements': StockMovement,
+    'cashbook': CashTransaction,
+    'ledger': None,
+}
+
+
+def seed(orders, offset=0):
+    random.seed(16 + offset)
+    if not offset:
+        db.session.add(Distributor(name='Export Distributor'))
+        db.session.add_all([Customer(name=f'Customer {i}') for i in range(100)])
+        db.session.add_all([Product(name=f'Product {i}', sku=f'EXP{i}', distributor_id=1, cost_price=80,
+                                    selling_price=100, stock_quantity=10) for i in range(200)])
+        db.session.commit()
+
+    now = datetime.now(PKT).replace(tzinfo=None)
+
+    def when():
+        return now - timedelta(seconds=random.randint(0, 360 * 86400))
+
+    first_id = (db.session.query(func.max(Order.id)).scalar() or 0) + 1
+    db.session.execute(insert(Order), [{
+        'created_by': 1, 'customer_id': random.randint(1, 100), 'status': 'approved', 'order_type': 'sale',
+        'total_amount': 300, 'total_profit': 60, 'amount_paid': 300, 'created_at': when(),
+    } for _ in range(orders)])
+    db.session.execute(insert(OrderItem), [{
+        'order_id': order_id, 'product_id': random.randint(1, 200), 'quantity': 1, 'price': 100,
+    } for order_id in range(first_id, first_id + orders) for _ in range(ITEMS_PER_ORDER)])
+    db.session.execute(insert(StockMovement), [{
+        'product_id': random.randint(1, 200), 'quantity_change': -1, 'quantity_before': 10, 'quantity_after': 9,
+        'reference_type': 'sale', 'reference_id': 1, 'user_id': 1, 'timestamp': when(),
+    } for _ in range(orders)])
+    db.session.execute(insert(CashTransaction), [{
+        'transaction_type': random.choice(('in', 'out')), 'amount': random.randint(1, 1000), 'source': 'sales',
+        'created_by': 1, 'created_at': when(),
+    } for _ in range(orders)])
+    db.session.execute(insert(CustomerTransaction), [{
+        'customer_id': random.randint(1, 100), 'transaction_type': random.choice(('receivable', 'payment')),
+        'amount': random.randint(1, 1000), 'created_by': 1, 'created_at': when(),
+    } for _ in range(orders // 2)])
+    db.session.execute(insert(SupplierTransaction), [{
+        'distributor_id': 1, 'transaction_type': random.choice(('payable', 'payment')),
+        'amount': random.randint(1, 1000), 'created_by': 1, 'created_at': when(),
+    } for _ in range(orders // 2)])
+    db.session.commit()
+
+
+def download(client, dataset, fmt):
+    """(status, xlsx body or None, csv line count, seconds to first chunk, seconds total, peak traced bytes)."""
+    tracemalloc.start()
+    started = time.perf_counter()
+    response = client.get(f'/analytics/export/{dataset}?format={fmt}', buffered=False)
+    first_chunk, size, body = None, 0, io.BytesIO() if fmt == 'xlsx' else None
+    rows = 0
+    for chunk in response.response:
+        if first_chunk is None:
+            first_chunk = time.perf_counter() - started
+        chunk = chunk if isinstance(chunk, bytes) else chunk.encode()
+        size += len(chunk)
+        if body is not None:
+            body.write(chunk)
+        else:
+            rows += chunk.count(b'\n')
+    response.close()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return response.status_code, body, rows, first_chunk, time.perf_counter() - started, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--orders', type=int, default=3000)
+    parser.add_argument('--growth', type=int, default=4)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'exports.db')
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}', 'WTF_CSRF_ENABLED': False})
+    initialize_database(app)
+    client = app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+    failures = []
+    peaks = {}
+
+    for stage, orders in (('small', args.orders), ('large', args.orders * (args.growth - 1))):
+        with app.app_context():
+            seed(orders, offset=0 if stage == 'small' else 1)
+            expected = {name: (model.query.count() if model else
+                               CustomerTransaction.query.count() + SupplierTransaction.query.count())
+                        for name, model in DATASETS.items()}
+
+        for dataset in DATASETS:
+            for fmt in ('csv', 'xlsx'):
+                status, body, rows, first, total, peak = download(client, dataset, fmt)
+                if status != 200:
+                    failures.append(f"{dataset}.{fmt}: HTTP {status}")
+                    continue
+                if fmt == 'xlsx':
+                    from openpyxl import load_workbook
+                    sheet = load_workbook(body, read_only=True).worksheets[0]
+                    rows = sum(1 for _ in sheet.iter_rows(values_only=True))
+                if rows - 1 != expected[dataset]:
+                    failures.append(f"{dataset}.{fmt}: {rows - 1} rows, expected {expected[dataset]}")
+                if fmt == 'csv' and stage == 'large' and first > total / 2:
+                    failures.append(f"{dataset}.csv: first chunk after {first:.2f}s of {total:.2f}s")
+                peaks[(stage, dataset, fmt)] = peak
+                print(f"{stage:<5} {dataset:<16} {fmt:<4} {expected[dataset]:>7} rows  first chunk "
+                      f"{first * 1000:>7.1f}ms  total {total:>6.2f}s  peak {peak / 1024 / 1024:>6.1f} MiB")
+
+    for dataset in DATASETS:
+        for fmt in ('csv', 'xlsx'):
+            small, large = peaks.get(('small', dataset, fmt)), peaks.get(('large', dataset, fmt))
+            # Allow slack for caches warming up; a buffered export would grow ~growth times
+            if small and large and large > small * 1.5 + 1024 * 1024:
+                failures.append(f"{dataset}.{fmt}: peak memory grew from {small} to {large} bytes")
+
+    for line in failures:
+        print('FAILED', line)
+    if failures:
+        sys.exit(1)
+    print('Every export streamed with flat memory.')
+
+
+if __name__ == '__main__':
+    main()
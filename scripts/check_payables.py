@@ -0,0 +1,132 @@
+"""Check the payables overview against a Python pass over every purchase order.
+
+Seeds a throwaway SQLite database with a few distributors, renders the
+payables page, the distributor list and the supplier payment run and counts
+their queries, then adds hundreds more distributors with open, partly paid
+and settled purchase orders and checks the same pages take the same number
+of queries. Compares each creditor's open-PO count, total, oldest date and
+listed purchase orders with the purchase orders themselves. Exits non-zero on
+any mismatch.
+
+    python scripts/check_payables.py [--distributors 300] [--purchase-orders 6000]
+"""
+import os
+import sys
+import random
+import argparse
+import tempfile
+from decimal import Decimal
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event
+from extensions import db
+from models import Distributor, PurchaseOrder, PKT, OPEN_PAYMENT_STATUSES
+from app import create_app, initialize_database
+from controllers.analytics_controller import AnalyticsController, PAYABLES_PO_LIMIT
+
+PAGES = ('/analytics/payables', '/distributors/', '/distributors/payments')
+
+
+def seed(distributors, purchase_orders):
+    now = datetime.now(PKT).replace(tzinfo=None)
+    first = (db.session.query(db.func.max(Distributor.id)).scalar() or 0) + 1
+    db.session.add_all([Distributor(name=f'Payables Distributor {first + i}', payment_terms=random.choice((15, 30, 60)))
+                        for i in range(distributors)])
+    db.session.commit()
+    for _ in range(purchase_orders):
+        total = Decimal(random.randint(100, 9000000)) / 100
+        paid = random.choice((Decimal(0), (total / 4).quantize(Decimal('0.01')), total))
+        db.session.add(PurchaseOrder(distributor_id=random.randint(first, first + distributors - 1), created_by=1,
+                                     status='received', total_amount=total, amount_paid=paid,
+                                     payment_status='paid' if paid == total else 'partial' if paid else 'pending',
+                                     created_at=now - timedelta(hours=random.randint(1, 300 * 24))))
+    db.session.commit()
+    db.session.execute(db.text(
+        "UPDATE distributor SET balance = (SELECT COALESCE(SUM(total_amount - amount_paid), 0) "
+        "FROM purchase_order WHERE distributor_id = distributor.id)"))
+    db.session.commit()
+
+
+def count_queries(app, client, path):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        response = client.get(path)
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+    return response.status_code, len(statements)
+
+
+def compare(failures):
+    data = AnalyticsController.get_payables_data()
+    open_pos = {}
+    for po in PurchaseOrder.query.order_by(PurchaseOrder.created_at, PurchaseOrder.id):
+        if po.payment_status in OPEN_PAYMENT_STATUSES and po.total_amount > po.amount_paid:
+            open_pos.setdefault(po.distributor_id, []).append(po)
+    debtors = [d.id for d in Distributor.query.filter(Distributor.balance > 0)
+               .order_by(Distributor.balance.desc(), Distributor.id)]
+    if [c['distributor'].id for c in data['creditors']] != debtors:
+        failures.append("creditors differ from the distributors with a balance")
+    for creditor in data['creditors']:
+        pos = open_pos.get(creditor['distributor'].id, [])
+        amount = sum((Decimal(str(po.total_amount)) - Decimal(str(po.amount_paid)) for po in pos), Decimal(0))
+        oldest = pos[0].created_at if pos else None
+        if creditor['open_count'] != len(pos) or abs(creditor['open_amount'] - amount) > Decimal('0.01') \
+                or creditor['oldest'] != oldest:
+            failures.append(f"distributor {creditor['distributor'].id}: {creditor['open_count']} open, "
+                            f"{creditor['open_amount']} from {creditor['oldest']}; "
+                            f"expected {len(pos)}, {amount} from {oldest}")
+        if [po.id for po in creditor['outstanding_pos']] != [po.id for po in pos[:PAYABLES_PO_LIMIT]]:
+            failures.append(f"distributor {creditor['distributor'].id}: listed POs differ from the oldest open")
+    if data['total_payable'] != sum((c['balance'] for c in data['creditors']), Decimal(0)):
+        failures.append("total payable differs from the creditors' balances")
+    return len(data['creditors'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--distributors', type=int, default=300)
+    parser.add_argument('--purchase-orders', type=int, default=6000)
+    args = parser.parse_args()
+
+    random.seed(25)
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'payables.db')}",
+                      'WTF_CSRF_ENABLED': False})
+    initialize_database(app)
+    client = app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+    failures = []
+
+    counts = {}
+    for label, distributors, purchase_orders in (('few', 4, 60), ('many', args.distributors, args.purchase_orders)):
+        with app.app_context():
+            seed(distributors, purchase_orders)
+            creditors = compare(failures)
+        counts[label] = {path: count_queries(app, client, path) for path in PAGES}
+        print(f"{creditors} creditors: " + ', '.join(f"{path} {status} in {n} queries"
+                                                     for path, (status, n) in counts[label].items()))
+
+    for path in PAGES:
+        (few_status, few), (many_status, many) = counts['few'][path], counts['many'][path]
+        if few_status != 200 or many_status != 200:
+            failures.append(f"{path} returned {few_status}/{many_status}")
+        elif few != many:
+            failures.append(f"{path} takes {few} queries with few suppliers and {many} with many")
+
+    for line in failures[:20]:
+        print('MISMATCH', line)
+    if failures:
+        sys.exit(1)
+    print('Payables pages take a constant number of queries and match the purchase orders.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+"""Check that closing a month freezes its reports and guards it against writes.
+
+Seeds a throwaway SQLite database with three months of orders, expenses,
+purchases and ledger rows, closes the oldest finished month and checks that:
+
+- its monthly report and dashboard match what they showed before the close,
+  and are read from the snapshot without touching the rollups;
+- back-dated inserts, edits and deletes in the month are refused;
+- late changes to an order and a purchase order from the month (approving an
+  old draft, receiving an old PO) are posted to today, so the closed month is
+  unchanged and the open month moves;
+- rebuild-rollups leaves the closed month alone and books the late changes on
+  today again, so the current month reads the same before and after;
+- the current month and an already closed month cannot be closed.
+
+Exits non-zero on any failure.
+
+    python scripts/check_period_close.py
+"""
+import os
+import sys
+import random
+import tempfile
+from decimal import Decimal
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event
+from extensions import db
+from models import (Order, Expense, PurchaseOrder, CashTransaction, CustomerTransaction, Customer, Distributor,
+                    DailySummary, PKT)
+from app import create_app, initialize_database
+from utils import period_bounds
+from controllers.period_controller import PeriodClosedError
+from controllers.reports_controller import ReportsController
+from controllers.analytics_controller import AnalyticsController
+from controllers.aggregation_controller import AggregationController
+from controllers.rollup_controller import RollupController
+
+
+def month_back(now, months):
+    year, month = now.year, now.month - months
+    while month < 1:
+        year, month = year - 1, month + 12
+    return year, month
+
+
+def seed(months):
+    random.seed(18)
+    db.session.add(Customer(name='Period Customer'))
+    db.session.add(Distributor(name='Period Distributor'))
+    db.session.commit()
+    for year, month in months:
+        start, end = period_bounds(year, month)
+        for _ in range(40):
+            when = start + timedelta(seconds=random.randrange(int((end - start).total_seconds())))
+            amount = Decimal(random.randint(100, 5000))
+            db.session.add(Order(created_by=1, customer_id=1, status='approved',
+                                 order_type=random.choice(('sale', 'credit_sale')), total_amount=amount,
+                                 total_profit=amount / 5, amount_paid=amount, created_at=when))
+            db.session.add(Expense(category=random.choice(('bills', 'rent')), amount=amount / 10, expense_date=when))
+            db.session.add(PurchaseOrder(distributor_id=1, status='received', total_amount=amount / 2,
+                                         created_at=when))
+            db.session.add(CashTransaction(transaction_type='in', amount=amount, source='sales', created_by=1,
+                                           created_at=when))
+        # A draft and an unreceived PO left over from this month, settled after it closes
+        db.session.add(Order(created_by=1, status='draft', order_type='sale', total_amount=Decimal('999'),
+                             total_profit=Decimal('99'), amount_paid=Decimal('999'),
+                             created_at=start + timedelta(days=3)))
+        db.session.add(PurchaseOrder(distributor_id=1, status='pending', total_amount=Decimal('777'),
+                                     created_at=start + timedelta(days=4)))
+    db.session.commit()
+    RollupController.rebuild()
+
+
+def main():
+    path = os.path.join(tempfile.mkdtemp(), 'periods.db')
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}', 'WTF_CSRF_ENABLED': False})
+    initialize_database(app)
+    failures = []
+
+    def expect_refused(label, change):
+        try:
+            change()
+            db.session.commit()
+            failures.append(f"{label} was accepted")
+        except PeriodClosedError:
+            db.session.rollback()
+
+    with app.app_context():
+        now = datetime.now(PKT)
+        closed, open_past, current = month_back(now, 2), month_back(now, 1), month_back(now, 0)
+        seed([closed, open_past, current])
+
+        report_before = ReportsController.get_monthly_report(*closed)
+        dashboard_before = AnalyticsController.get_dashboard_metrics(*closed)
+        year_before = AnalyticsController.get_dashboard_metrics(closed[0], None)
+
+        success, message = ReportsController.close_month(*closed, user_id=1)
+        print(message)
+        if not success:
+            failures.append(f"close failed: {message}")
+        for label, month in (('current month', current), ('closed month again', closed)):
+            if ReportsController.close_month(*month, user_id=1)[0]:
+                failures.append(f"closing the {label} succeeded")
+
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        report_after = ReportsController.get_monthly_report(*closed)
+        event.remove(db.engine, 'before_cursor_execute', listener)
+        print(f"Closed month report: {len(statements)} queries")
+        if any('daily_summary' in s for s in statements):
+            failures.append('closed month report read the rollup')
+
+        def same(label, before, after):
+            for key, value in before.items():
+                if key != 'closed_at' and key in after and after[key] != value and \
+                        not (isinstance(value, float) and abs(after[key] - value) < 0.005):
+                    failures.append(f"{label} {key}: {value!r} became {after[key]!r}")
+
+        same('report', report_before, report_after)
+        dashboard_after = AnalyticsController.get_dashboard_metrics(*closed)
+        same('dashboard', {k: v for k, v in dashboard_before.items() if not k.startswith('top_')}, dashboard_after)
+        for key in ('top_products', 'top_distributors'):
+            before = [(r.name if hasattr(r, 'name') else r['name']) for r in dashboard_before[key]]
+            after = [(r.name if hasattr(r, 'name') else r['name']) for r in dashboard_after[key]]
+            if before != after:
+                failures.append(f"dashboard {key} changed")
+
+        # Writes dated in the closed month
+        start, end = period_bounds(*closed)
+        inside = start + timedelta(days=10)
+        expect_refused('back-dated cash entry', lambda: db.session.add(CashTransaction(
+            transaction_type='in', amount=5, source='manual', created_by=1, created_at=inside)))
+        expect_refused('back-dated order', lambda: db.session.add(Order(
+            created_by=1, status='approved', order_type='sale', total_amount=5, created_at=inside)))
+        expect_refused('back-dated customer ledger row', lambda: db.session.add(CustomerTransaction(
+            customer_id=1, transaction_type='receivable', amount=5, created_by=1, created_at=inside)))
+        old_expense = Expense.query.filter(Expense.expense_date >= start, Expense.expense_date < end).first()
+        expect_refused('closed expense edit', lambda: setattr(old_expense, 'amount', 1))
+        old_cash = CashTransaction.query.filter(CashTransaction.created_at >= start,
+                                                CashTransaction.created_at < end).first()
+        expect_refused('closed cash entry delete', lambda: db.session.delete(old_cash))
+        moved = Order.query.filter(Order.created_at >= period_bounds(*open_past)[0]).first()
+        expect_refused('order moved into the closed month', lambda: setattr(moved, 'created_at', inside))
+
+        # Writes dated now and after the closed month are unaffected
+        db.session.add(CashTransaction(transaction_type='in', amount=5, source='manual', created_by=1))
+        db.session.add(Expense(category='bills', amount=5,
+                               expense_date=period_bounds(*open_past)[0] + timedelta(days=2)))
+        db.session.commit()
+
+        # Approving an old draft: the order changes, its figures go to today
+        current_before = AggregationController.get_month_totals(*current)
+        draft = Order.query.filter(Order.status == 'draft', Order.created_at >= start,
+                                   Order.created_at < end).one()
+        draft.status = 'approved'
+        RollupController.record_order(draft)
+        old_po = PurchaseOrder.query.filter(PurchaseOrder.status == 'pending', PurchaseOrder.created_at >= start,
+                                            PurchaseOrder.created_at < end).one()
+        old_po.status = 'received'
+        RollupController.record_purchase(old_po, old_po.total_amount)
+        db.session.commit()
+        current_after = AggregationController.get_month_totals(*current)
+        same('report after a late approval', report_before, ReportsController.get_monthly_report(*closed))
+        for key, late in (('total_revenue', 999), ('total_purchases', 777)):
+            if abs(current_after[key] - current_before[key] - late) > 0.005:
+                failures.append(f"late change did not reach the current month's {key}: "
+                                f"{current_before[key]} -> {current_after[key]}")
+
+        # A full rebuild keeps the closed month's rollup rows as they were
+        closed_rows = [(r.date, r.sales_total) for r in DailySummary.query.filter(
+            DailySummary.date >= start.date(), DailySummary.date < end.date()).order_by(DailySummary.date)]
+        RollupController.rebuild()
+        after_rows = [(r.date, r.sales_total) for r in DailySummary.query.filter(
+            DailySummary.date >= start.date(), DailySummary.date < end.date()).order_by(DailySummary.date)]
+        if closed_rows != after_rows:
+            failures.append('rebuild-rollups rewrote the closed month')
+        # ...and replays the late changes on the day they were posted
+        current_rebuilt = AggregationController.get_month_totals(*current)
+        for key in ('total_revenue', 'total_purchases', 'gross_profit'):
+            if abs(current_rebuilt[key] - current_after[key]) > 0.005:
+                failures.append(f"rebuild-rollups changed the current month's {key}: "
+                                f"{current_after[key]} -> {current_rebuilt[key]}")
+        same('report after rebuild', report_before, ReportsController.get_monthly_report(*closed))
+        year_after = AnalyticsController.get_dashboard_metrics(closed[0], None)
+        if year_before['monthly_cash'][closed[1] - 1] != year_after['monthly_cash'][closed[1] - 1]:
+            failures.append('yearly chart changed for the closed month')
+
+    for line in failures:
+        print('FAILED', line)
+    if failures:
+        sys.exit(1)
+    print('The closed month stayed frozen.')
+
+
+if __name__ == '__main__':
+    main()
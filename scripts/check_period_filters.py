@@ -0,0 +1,136 @@
+"""Check that range-based period filters give the same totals as extract(year/month).
+
+Seeds a throwaway SQLite database with rows on the edges of every month
+(first and last instant, PKT-aware values late in the day, UTC values that
+straddle the PKT midnight) and compares, per month and per year, the old
+extract() predicates with period_bounds/filter_period, the daily rollup and
+StaffController.get_salary_summary. Exits non-zero on any mismatch.
+
+    python scripts/check_period_filters.py
+"""
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import func, extract
+from extensions import db
+from models import Order, Expense, EmployeePayment, Employee, User, PKT
+from utils import period_bounds, filter_period
+from controllers.aggregation_controller import AggregationController
+from controllers.rollup_controller import RollupController
+from controllers.staff_controller import StaffController
+
+
+def edge_times(year, month):
+    """Timestamps on and around the edges of a calendar month."""
+    start, end = period_bounds(year, month)
+    last = end - timedelta(microseconds=1)
+    return [
+        start,
+        start + timedelta(hours=4, minutes=59),
+        start + timedelta(days=14, hours=12),
+        last,
+        end - timedelta(seconds=1),
+        # PKT-aware: stored as the PKT wall clock
+        (end - timedelta(minutes=30)).replace(tzinfo=PKT),
+        # UTC value 00:30 PKT on the 1st: SQLite keeps the 19:30 wall clock, so both filters keep it in this month
+        (end - timedelta(hours=4, minutes=30)).replace(tzinfo=PKT).astimezone(timezone.utc),
+    ]
+
+
+def seed(year):
+    db.session.add(User(username='periods', password_hash='-', role='admin'))
+    db.session.add(Employee(nickname='periods', full_name='Period Check'))
+    db.session.commit()
+    amount = 1
+    for y in (year - 1, year, year + 1):
+        for m in range(1, 13):
+            for when in edge_times(y, m):
+                db.session.add(Order(created_by=1, status='approved', order_type='sale',
+                                     total_amount=amount, total_profit=amount, amount_paid=amount,
+                                     created_at=when))
+                db.session.add(Expense(category='bills', amount=amount, expense_date=when))
+                db.session.add(EmployeePayment(employee_id=1, payment_type='salary', amount=amount, date=when))
+                amount += 1
+    db.session.commit()
+    RollupController.rebuild(end=period_bounds(year + 2)[0].date())
+
+
+def legacy_sum(amount, column, year, month=None):
+    query = db.session.query(func.sum(amount)).filter(extract('year', column) == year)
+    if month:
+        query = query.filter(extract('month', column) == month)
+    return float(query.scalar() or 0)
+
+
+def ranged_sum(amount, column, year, month=None):
+    start, end = period_bounds(year, month)
+    return float(filter_period(db.session.query(func.sum(amount)), column, start, end).scalar() or 0)
+
+
+def main():
+    path = os.path.join(tempfile.mkdtemp(), 'periods.db')
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+    db.init_app(app)
+
+    year = datetime.now(PKT).year
+    mismatches = []
+
+    def check(label, expected, actual):
+        if abs(expected - actual) > 0.005:
+            mismatches.append(f"{label}: extract={expected} range={actual}")
+
+    with app.app_context():
+        db.create_all()
+        seed(year)
+
+        columns = [
+            ('order', Order.total_amount, Order.created_at),
+            ('expense', Expense.amount, Expense.expense_date),
+            ('staff', EmployeePayment.amount, EmployeePayment.date),
+        ]
+        for y in (year - 1, year, year + 1):
+            for month in [None] + list(range(1, 13)):
+                period = f"{y}-{month:02d}" if month else str(y)
+                for name, amount, column in columns:
+                    check(f"{name} {period}", legacy_sum(amount, column, y, month),
+                          ranged_sum(amount, column, y, month))
+                if month:
+                    totals = AggregationController.get_month_totals(y, month)
+                    check(f"rollup revenue {period}", legacy_sum(Order.total_amount, Order.created_at, y, month),
+                          totals['total_revenue'])
+                    check(f"rollup expenses {period}", legacy_sum(Expense.amount, Expense.expense_date, y, month),
+                          totals['total_expenses'])
+
+        summary = StaffController.get_salary_summary()
+        now = datetime.now(PKT)
+        check('salary month_total', legacy_sum(EmployeePayment.amount, EmployeePayment.date, now.year, now.month),
+              summary['month_total'])
+        check('salary year_total', legacy_sum(EmployeePayment.amount, EmployeePayment.date, now.year),
+              summary['year_total'])
+        for m in range(1, 13):
+            check(f"salary chart {m:02d}", legacy_sum(EmployeePayment.amount, EmployeePayment.date, now.year, m),
+                  summary['monthly_data'][m - 1])
+
+        # Custom ranges: both days inclusive, aware datetimes resolved to their PKT day
+        start, end = period_bounds(start_date='2024-01-31', end_date='2024-02-01')
+        if (start, end) != (datetime(2024, 1, 31), datetime(2024, 2, 2)):
+            mismatches.append(f"custom range bounds: {start} .. {end}")
+        late_utc = datetime(2024, 1, 31, 20, 0, tzinfo=timezone.utc)
+        if period_bounds(start_date=late_utc)[0] != datetime(2024, 2, 1):
+            mismatches.append('UTC timestamp not resolved to its PKT day')
+
+    for line in mismatches:
+        print('MISMATCH', line)
+    if mismatches:
+        sys.exit(1)
+    print('Range filters match extract() totals for every month and year checked.')
+
+
+if __name__ == '__main__':
+    main()
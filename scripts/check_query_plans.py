@@ -0,0 +1,203 @@
+"""Check that the hot read paths are served by indexes.
+
+Seeds a throwaway SQLite database through the migration path, runs the
+dashboard, order history, aging and ledger code, and prints EXPLAIN QUERY
+PLAN for every SELECT they emit. Exits non-zero when any of them scans one of
+the large transactional tables without an index, or when an open-invoice path
+reads orders or purchase orders through anything but an open-only index.
+
+    python scripts/check_query_plans.py [--rows 5000] [--verbose]
+"""
+import os
+import sys
+import random
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import event, insert
+from extensions import db
+from models import (Order, OrderItem, Product, PurchaseOrder, Expense, EmployeePayment, CashTransaction,
+                    CustomerTransaction, SupplierTransaction, StockMovement, Customer, Distributor,
+                    Employee, User)
+import migrations
+from controllers.analytics_controller import AnalyticsController
+from controllers.main_controller import MainController
+from controllers.sales_controller import SalesController
+from controllers.rollup_controller import RollupController
+from controllers.running_balance_controller import RunningBalanceController
+from controllers.allocation_controller import AllocationController
+from controllers.purchases_controller import PurchasesController
+
+LARGE_TABLES = {
+    'order', 'order_item', 'purchase_order', 'purchase_order_item', 'customer_transaction',
+    'supplier_transaction', 'cash_transaction', 'stock_movement', 'expense', 'employee_payment',
+}
+
+# Paths that only look at open invoices, and the invoice tables they read
+OPEN_INVOICE_PATHS = {'outstanding totals', 'credit reminders', 'payment allocation', 'supplier payment allocation',
+                      'supplier payment run', 'aging', 'aging drill-down', 'payables'}
+INVOICE_TABLES = {'order', 'purchase_order'}
+
+
+def seed(rows):
+    random.seed(7)
+    now = datetime.now()
+
+    def when():
+        return now - timedelta(seconds=random.randint(0, 400 * 86400))
+
+    db.session.add(User(username='plans', password_hash='-', role='admin'))
+    db.session.add_all([Distributor(name=f'Distributor {i}') for i in range(20)])
+    db.session.add_all([Customer(name=f'Customer {i}') for i in range(200)])
+    db.session.add_all([Product(name=f'Product {i}', sku=f'SKU{i}', distributor_id=1 + i % 20,
+                                selling_price=100, cost_price=80, stock_quantity=random.randint(0, 50),
+                                min_stock_level=10) for i in range(300)])
+    db.session.add(Employee(nickname='plans', full_name='Plan Check'))
+    db.session.commit()
+
+    statuses = ('approved',) * 8 + ('draft', 'cancelled')
+    db.session.execute(insert(Order), [{
+        'created_by': 1, 'customer_id': random.randint(1, 200), 'status': random.choice(statuses),
+        'order_type': random.choice(('sale', 'sale', 'credit_sale', 'return')),
+        'total_amount': 1000, 'total_profit': 200, 'amount_paid': random.choice((0, 500, 1000)),
+        'created_at': when(), 'due_date': now + timedelta(days=random.randint(-30, 30)),
+    } for _ in range(rows)])
+    db.session.execute(insert(OrderItem), [
+        {'order_id': random.randint(1, rows), 'product_id': random.randint(1, 300), 'quantity': 1, 'price': 100}
+        for _ in range(rows * 2)])
+    db.session.execute(insert(PurchaseOrder), [{
+        'distributor_id': random.randint(1, 20), 'status': random.choice(('received', 'received', 'pending')),
+        'total_amount': 5000, 'amount_paid': 0, 'created_at': when(),
+        'payment_status': random.choice(('paid',) * 18 + ('pending', 'partial')),
+    } for _ in range(rows // 5)])
+    db.session.execute(insert(CustomerTransaction), [{
+        'customer_id': random.randint(1, 200), 'transaction_type': random.choice(('receivable', 'payment')),
+        'amount': 100, 'created_at': when(),
+    } for _ in range(rows)])
+    db.session.execute(insert(SupplierTransaction), [{
+        'distributor_id': random.randint(1, 20), 'transaction_type': random.choice(('payable', 'payment')),
+        'amount': 100, 'created_at': when(),
+    } for _ in range(rows // 2)])
+    db.session.execute(insert(CashTransaction), [{
+        'transaction_type': random.choice(('in', 'out')), 'amount': 100, 'source': 'sale',
+        'created_at': when(),
+    } for _ in range(rows)])
+    db.session.execute(insert(StockMovement), [{
+        'product_id': random.randint(1, 300), 'quantity_change': -1, 'reference_type': 'sale', 'timestamp': when(),
+    } for _ in range(rows)])
+    db.session.execute(insert(Expense), [
+        {'category': random.choice(('bills', 'rent', 'other')), 'amount': 100, 'expense_date': when()}
+        for _ in range(rows // 10)])
+    db.session.execute(insert(EmployeePayment), [
+        {'employee_id': 1, 'payment_type': 'salary', 'amount': 100, 'date': when()}
+        for _ in range(rows // 10)])
+    db.session.commit()
+    # No ANALYZE: the app never runs it, so plans here match what a live pos.db gets
+    RollupController.rebuild(chunk_days=92)
+    # The bulk inserts skip the flush hook that adds balance checkpoints; write them as the command would
+    RunningBalanceController.refresh_checkpoints()
+
+
+def capture(fn):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            statements.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        fn()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+        db.session.rollback()
+    return statements
+
+
+def full_scans(plan):
+    """Plan lines that read a large table without any index."""
+    problems = []
+    for line in plan:
+        words = line.replace('"', '').split()
+        if len(words) >= 2 and words[0] == 'SCAN' and words[1] in LARGE_TABLES and 'INDEX' not in words:
+            problems.append(line)
+    return problems
+
+
+def settled_reads(plan):
+    """Plan lines that read invoices through something other than an open-only partial index."""
+    problems = []
+    for line in plan:
+        words = line.replace('"', '').split()
+        if len(words) >= 2 and words[0] in ('SCAN', 'SEARCH') and words[1] in INVOICE_TABLES \
+                and '_open_' not in line:
+            problems.append(line)
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--verbose', action='store_true', help='Print every plan, not only failures.')
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'plans.db')
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+    db.init_app(app)
+
+    with app.app_context():
+        db.create_all()
+        migrations.upgrade()
+        seed(args.rows)
+
+        now = datetime.now()
+        start = (now - timedelta(days=30)).strftime('%Y-%m-%d')
+        end = now.strftime('%Y-%m-%d')
+        paths = {
+            'analytics dashboard (month)': lambda: AnalyticsController.get_dashboard_metrics(now.year, now.month),
+            'admin dashboard': MainController.get_admin_dashboard_data,
+            'outstanding totals': AnalyticsController.get_outstanding_totals,
+            'credit reminders': MainController.get_credit_due_reminders,
+            'order history (date range)': lambda: SalesController.get_all_orders('all', start, end),
+            'order history (type + range)': lambda: SalesController.get_all_orders('credit_sale', start, end),
+            'payment allocation': lambda: db.session.execute(AllocationController.plan('customer', 1, 5000)).all(),
+            'supplier payment allocation':
+                lambda: db.session.execute(AllocationController.plan('supplier', 1, 5000)).all(),
+            'supplier payment run': PurchasesController.get_payment_run,
+            'aging': AnalyticsController.get_aging_data,
+            'aging drill-down': lambda: AnalyticsController.get_aging_bucket('receivables', '31-60', 1),
+            'payables': AnalyticsController.get_payables_data,
+            'receivables': AnalyticsController.get_receivables_data,
+            'cash ledger (date range)': lambda: AnalyticsController.get_ledger_data('all', start, end),
+            'account ledger (date range)': lambda: AnalyticsController.get_ledger_entries('all', start, end),
+        }
+
+        failures = 0
+        for label, fn in paths.items():
+            statements = capture(fn)
+            print(f"-- {label}: {len(statements)} select(s)")
+            with db.engine.connect() as conn:
+                for statement, parameters in statements:
+                    plan = [row[-1] for row in conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters)]
+                    problems = full_scans(plan)
+                    if label in OPEN_INVOICE_PATHS:
+                        problems += settled_reads(plan)
+                    failures += bool(problems)
+                    if problems or args.verbose:
+                        print('   ', ' '.join(statement.split())[:160])
+                        for line in plan:
+                            print('       ', 'FULL SCAN' if line in problems else '         ', line)
+
+    if failures:
+        print(f"{failures} statement(s) scan a large table without an index or read settled invoices.")
+        sys.exit(1)
+    print('No full scans of large tables.')
+
+
+if __name__ == '__main__':
+    main()
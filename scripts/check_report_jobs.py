@@ -0,0 +1,211 @@
+"""Check the background report queue and artifact store.
+
+Runs the app against a throwaway SQLite database with a slowed-down PDF
+renderer, then checks that:
+
+- a burst of simultaneous PDF downloads for one month queues a single job and
+  every request returns without waiting for the render, while a counter keeps
+  searching products at normal speed;
+- the finished report downloads, and asking for a closed month again is served
+  from the artifact store without rendering it again;
+- the current month is rendered again once its last job has finished;
+- workers racing to claim jobs never claim one twice, and a job left running by
+  a dead worker is retried, then failed after MAX_ATTEMPTS.
+
+Exits non-zero on any failure.
+
+    python scripts/check_report_jobs.py [--burst 12] [--render-seconds 1.0]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from statistics import median
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import jobs
+from extensions import db
+from models import ReportJob, PKT
+from app import create_app, initialize_database
+from controllers import report_job_controller
+from controllers.report_job_controller import ReportJobController, MAX_ATTEMPTS, STALE_AFTER
+from controllers.reports_controller import ReportsController
+
+
+def login(app, username, password):
+    client = app.test_client()
+    client.post('/login', data={'username': username, 'password': password})
+    return client
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--burst', type=int, default=12)
+    parser.add_argument('--render-seconds', type=float, default=1.0)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp()
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(root, 'jobs.db')}",
+                      'REPORT_ARTIFACT_DIR': os.path.join(root, 'artifacts'),
+                      'REPORT_JOB_POLL_SECONDS': 1, 'WTF_CSRF_ENABLED': False})
+    initialize_database(app)
+    failures = []
+
+    renders = []
+    ext, mimetype, generate = report_job_controller.MONTHLY_FORMATS['pdf']
+
+    def slow_pdf(data):
+        renders.append(data['month'])
+        time.sleep(args.render_seconds)
+        return generate(data)
+
+    report_job_controller.MONTHLY_FORMATS['pdf'] = (ext, mimetype, slow_pdf)
+
+    now = datetime.now(PKT)
+    closed = (now.replace(day=1) - timedelta(days=1))
+    closed_url = f'/analytics/monthly-report/download?year={closed.year}&month={closed.month}&format=pdf'
+    current_url = f'/analytics/monthly-report/download?year={now.year}&month={now.month}&format=pdf'
+    with app.app_context():
+        success, message = ReportsController.close_month(closed.year, closed.month, user_id=1)
+        if not success:
+            failures.append(f"closing {closed:%B %Y} failed: {message}")
+
+    counter = login(app, 'staff', 'staff123')
+
+    def search_latency(samples=20):
+        timings = []
+        for _ in range(samples):
+            started = time.perf_counter()
+            counter.get('/products/api/search?q=a')
+            timings.append(time.perf_counter() - started)
+        return median(timings)
+
+    baseline = search_latency()
+
+    # Month-end burst: every admin asks for the same PDF at once, with a worker running
+    stop = threading.Event()
+    worker = threading.Thread(target=jobs.run_worker, args=(app, stop, 1))
+    worker.start()
+    clients = [login(app, 'admin', 'admin123') for _ in range(args.burst)]
+    results = [None] * args.burst
+    barrier = threading.Barrier(args.burst)
+
+    def download(i):
+        barrier.wait()
+        started = time.perf_counter()
+        response = clients[i].get(closed_url)
+        results[i] = (response.status_code, response.headers.get('Location', ''), time.perf_counter() - started)
+
+    threads = [threading.Thread(target=download, args=(i,)) for i in range(args.burst)]
+    for thread in threads:
+        thread.start()
+    during = search_latency()
+    for thread in threads:
+        thread.join()
+
+    locations = {location for _, location, _ in results}
+    slowest = max(seconds for _, _, seconds in results)
+    print(f"Burst of {args.burst}: {len(locations)} distinct job(s), slowest request {slowest * 1000:.0f}ms, "
+          f"counter search {baseline * 1000:.1f}ms idle / {during * 1000:.1f}ms during the burst")
+    if any(status != 302 for status, _, _ in results):
+        failures.append(f"burst statuses {sorted({status for status, _, _ in results})}")
+    if len(locations) != 1:
+        failures.append(f"burst queued {len(locations)} jobs: {sorted(locations)}")
+    if slowest >= args.render_seconds:
+        failures.append(f"a download request waited {slowest:.2f}s for the render")
+    if during > max(baseline * 5, baseline + 0.05):
+        failures.append(f"counter search slowed from {baseline * 1000:.1f}ms to {during * 1000:.1f}ms")
+
+    admin = clients[0]
+    job_id = int(next(iter(locations)).rstrip('/').split('/')[-1])
+    deadline = time.time() + args.render_seconds * 5 + 10
+    status = {}
+    while time.time() < deadline:
+        status = admin.get(f'/analytics/jobs/{job_id}/status').get_json()
+        if status['status'] in ('done', 'failed'):
+            break
+        time.sleep(0.1)
+    if status.get('status') != 'done':
+        failures.append(f"job {job_id} ended as {status}")
+    else:
+        response = admin.get(status['download_url'])
+        if response.status_code != 200 or not response.data.startswith(b'%PDF'):
+            failures.append(f"download returned {response.status_code} {response.data[:8]!r}")
+
+        # Closed month again: straight from the store
+        response = admin.get(closed_url)
+        if response.status_code != 302 or not response.headers['Location'].endswith(f'/jobs/{job_id}/download'):
+            failures.append(f"closed month re-download went to {response.headers.get('Location')}")
+        if len(renders) != 1:
+            failures.append(f"closed month rendered {len(renders)} times")
+
+        # Current month: can still change, so each request after the last one finished renders again
+        for attempt in range(2):
+            location = admin.get(current_url).headers['Location']
+            if location.endswith('/download'):
+                failures.append('current month served a cached artifact')
+            current_id = int(location.rstrip('/').split('/')[-1])
+            while admin.get(f'/analytics/jobs/{current_id}/status').get_json()['status'] not in ('done', 'failed'):
+                time.sleep(0.1)
+        print(f"Renders: {len(renders)} (1 closed month, 2 current month)")
+        if len(renders) != 3:
+            failures.append(f"expected 3 renders, got {len(renders)}")
+    stop.set()
+    jobs.wake()
+    worker.join()
+
+    # Claim race: many workers, no job claimed twice
+    with app.app_context():
+        queued = 200
+        for i in range(queued):
+            db.session.add(ReportJob(kind='monthly_report', params=json.dumps({'i': i}),
+                                     params_key=f'race-{i}', status='queued'))
+        db.session.commit()
+
+    claimed, lock = [], threading.Lock()
+
+    def claimer():
+        with app.app_context():
+            while (job := ReportJobController.claim()) is not None:
+                with lock:
+                    claimed.append(job.id)
+            db.session.remove()
+
+    claimers = [threading.Thread(target=claimer) for _ in range(8)]
+    for thread in claimers:
+        thread.start()
+    for thread in claimers:
+        thread.join()
+    print(f"Claim race: {len(claimed)} claims by 8 workers for {queued} jobs")
+    if len(claimed) != queued or len(set(claimed)) != queued:
+        failures.append(f"{len(claimed)} claims, {len(set(claimed))} distinct, for {queued} jobs")
+
+    # A job whose worker died is retried until it runs out of attempts
+    with app.app_context():
+        long_ago = datetime.now(PKT).replace(tzinfo=None) - STALE_AFTER - timedelta(minutes=1)
+        ReportJob.query.filter_by(status='running').update({'started_at': long_ago})
+        db.session.commit()
+        retried = ReportJobController.claim()
+        if retried is None or retried.attempts != 2:
+            failures.append(f"stale job not retried: {retried}")
+        ReportJob.query.filter_by(status='running').update({'started_at': long_ago, 'attempts': MAX_ATTEMPTS})
+        db.session.commit()
+        if ReportJobController.claim() is not None:
+            failures.append('claimed a job that had used up its attempts')
+        if ReportJob.query.filter_by(status='running').count():
+            failures.append('stale jobs with no attempts left were not failed')
+
+    for line in failures:
+        print('FAILED', line)
+    if failures:
+        sys.exit(1)
+    print('Report jobs are deduplicated, cached and claimed once.')
+
+
+if __name__ == '__main__':
+    main()
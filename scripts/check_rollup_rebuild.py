@@ -0,0 +1,127 @@
+"""Check that rebuild-rollups reproduces the rollups the write paths kept.
+
+Seeds a throwaway SQLite database with products, sells them through the
+admin order form, staff drafts approved later and customer returns, and
+receives stock at new purchase prices in between so every product's
+weighted-average cost keeps moving. Then rebuilds the rollups from the raw
+rows and checks every DailySummary and ProductDailySales figure, profit
+included, is what the incremental path had written. Exits non-zero on any
+difference.
+
+    python scripts/check_rollup_rebuild.py [--orders 300]
+"""
+import os
+import sys
+import random
+import argparse
+import tempfile
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.datastructures import MultiDict
+from extensions import db
+from models import Order, Product, DailySummary, ProductDailySales
+from app import create_app, initialize_database
+from controllers.sales_controller import SalesController
+from controllers.return_controller import ReturnController
+from controllers.inventory_controller import InventoryController
+from controllers.rollup_controller import RollupController
+
+PRODUCTS = 12
+
+
+def order_form(products, admin):
+    lines = random.sample(products, random.randint(1, 3))
+    form = MultiDict([('order_type', random.choice(('sale', 'credit_sale'))), ('amount_paid', '0')])
+    for product in lines:
+        form.add('product_id[]', str(product.id))
+        form.add('quantity[]', str(random.randint(1, 3)))
+        if admin:
+            form.add(f'price_{product.id}', str(product.selling_price))
+    return form
+
+
+def rollups():
+    summary = {r.date: {c.name: round(float(getattr(r, c.name) or 0), 2) for c in DailySummary.__table__.columns
+                        if c.name != 'date'} for r in DailySummary.query}
+    products = {(r.date, r.product_id): (r.quantity, round(float(r.revenue), 2), round(float(r.profit), 2))
+                for r in ProductDailySales.query}
+    return summary, products
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--orders', type=int, default=300)
+    args = parser.parse_args()
+
+    random.seed(3)
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'rollups.db')}"})
+    initialize_database(app)
+    failures = []
+
+    with app.app_context():
+        db.session.add_all([Product(name=f'Rebuild Product {i}', sku=f'RB{i}', stock_quantity=10 ** 6,
+                                    purchase_price=100 + i, cost_price=100 + i, selling_price=180 + i)
+                            for i in range(PRODUCTS)])
+        db.session.commit()
+        products = Product.query.all()
+
+        for n in range(args.orders):
+            step = random.random()
+            if step < 0.4:
+                success, message, *_ = SalesController.create_order(order_form(products, True), 1, is_admin=True)
+            elif step < 0.7:
+                SalesController.create_order(order_form(products, False), 2)
+                draft = Order.query.filter_by(status='draft').order_by(Order.id.desc()).first()
+                form = MultiDict({f'price_{item.id}': str(item.product.selling_price) for item in draft.items})
+                success, message = SalesController.approve_order(draft.id, form, 1)
+            elif step < 0.8:
+                sold = Order.query.filter(Order.status == 'approved', Order.order_type != 'return')\
+                    .order_by(db.func.random()).first()
+                if sold is None:
+                    continue
+                item = random.choice(sold.items)
+                success, message, _ = ReturnController.process_customer_return(MultiDict({
+                    'order_id': sold.id, 'product_id': item.product_id, 'quantity': 1,
+                    'reason': 'Customer changed mind'}), 1)
+            else:
+                # Stock received at a new price re-averages the cost of everything on hand
+                product = random.choice(products)
+                quantity = random.randint(10 ** 5, 10 ** 6)
+                InventoryController.put({product.id: quantity},
+                                        {product.id: Decimal(random.randint(50, 250)) * quantity})
+                db.session.commit()
+                continue
+            if not success:
+                failures.append(f"step {n}: {message}")
+            db.session.commit()
+
+        moved = sum(1 for p in Product.query if float(p.cost_price) != float(p.purchase_price))
+        before = rollups()
+        RollupController.rebuild()
+        after = rollups()
+
+    print(f"{args.orders} writes, {len(before[1])} product-day rows, {moved} of {PRODUCTS} costs moved")
+    for label, expected, rebuilt in (('daily summary', before[0], after[0]), ('product sales', before[1], after[1])):
+        for key in sorted(set(expected) | set(rebuilt), key=str):
+            old, new = expected.get(key), rebuilt.get(key)
+            if isinstance(old, dict) and isinstance(new, dict):
+                old = {k: v for k, v in old.items() if abs(v - new.get(k, 0)) > 0.01}
+                new = {k: new[k] for k in old}
+                if not old:
+                    continue
+            elif old is not None and new is not None and old[0] == new[0] and \
+                    all(abs(a - b) <= 0.01 for a, b in zip(old[1:], new[1:])):
+                continue
+            failures.append(f"{label} {key}: {old} rebuilt as {new}")
+
+    for line in failures[:20]:
+        print('MISMATCH', line)
+    if failures:
+        sys.exit(1)
+    print('A rebuild reproduces the incremental rollups, profit included.')
+
+
+if __name__ == '__main__':
+    main()
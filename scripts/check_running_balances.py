@@ -0,0 +1,253 @@
+"""Check checkpointed running balances against a full recomputation.
+
+Seeds a throwaway SQLite database with three years of cash, customer and
+supplier ledger rows, then compares every page of the cash book (all rows,
+one type, a date range) and of each customer's and distributor's ledger with
+running balances summed in Python over the whole history. It does so with no
+checkpoints (checking the reads write nothing), after refresh_checkpoints, and
+after backdated inserts, edits and deletes that must rebuild checkpoints, and
+checks a ledger write adds missing checkpoints. Exits non-zero on any mismatch.
+
+    python scripts/check_running_balances.py
+"""
+import os
+import sys
+import random
+import tempfile
+from decimal import Decimal
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import event
+from extensions import db
+from models import (CashTransaction, CustomerTransaction, SupplierTransaction, BalanceCheckpoint,
+                    Customer, Distributor, User, PKT)
+from controllers.analytics_controller import AnalyticsController
+from controllers.running_balance_controller import RunningBalanceController, LEDGERS
+
+ACCOUNTS = 6
+
+
+def seed(rows_per_ledger):
+    random.seed(14)
+    db.session.add(User(username='balances', password_hash='-', role='admin'))
+    db.session.add_all([Customer(name=f'Customer {i}') for i in range(ACCOUNTS)])
+    db.session.add_all([Distributor(name=f'Distributor {i}') for i in range(ACCOUNTS)])
+    db.session.commit()
+
+    now = datetime.now(PKT).replace(tzinfo=None)
+    first = now - timedelta(days=3 * 365)
+
+    def when():
+        # Some rows share a timestamp so the id tie-break matters
+        return first + timedelta(minutes=random.randrange(0, 3 * 365 * 24 * 60, 7))
+
+    def amount():
+        return Decimal(random.randint(100, 500000)) / 100
+
+    for _ in range(rows_per_ledger):
+        db.session.add(CashTransaction(transaction_type=random.choice(('in', 'in', 'out')), amount=amount(),
+                                       source='manual', created_by=1, created_at=when()))
+        db.session.add(CustomerTransaction(customer_id=random.randint(1, ACCOUNTS), amount=amount(),
+                                           transaction_type=random.choice(('receivable', 'payment')),
+                                           created_by=1, created_at=when()))
+        db.session.add(SupplierTransaction(distributor_id=random.randint(1, ACCOUNTS), amount=amount(),
+                                           transaction_type=random.choice(('payable', 'payment')),
+                                           created_by=1, created_at=when()))
+    db.session.commit()
+    return first, now
+
+
+def expected_balances(ledger, account_id=None, transaction_type=None):
+    """{id: running balance} over the full history, summed in Python."""
+    model, account_column, increasing, decreasing = LEDGERS[ledger]
+    query = model.query
+    if account_id is not None:
+        query = query.filter(account_column == account_id)
+    if transaction_type:
+        query = query.filter(model.transaction_type == transaction_type)
+    balance, result = Decimal('0'), {}
+    for row in query.order_by(model.created_at, model.id):
+        if row.transaction_type == increasing:
+            balance += Decimal(str(row.amount))
+        elif row.transaction_type == decreasing:
+            balance -= Decimal(str(row.amount))
+        result[row.id] = float(balance)
+    return result
+
+
+def expected_combined(transaction_type):
+    """{(ledger, id): net position} over both ledgers in (created_at, ledger, id) order."""
+    rows = []
+    if transaction_type != 'supplier':
+        rows += [(r.created_at, 'customer', r.id, r.amount if r.transaction_type == 'receivable' else -r.amount)
+                 for r in CustomerTransaction.query]
+    if transaction_type != 'customer':
+        rows += [(r.created_at, 'supplier', r.id, -r.amount if r.transaction_type == 'payable' else r.amount)
+                 for r in SupplierTransaction.query]
+    balance, result = Decimal('0'), {}
+    for _, ledger, row_id, signed in sorted(rows):
+        balance += Decimal(str(signed))
+        result[(ledger, row_id)] = float(balance)
+    return result
+
+
+def main():
+    path = os.path.join(tempfile.mkdtemp(), 'balances.db')
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+    db.init_app(app)
+    mismatches = []
+
+    def compare(label, expected, rows):
+        for row in rows:
+            row_id, actual = (row['id'], row['running_balance']) if isinstance(row, dict) else \
+                (row.id, row.running_balance)
+            if abs(expected[row_id] - actual) > 0.005:
+                mismatches.append(f"{label}: row {row_id} expected {expected[row_id]:.2f} got {actual:.2f}")
+                return
+
+    def walk(fetch):
+        rows, cursor = fetch(None)
+        yield from rows
+        while cursor:
+            rows, cursor = fetch(cursor)
+            yield from rows
+
+    def check_all(stage, first, now):
+        expected = expected_balances('cash')
+        compare(f"{stage} cash book", expected,
+                walk(lambda c: AnalyticsController.get_ledger_data('all', None, None, c)))
+        day = (first + timedelta(days=400)).strftime('%Y-%m-%d')
+        compare(f"{stage} cash book {day}", expected,
+                walk(lambda c: AnalyticsController.get_ledger_data('all', day, day, c)))
+        range_start = (first + timedelta(days=500)).strftime('%Y-%m-%d')
+        range_end = (first + timedelta(days=620)).strftime('%Y-%m-%d')
+        compare(f"{stage} cash book {range_start}..{range_end}", expected,
+                walk(lambda c: AnalyticsController.get_ledger_data('all', range_start, range_end, c)))
+        for transaction_type in ('in', 'out'):
+            compare(f"{stage} cash book '{transaction_type}'", expected_balances('cash', None, transaction_type),
+                    walk(lambda c: AnalyticsController.get_ledger_data(transaction_type, None, None, c)))
+        for ledger in ('customer', 'supplier'):
+            for account_id in range(1, ACCOUNTS + 1):
+                compare(f"{stage} {ledger} #{account_id}", expected_balances(ledger, account_id),
+                        walk(lambda c: RunningBalanceController.account_page(ledger, account_id, c)))
+
+        # Combined ledger: keyset pages and the streaming iterator, with and without a start date
+        start = (first + timedelta(days=700)).strftime('%Y-%m-%d')
+        for transaction_type in ('all', 'customer', 'supplier'):
+            expected = expected_combined(transaction_type)
+            for range_start in (None, start):
+                label = f"{stage} ledger '{transaction_type}' from {range_start or 'the start'}"
+                paged = list(walk(lambda c: (lambda d: (d['transactions'], d['next_cursor']))(
+                    AnalyticsController.get_ledger_entries(transaction_type, range_start, None, c))))
+                streamed = list(AnalyticsController.iter_ledger_entries(transaction_type, range_start, None))
+                keys = [(r['ledger'], r['id']) for r in paged]
+                if keys[::-1] != [(r['ledger'], r['id']) for r in streamed] or len(set(keys)) != len(keys):
+                    mismatches.append(f"{label}: pages and stream disagree")
+                if range_start is None and len(keys) != len(expected):
+                    mismatches.append(f"{label}: {len(keys)} rows, expected {len(expected)}")
+                for row in paged + streamed:
+                    if abs(expected[(row['ledger'], row['id'])] - row['running_balance']) > 0.005:
+                        mismatches.append(f"{label}: {row['ledger']} row {row['id']} balance")
+                        break
+
+        totals = AnalyticsController.get_ledger_entries('all', None, None)
+        for key, ledger in (('total_receivables', 'customer'), ('total_payables', 'supplier')):
+            expected = max(sum(v.amount if v.transaction_type in ('receivable', 'payable') else -v.amount
+                               for v in LEDGERS[ledger][0].query), 0)
+            if abs(float(expected) - totals[key]) > 0.005:
+                mismatches.append(f"{stage} {key}: expected {expected} got {totals[key]}")
+
+    def checkpoint_rows():
+        return {(cp.ledger, cp.account_id, cp.period_start): (cp.increases, cp.decreases)
+                for cp in BalanceCheckpoint.query}
+
+    with app.app_context():
+        db.create_all()
+        first, now = seed(3000)
+        # The seed's commit wrote the checkpoints; start the read checks without any
+        seeded = checkpoint_rows()
+        for ledger in LEDGERS:
+            RunningBalanceController.invalidate(ledger, datetime.min)
+        db.session.commit()
+
+        # Without checkpoints every opening balance is summed from the first row
+        for ledger in LEDGERS:
+            model = LEDGERS[ledger][0]
+            page = model.query.order_by(model.created_at.desc(), model.id.desc()).offset(1000).limit(50).all()
+            balances = RunningBalanceController.running_balances(ledger, page)
+            compare(f"no checkpoints {ledger}", expected_balances(ledger),
+                    [{'id': row_id, 'running_balance': value} for row_id, value in balances.items()])
+
+        # Ledger reads never write: every page still works from the first row
+        writes = []
+        listener = lambda conn, cursor, statement, *args: writes.append(statement) \
+            if not statement.lstrip().upper().startswith('SELECT') else None
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        check_all('no checkpoints', first, now)
+        event.remove(db.engine, 'before_cursor_execute', listener)
+        if writes or BalanceCheckpoint.query.count():
+            mismatches.append(f"ledger reads ran {len(writes)} writes, e.g. {writes[:1]}")
+
+        # The command writes the same set the seed's write did
+        written = RunningBalanceController.refresh_checkpoints()
+        print(f"Wrote {written} checkpoints.")
+        if not written or checkpoint_rows() != seeded:
+            mismatches.append(f"refresh wrote {written} checkpoints, the seed's write {len(seeded)}")
+        if RunningBalanceController.refresh_checkpoints() != 0:
+            mismatches.append('second refresh rewrote checkpoints')
+        check_all('checkpoints', first, now)
+
+        # With none left, the next ledger write adds them in its own transaction
+        for ledger in LEDGERS:
+            RunningBalanceController.invalidate(ledger, datetime.min)
+        db.session.commit()
+        db.session.add(CashTransaction(transaction_type='in', amount=Decimal('1.00'), source='manual',
+                                       created_by=1, created_at=now))
+        db.session.commit()
+        cash = {key: value for key, value in checkpoint_rows().items() if key[0] == 'cash'}
+        if not cash or cash != {key: value for key, value in seeded.items() if key[0] == 'cash'}:
+            mismatches.append(f"a cash write added {len(cash)} cash checkpoints")
+        RunningBalanceController.refresh_checkpoints()
+
+        # A one-day cash book reads the checkpoint plus at most a month of rows
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        day = (first + timedelta(days=900)).strftime('%Y-%m-%d')
+        AnalyticsController.get_ledger_data('all', day, day)
+        event.remove(db.engine, 'before_cursor_execute', listener)
+        print(f"One-day cash book page: {len(statements)} queries.")
+
+        # Backdated writes rebuild the checkpoints after them with the change included
+        old = CashTransaction.query.order_by(CashTransaction.created_at).offset(100).first()
+        old.amount = Decimal(str(old.amount)) + 1000
+        db.session.add(CashTransaction(transaction_type='out', amount=Decimal('777.77'), source='manual',
+                                       created_by=1, created_at=first + timedelta(days=200)))
+        db.session.add(CustomerTransaction(customer_id=2, transaction_type='receivable', amount=Decimal('55.10'),
+                                           created_by=1, created_at=first + timedelta(days=300)))
+        moved = SupplierTransaction.query.filter_by(distributor_id=3).order_by(SupplierTransaction.created_at).first()
+        moved.distributor_id = 4
+        db.session.delete(CustomerTransaction.query.filter_by(customer_id=5)
+                          .order_by(CustomerTransaction.created_at).offset(3).first())
+        db.session.commit()
+        rebuilt = checkpoint_rows()
+        for ledger in LEDGERS:
+            RunningBalanceController.invalidate(ledger, datetime.min)
+        RunningBalanceController.refresh_checkpoints()
+        if checkpoint_rows() != rebuilt:
+            mismatches.append("checkpoints after backdated writes differ from a full rebuild")
+        check_all('after backdated edits', first, now)
+
+    for line in mismatches:
+        print('MISMATCH', line)
+    if mismatches:
+        sys.exit(1)
+    print('Running balances match a full recomputation on every page checked.')
+
+
+if __name__ == '__main__':
+    main()
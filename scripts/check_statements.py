@@ -0,0 +1,176 @@
+"""Check customer statements against a full recomputation of the ledger.
+
+Seeds a throwaway SQLite database with two years of invoices, returns and
+payments for a handful of customers, then for whole months, custom ranges
+and open-ended ranges compares each statement's opening balance, period
+totals, lines, running balances and closing balance with sums over the whole
+ledger in Python. Downloads the CSV and PDF through the app, and renders a
+month-end batch for every debtor in a process pool, comparing each file with
+the single statement. Exits non-zero on any mismatch.
+
+    python scripts/check_statements.py [--rows 6000] [--workers 2]
+"""
+import os
+import csv
+import sys
+import random
+import argparse
+import tempfile
+from decimal import Decimal
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import insert
+from extensions import db
+from models import Customer, CustomerTransaction, PKT
+from app import create_app, initialize_database
+from utils import period_bounds
+from controllers.running_balance_controller import RunningBalanceController
+from controllers.statement_controller import StatementController
+
+CUSTOMERS = 6
+
+
+def seed(rows):
+    random.seed(22)
+    db.session.add_all([Customer(name=f'Statement Customer {i}') for i in range(CUSTOMERS)])
+    db.session.commit()
+    now = datetime.now(PKT).replace(tzinfo=None)
+
+    def line():
+        kind = random.choice(('receivable', 'receivable', 'payment', 'return'))
+        amount = Decimal(random.randint(100, 900000)) / 100
+        return ('receivable', -amount) if kind == 'return' else (kind, amount)
+
+    entries = []
+    for _ in range(rows):
+        kind, amount = line()
+        # Customer 6 never buys anything, so it is no debtor
+        entries.append({'customer_id': random.randint(1, CUSTOMERS - 1), 'transaction_type': kind, 'amount': amount,
+                        'reference': f'{kind} line', 'created_by': 1,
+                        'created_at': now - timedelta(minutes=random.randrange(0, 2 * 365 * 24 * 60, 5))})
+    db.session.execute(insert(CustomerTransaction), entries)
+    db.session.execute(db.text(
+        "UPDATE customer SET balance = (SELECT COALESCE(SUM(CASE WHEN transaction_type = 'receivable' "
+        "THEN amount ELSE -amount END), 0) FROM customer_transaction WHERE customer_id = customer.id)"))
+    db.session.commit()
+    RunningBalanceController.refresh_checkpoints()
+    return now
+
+
+def expected_statement(customer_id, start, end):
+    """(opening, [(created_at, signed amount, balance)], closing) from every ledger row."""
+    opening, lines = Decimal('0'), []
+    rows = CustomerTransaction.query.filter_by(customer_id=customer_id)\
+        .order_by(CustomerTransaction.created_at, CustomerTransaction.id)
+    for row in rows:
+        signed = Decimal(str(row.amount)) * (1 if row.transaction_type == 'receivable' else -1)
+        if start is not None and row.created_at < start:
+            opening += signed
+        elif end is None or row.created_at < end:
+            balance = (lines[-1][2] if lines else opening) + signed
+            lines.append((row.created_at, signed, balance))
+    return opening, lines, lines[-1][2] if lines else opening
+
+
+def compare(label, statement, expected, failures):
+    opening, lines, closing = expected
+    got = list(statement['lines'])
+    if statement['opening'] != opening or statement['closing'] != closing:
+        failures.append(f"{label}: opening/closing {statement['opening']}/{statement['closing']}, "
+                        f"expected {opening}/{closing}")
+    if len(got) != len(lines):
+        failures.append(f"{label}: {len(got)} lines, expected {len(lines)}")
+        return
+    for line, (created_at, signed, balance) in zip(got, lines):
+        amount = line['debit'] if line['debit'] is not None else -line['credit']
+        if line['created_at'] != created_at or amount != signed or line['balance'] != balance:
+            failures.append(f"{label}: line {line}, expected {created_at} {signed} {balance}")
+            return
+    movement = statement['receivables'] - statement['returns'] - statement['payments']
+    if movement != sum((signed for _, signed, _ in lines), Decimal('0')):
+        failures.append(f"{label}: period totals do not add up to the lines")
+
+
+def csv_rows(text):
+    return list(csv.reader(text.lstrip('﻿').splitlines()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=6000)
+    parser.add_argument('--workers', type=int, default=2)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp()
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(root, 'statements.db')}",
+                      'WTF_CSRF_ENABLED': False})
+    initialize_database(app)
+    failures = []
+
+    with app.app_context():
+        now = seed(args.rows)
+        last_month = now.replace(day=1) - timedelta(days=1)
+        ranges = {
+            'last month': period_bounds(last_month.year, last_month.month),
+            'this month': period_bounds(now.year, now.month),
+            'custom range': period_bounds(start_date=(now - timedelta(days=400)).strftime('%Y-%m-%d'),
+                                          end_date=(now - timedelta(days=230)).strftime('%Y-%m-%d')),
+            'from a date': period_bounds(start_date=(now - timedelta(days=45)).strftime('%Y-%m-%d')),
+            'everything': (None, None),
+        }
+        for customer_id in range(1, CUSTOMERS + 1):
+            for label, (start, end) in ranges.items():
+                compare(f"customer {customer_id} {label}", StatementController.get_statement(customer_id, start, end),
+                        expected_statement(customer_id, start, end), failures)
+        checked = CUSTOMERS * len(ranges)
+
+        # Downloads through the app
+        client = app.test_client()
+        client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+        start, end = ranges['custom range']
+        query = {'start_date': start.strftime('%Y-%m-%d'), 'end_date': (end - timedelta(days=1)).strftime('%Y-%m-%d')}
+        response = client.get('/customers/1/statement', query_string=dict(query, format='csv'))
+        rows = csv_rows(response.get_data(as_text=True))
+        opening, lines, closing = expected_statement(1, start, end)
+        if response.status_code != 200 or len(rows) != len(lines) + 3 or \
+                Decimal(rows[1][-1]) != opening or Decimal(rows[-1][-1]) != closing:
+            failures.append(f"CSV download: {response.status_code}, {len(rows)} rows, expected {len(lines) + 3}")
+        response = client.get('/customers/1/statement', query_string=dict(query, format='pdf'))
+        pdf = response.get_data()
+        pages = pdf.count(b'/Type /Page\n')
+        if response.status_code != 200 or not pdf.startswith(b'%PDF') or pages < 2:
+            failures.append(f"PDF download: {response.status_code}, {pages} page(s)")
+        if client.get('/customers/999/statement?format=csv').status_code != 404:
+            failures.append('statement for a missing customer did not return 404')
+
+        # Month-end batch in worker processes
+        output = os.path.join(root, 'batch')
+        for fmt in ('csv', 'pdf'):
+            written = StatementController.render_batch(last_month.year, last_month.month, output, fmt, args.workers)
+            debtors = StatementController.debtor_ids()
+            if [customer_id for customer_id, _ in written] != debtors:
+                failures.append(f"{fmt} batch wrote {[c for c, _ in written]}, expected debtors {debtors}")
+            start, end = ranges['last month']
+            for customer_id, path in written:
+                with open(path, 'rb') as f:
+                    content = f.read()
+                if fmt == 'csv':
+                    single = ''.join(StatementController.iter_csv(
+                        StatementController.get_statement(customer_id, start, end)))
+                    if content.decode('utf-8') != single:
+                        failures.append(f"batch CSV for customer {customer_id} differs from the single statement")
+                elif not content.startswith(b'%PDF'):
+                    failures.append(f"batch PDF for customer {customer_id} is not a PDF")
+            print(f"{fmt.upper()} batch: {len(written)} statement(s) with {args.workers} worker(s)")
+
+    for line in failures[:20]:
+        print('MISMATCH', line)
+    if failures:
+        sys.exit(1)
+    print(f"{checked} statements match the ledger; downloads and the batch agree.")
+
+
+if __name__ == '__main__':
+    main()
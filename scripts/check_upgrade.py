@@ -0,0 +1,183 @@
+"""Check that upgrading a database written by the baseline app keeps its dashboard figures.
+
+Exports the baseline commit (the repository's first commit unless --baseline
+names another) to a temporary directory, and with that code creates a
+database and fills it with a year and a half of orders, returns, purchases,
+expenses, staff payments and customer payments. The baseline dashboard is
+recorded for every month and year with activity. The current app then
+upgrades the same database (create_all, every migration and backfill) and
+must show the same cards and charts, and top products that match the
+baseline's order lines with returns netted out (the baseline ranked return
+lines as sales). Exits non-zero on any difference.
+
+    python scripts/check_upgrade.py [--baseline <commit>] [--orders 1500]
+"""
+import os
+import sys
+import json
+import tarfile
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Runs inside the exported baseline tree, with its own models and controllers
+BASELINE_SEED = '''
+import sys, json, random
+from datetime import datetime, timedelta
+from decimal import Decimal
+from app import app, initialize_database
+from extensions import db
+from models import (Product, Customer, Distributor, Order, OrderItem, PurchaseOrder, Expense, Employee,
+                    EmployeePayment, CustomerTransaction)
+from controllers.analytics_controller import AnalyticsController
+from sqlalchemy import case, extract, func
+
+orders, output = int(sys.argv[1]), sys.argv[2]
+random.seed(4)
+initialize_database()
+with app.app_context():
+    db.session.add_all([Distributor(name=f'Upgrade Distributor {i}') for i in range(5)])
+    db.session.add_all([Customer(name=f'Upgrade Customer {i}') for i in range(20)])
+    db.session.add_all([Product(name=f'Upgrade Product {i}', sku=f'UP{i}', stock_quantity=1000,
+                                cost_price=100 + i, selling_price=150 + 2 * i, distributor_id=1 + i % 5)
+                        for i in range(30)])
+    db.session.add(Employee(nickname='upgrade', full_name='Upgrade Check'))
+    db.session.commit()
+    products = Product.query.all()
+    now = datetime.now().replace(microsecond=0)
+
+    def when():
+        return now - timedelta(minutes=random.randint(0, 540 * 24 * 60))
+
+    for _ in range(orders):
+        created_at = when()
+        lines = [(product, random.randint(1, 4)) for product in random.sample(products, random.randint(1, 3))]
+        order_type = random.choice(('sale', 'sale', 'credit_sale', 'return'))
+        sign = -1 if order_type == 'return' else 1
+        total = sum(Decimal(str(p.selling_price)) * q for p, q in lines)
+        profit = sum((Decimal(str(p.selling_price)) - Decimal(str(p.cost_price))) * q for p, q in lines)
+        order = Order(created_by=1, approved_by=1, customer_id=random.randint(1, 20),
+                      status=random.choice(('approved',) * 9 + ('draft',)), order_type=order_type,
+                      total_amount=sign * total, total_profit=sign * profit,
+                      amount_paid=sign * total if order_type != 'credit_sale' else 0, created_at=created_at)
+        db.session.add(order)
+        db.session.flush()
+        db.session.add_all([OrderItem(order_id=order.id, product_id=p.id, quantity=q, price=p.selling_price)
+                            for p, q in lines])
+        if order_type == 'credit_sale' and random.random() < 0.6:
+            db.session.add(CustomerTransaction(customer_id=order.customer_id, order_id=order.id,
+                                               transaction_type='payment', amount=total / 2, created_by=1,
+                                               created_at=min(created_at + timedelta(days=random.randint(0, 20)), now)))
+    for _ in range(orders // 5):
+        db.session.add(PurchaseOrder(distributor_id=random.randint(1, 5), created_by=1,
+                                     status=random.choice(('received', 'received', 'pending')),
+                                     total_amount=Decimal(random.randint(1000, 90000)), created_at=when()))
+        db.session.add(Expense(category=random.choice(('bills', 'rent', 'other')),
+                               amount=Decimal(random.randint(100, 9000)), expense_date=when()))
+        db.session.add(EmployeePayment(employee_id=1, payment_type='salary',
+                                       amount=Decimal(random.randint(1000, 20000)), date=when()))
+    db.session.commit()
+
+    periods = sorted({(d.year, d.month) for (d,) in db.session.query(Order.created_at)})
+    periods += sorted({(year, None) for year, _ in periods})
+
+    def plain(value):
+        if isinstance(value, list):
+            return [plain(v) for v in value]
+        if hasattr(value, '_asdict'):
+            return {k: plain(v) for k, v in value._asdict().items()}
+        return float(value) if isinstance(value, Decimal) else value
+
+    def net_products(year, month):
+        # The baseline ranked return lines as sales; the rollups net them out, so compare with the rows
+        sign = case((Order.order_type == 'return', -1), else_=1)
+        query = db.session.query(Product.name, func.sum(sign * OrderItem.quantity),
+                                 func.sum(sign * OrderItem.quantity * OrderItem.price),
+                                 func.sum(sign * (OrderItem.price - Product.cost_price) * OrderItem.quantity))\
+            .join(OrderItem).join(Order).filter(Order.status == 'approved')
+        if month:  # Without a month the dashboard ranks all time
+            query = query.filter(extract('year', Order.created_at) == year, extract('month', Order.created_at) == month)
+        return {name: [int(q), float(r), float(p)] for name, q, r, p in query.group_by(Product.id)}
+
+    json.dump([[year, month, {key: plain(value) for key, value in
+                              AnalyticsController.get_dashboard_metrics(year, month).items()},
+                net_products(year, month)]
+               for year, month in periods], open(output, 'w'))
+'''
+
+# Figures the baseline dashboard computed from the rows the rollups now summarise
+CARDS = ('total_revenue', 'gross_profit', 'net_profit', 'total_expenses', 'total_staff_expenses', 'total_orders',
+         'cash_revenue', 'cash_count', 'cash_profit', 'credit_revenue', 'credit_count', 'credit_profit',
+         'total_returns_amount', 'total_returns_count', 'total_purchases', 'total_receipts')
+CHARTS = ('monthly_cash', 'monthly_credit', 'monthly_profit', 'monthly_expenses')
+
+
+def export_baseline(revision, target):
+    archive = os.path.join(target, 'baseline.tar')
+    subprocess.run(['git', 'archive', '--format=tar', '-o', archive, revision], cwd=ROOT, check=True)
+    with tarfile.open(archive) as tar:
+        tar.extractall(os.path.join(target, 'baseline'))
+    return os.path.join(target, 'baseline')
+
+
+def close(a, b):
+    return abs(float(a or 0) - float(b or 0)) <= 0.01
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--baseline', help='Commit to upgrade from. Defaults to the first commit.')
+    parser.add_argument('--orders', type=int, default=1500)
+    args = parser.parse_args()
+
+    revision = args.baseline or subprocess.run(['git', 'rev-list', '--max-parents=0', 'HEAD'], cwd=ROOT, check=True,
+                                               capture_output=True, text=True).stdout.split()[0]
+    workdir = tempfile.mkdtemp()
+    baseline = export_baseline(revision, workdir)
+    expected_path = os.path.join(workdir, 'baseline.json')
+    subprocess.run([sys.executable, '-c', BASELINE_SEED, str(args.orders), expected_path], cwd=baseline,
+                   check=True, env={**os.environ, 'PYTHONPATH': baseline})
+    with open(expected_path) as f:
+        expected = json.load(f)
+    database = os.path.join(baseline, 'instance', 'pos.db')
+
+    from app import create_app, initialize_database
+    from controllers.analytics_controller import AnalyticsController
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{database}'})
+    initialize_database(app)
+    failures = []
+    with app.app_context():
+        for year, month, before, products in expected:
+            label = f"{year}-{month:02d}" if month else f"{year}"
+            after = AnalyticsController.get_dashboard_metrics(year, month)
+            for key in CARDS:
+                if not close(before[key], after[key]):
+                    failures.append(f"{label} {key}: baseline {before[key]}, upgraded {after[key]}")
+            for key in CHARTS:
+                if not all(close(a, b) for a, b in zip(before[key], after[key])):
+                    failures.append(f"{label} {key}: baseline {before[key]}, upgraded {after[key]}")
+            top = sorted((q for q, _, _ in products.values()), reverse=True)[:len(after['top_products'])]
+            if [p['total_sold'] for p in after['top_products']] != top:
+                failures.append(f"{label} top products sold {[p['total_sold'] for p in after['top_products']]}, "
+                                f"baseline rows {top}")
+            for p in after['top_products']:
+                if [p['total_sold'], p['revenue'], p['profit']] != products.get(p['name']) and \
+                        not all(close(a, b) for a, b in zip([p['total_sold'], p['revenue'], p['profit']],
+                                                            products.get(p['name'], [None] * 3))):
+                    failures.append(f"{label} {p['name']}: upgraded {p}, baseline rows {products.get(p['name'])}")
+
+    print(f"Upgraded a database from {revision[:7]} with {args.orders} orders; "
+          f"compared {len(expected)} dashboards")
+    for line in failures[:20]:
+        print('MISMATCH', line)
+    if failures:
+        sys.exit(1)
+    print('The upgraded dashboards match the baseline for every month and year.')
+
+
+if __name__ == '__main__':
+    main()
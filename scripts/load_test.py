@@ -0,0 +1,164 @@
+"""Rush-hour load test: concurrent order creation plus dashboard reads.
+
+Starts the app from the production factory on a throwaway SQLite database
+behind waitress, then runs, for a fixed duration:
+
+  * --counters staff sessions posting draft orders,
+  * --admins admin sessions confirming orders directly (these decrement stock),
+  * --pollers admin sessions reloading the dashboard and pending orders.
+
+Prints throughput, latency percentiles and every failed request, and exits
+non-zero if any request failed. `--legacy` reproduces the old setup (no
+pragmas, rollback journal, default pool) for comparison.
+
+    python scripts/load_test.py --seconds 20 --counters 6 --admins 2 --pollers 2
+"""
+import os
+import sys
+import time
+import random
+import logging
+import argparse
+import tempfile
+import threading
+import http.cookiejar
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import got_request_exception
+from waitress.server import create_server
+from extensions import db
+from models import Product, Distributor, Customer
+from app import create_app, initialize_database
+
+PRODUCTS = 200
+
+
+def seed():
+    db.session.add(Distributor(name='Load Distributor'))
+    db.session.add_all([Customer(name=f'Walk-in {i}', phone=f'0300{i:07d}') for i in range(100)])
+    db.session.add_all([Product(name=f'Item {i}', sku=f'LOAD{i}', distributor_id=1, cost_price=80,
+                                selling_price=100, stock_quantity=1_000_000, min_stock_level=5)
+                        for i in range(PRODUCTS)])
+    db.session.commit()
+
+
+class Client:
+    """A logged-in browser session."""
+
+    def __init__(self, base, username, password):
+        self.base = base
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        self.request('POST', '/login', {'username': username, 'password': password})
+
+    def request(self, method, path, form=None):
+        body = urllib.parse.urlencode(form, doseq=True).encode() if form is not None else None
+        req = urllib.request.Request(self.base + path, data=body, method=method)
+        try:
+            with self.opener.open(req, timeout=60) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as exc:
+            return exc.code
+
+
+def order_form(with_prices):
+    lines = random.sample(range(1, PRODUCTS + 1), random.randint(1, 8))
+    form = {
+        'product_id[]': [str(pid) for pid in lines],
+        'quantity[]': [str(random.randint(1, 3)) for _ in lines],
+        'order_type': 'sale',
+        'customer_id': str(random.randint(1, 100)),
+    }
+    if with_prices:
+        form.update({f'price_{pid}': '100' for pid in lines})
+    return form
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--counters', type=int, default=6)
+    parser.add_argument('--admins', type=int, default=2)
+    parser.add_argument('--pollers', type=int, default=2)
+    parser.add_argument('--server-threads', type=int, default=8)
+    parser.add_argument('--legacy', action='store_true', help='No SQLite pragmas and default pool, as before.')
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'load.db')
+    overrides = {'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}', 'WTF_CSRF_ENABLED': False}
+    if args.legacy:
+        overrides.update({'SQLITE_PRAGMAS': {}, 'SQLALCHEMY_ENGINE_OPTIONS': {}})
+    app = create_app(overrides)
+    initialize_database(app)
+    with app.app_context():
+        seed()
+
+    errors = defaultdict(int)
+
+    def record_exception(sender, exception, **extra):
+        errors[f'{type(exception).__name__}: {str(exception).splitlines()[0][:100]}'] += 1
+
+    got_request_exception.connect(record_exception, app)
+
+    logging.getLogger('waitress.queue').setLevel(logging.ERROR)
+    server = create_server(app, host='127.0.0.1', port=0, threads=args.server_threads)
+    base = f'http://127.0.0.1:{server.effective_port}'
+    threading.Thread(target=server.run, daemon=True).start()
+
+    lock = threading.Lock()
+    latencies = defaultdict(list)
+    failures = defaultdict(int)
+    deadline = time.monotonic() + args.seconds
+
+    def run(label, username, password, step):
+        client = Client(base, username, password)
+        while time.monotonic() < deadline:
+            method, route, form = step()
+            started = time.perf_counter()
+            status = client.request(method, route, form)
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies[label].append(elapsed)
+                if status >= 400:
+                    failures[f'{label} {status}'] += 1
+
+    workers = []
+    for _ in range(args.counters):
+        workers.append(('counter', 'staff', 'staff123', lambda: ('POST', '/sales/create', order_form(False))))
+    for _ in range(args.admins):
+        workers.append(('admin sale', 'admin', 'admin123', lambda: ('POST', '/sales/create', order_form(True))))
+    for _ in range(args.pollers):
+        workers.append(('dashboard', 'admin', 'admin123', lambda: random.choice((
+            ('GET', '/', None),
+            ('GET', '/pending-pos', None),
+        ))))
+    threads = [threading.Thread(target=run, args=worker) for worker in workers]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    server.close()
+
+    mode = 'legacy' if args.legacy else 'tuned'
+    print(f"{mode}: {args.counters} counters, {args.admins} admins, {args.pollers} pollers, {args.seconds:.0f}s")
+    for label, values in sorted(latencies.items()):
+        values.sort()
+        pct = lambda p: values[min(len(values) - 1, int(len(values) * p))] * 1000
+        print(f"  {label:<11} {len(values):>6} req  {len(values) / args.seconds:>7.1f}/s  "
+              f"p50 {pct(0.5):>7.1f}ms  p95 {pct(0.95):>7.1f}ms  max {values[-1] * 1000:>7.1f}ms")
+    for label, count in sorted(failures.items()):
+        print(f"  FAILED {label}: {count}")
+    for message, count in sorted(errors.items()):
+        print(f"  ERROR x{count} {message}")
+    if failures or errors:
+        sys.exit(1)
+    print('No failed requests.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""Concurrency stress test for stock changes.
+
+Creates a throwaway SQLite database with a few scarce products and many
+draft orders, then approves the drafts from several threads while other
+threads receive purchase orders for the same products. Every draft is
+submitted for approval twice, as a double-clicked button or two admins would,
+so both approvals race for it. Afterwards it checks that each draft was
+approved at most once, that no product went negative, that every approved
+sale and every received unit is reflected in the final stock, and that the
+StockMovement log adds up. Exits non-zero on any violation.
+
+    python scripts/stress_stock.py --threads 8 --orders 400
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from flask_login import login_user
+from sqlalchemy import func
+from sqlalchemy.exc import OperationalError
+from werkzeug.datastructures import MultiDict
+from extensions import db, login_manager
+from models import (Order, OrderItem, Product, PurchaseOrder, PurchaseOrderItem, StockMovement,
+                    Distributor, User)
+from controllers.sales_controller import SalesController
+from controllers.purchases_controller import PurchasesController
+
+PRODUCTS = 5
+INITIAL_STOCK = 40
+
+
+def seed(orders, receipts):
+    random.seed(11)
+    db.session.add(User(username='stress', password_hash='-', role='admin'))
+    db.session.add(Distributor(name='Stress Distributor'))
+    db.session.add_all([Product(name=f'Scarce {i}', sku=f'STRESS{i}', stock_quantity=INITIAL_STOCK,
+                                cost_price=10, selling_price=15, distributor_id=1) for i in range(PRODUCTS)])
+    db.session.commit()
+
+    for _ in range(orders):
+        order = Order(created_by=1, status='draft', order_type='sale',
+                      total_amount=0, total_profit=0, amount_paid=0)
+        db.session.add(order)
+        db.session.flush()
+        for product_id in random.sample(range(1, PRODUCTS + 1), random.randint(1, 3)):
+            db.session.add(OrderItem(order_id=order.id, product_id=product_id, quantity=random.randint(1, 4)))
+
+    for _ in range(receipts):
+        po = PurchaseOrder(distributor_id=1, created_by=1, status='pending', total_amount=0, amount_paid=0)
+        db.session.add(po)
+        db.session.flush()
+        product_id, quantity = random.randint(1, PRODUCTS), random.randint(1, 5)
+        db.session.add(PurchaseOrderItem(purchase_order_id=po.id, product_id=product_id, quantity=quantity,
+                                         unit_cost=10, total_cost=10 * quantity))
+        po.total_amount = 10 * quantity
+    db.session.commit()
+
+
+def run_workers(app, jobs, threads):
+    """Run (kind, id) jobs across threads; returns {'approved': n, 'rejected': n, 'received': n, 'busy': n}."""
+    lock = threading.Lock()
+    counts = {'approved': 0, 'rejected': 0, 'received': 0, 'busy': 0}
+    queue = list(jobs)
+
+    def worker():
+        with app.test_request_context():
+            while True:
+                with lock:
+                    if not queue:
+                        return
+                    kind, job_id = queue.pop()
+                # Each job gets a fresh session, so the logged-in user is re-attached per job
+                login_user(db.session.get(User, 1))
+                for _ in range(20):
+                    try:
+                        if kind == 'approve':
+                            order = db.session.get(Order, job_id)
+                            data = MultiDict({f'price_{item.id}': '15' for item in order.items})
+                            ok, _ = SalesController.approve_order(job_id, data, 1)
+                            outcome = 'approved' if ok else 'rejected'
+                        else:
+                            ok, message = PurchasesController.receive_purchase_order(job_id)
+                            if not ok:
+                                raise RuntimeError(message)
+                            outcome = 'received'
+                        break
+                    except OperationalError:
+                        # SQLite writer contention: the transaction rolled back, try again
+                        db.session.rollback()
+                        with lock:
+                            counts['busy'] += 1
+                        time.sleep(random.random() / 50)
+                else:
+                    raise RuntimeError(f"{kind} #{job_id} kept hitting a locked database")
+                db.session.remove()
+                with lock:
+                    counts[outcome] += 1
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return counts
+
+
+def verify():
+    problems = []
+    for product in Product.query.order_by(Product.id):
+        sold = db.session.query(func.coalesce(func.sum(OrderItem.quantity), 0))\
+            .join(Order, Order.id == OrderItem.order_id)\
+            .filter(Order.status == 'approved', OrderItem.product_id == product.id).scalar()
+        received = db.session.query(func.coalesce(func.sum(PurchaseOrderItem.quantity), 0))\
+            .join(PurchaseOrder, PurchaseOrder.id == PurchaseOrderItem.purchase_order_id)\
+            .filter(PurchaseOrder.status == 'received', PurchaseOrderItem.product_id == product.id).scalar()
+        logged = db.session.query(func.coalesce(func.sum(StockMovement.quantity_change), 0))\
+            .filter(StockMovement.product_id == product.id).scalar()
+        expected = INITIAL_STOCK + received - sold
+
+        print(f"{product.name}: stock={product.stock_quantity} expected={expected} "
+              f"sold={sold} received={received} logged={logged:+d}")
+        if product.stock_quantity < 0:
+            problems.append(f"{product.name} oversold to {product.stock_quantity}")
+        if product.stock_quantity != expected:
+            problems.append(f"{product.name} lost an update: {product.stock_quantity} != {expected}")
+        if logged != product.stock_quantity - INITIAL_STOCK:
+            problems.append(f"{product.name} movement log drifted: {logged:+d}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--orders', type=int, default=400)
+    parser.add_argument('--receipts', type=int, default=60)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'stress.db')
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = 'stress'
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'connect_args': {'timeout': 30}}
+    db.init_app(app)
+    login_manager.init_app(app)
+    login_manager.user_loader(lambda user_id: db.session.get(User, int(user_id)))
+
+    with app.app_context():
+        db.create_all()
+        seed(args.orders, args.receipts)
+        # Each draft twice in a row, so two threads race for it: only one approval may take its stock
+        units = [[('approve', i)] * 2 for i in range(1, args.orders + 1)] + \
+                [[('receive', i)] for i in range(1, args.receipts + 1)]
+        random.shuffle(units)
+        jobs = [job for unit in units for job in unit]
+
+    started = time.perf_counter()
+    counts = run_workers(app, jobs, args.threads)
+    elapsed = time.perf_counter() - started
+    print(f"{args.threads} threads, {elapsed:.1f}s: {counts}")
+
+    with app.app_context():
+        problems = verify()
+        approved = Order.query.filter_by(status='approved').count()
+        if counts['approved'] != approved:
+            problems.append(f"{counts['approved']} approvals succeeded for {approved} approved orders")
+    for problem in problems:
+        print('FAIL', problem)
+    if problems:
+        sys.exit(1)
+    print('No oversells and no lost updates.')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,11 @@
 from functools import wraps
-from flask import abort, current_app
+from flask import abort
 from flask_login import current_user
-import os
-import glob
+import hashlib
+from datetime import datetime, date, timedelta
 from werkzeug.utils import secure_filename
+from sqlalchemy import tuple_
+from models import PKT
 
 def role_required(role):
     def wrapper(f):
@@ -15,21 +17,101 @@ def role_required(role):
         return decorated
     return wrapper
 
-def get_product_image_url(product_name):
-    base_name = f"{secure_filename(product_name)}_img"
-    
+PRODUCT_IMAGE_DIR = 'product_images'  # under the static folder
+IMAGE_MAX_AGE = 365 * 24 * 3600  # product image URLs change whenever the content does
+
+
+def product_image_filename(product_name, content, ext):
+    """Content-hashed file name for a product image, so every new upload gets a new URL."""
+    digest = hashlib.sha256(content).hexdigest()[:12]
+    return f"{secure_filename(product_name)}_img.{digest}{ext.lower()}"
+
+
+def _pkt_date(value):
+    """Coerce a 'YYYY-MM-DD' string, date or datetime to a PKT calendar date."""
+    if isinstance(value, str):
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(PKT)
+        return value.date()
+    return value
+
+
+def period_bounds(year=None, month=None, day=None, start_date=None, end_date=None):
+    """Half-open [start, end) bounds for a reporting period.
+
+    Pass a year (optionally a month, and a day within that month) for a
+    calendar period, or start_date/end_date for an inclusive custom range of
+    days; a missing side of a custom range comes back as None. Timestamps are
+    stored as naive PKT wall-clock values, so the bounds are naive PKT
+    midnights and compare directly against the columns. Raises ValueError on
+    malformed dates.
+    """
+    if year is None:
+        start = _pkt_date(start_date) if start_date else None
+        end = _pkt_date(end_date) + timedelta(days=1) if end_date else None
+    elif day is not None:
+        start = date(year, month, day)
+        end = start + timedelta(days=1)
+    elif month is not None:
+        start = date(year, month, 1)
+        end = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    else:
+        start = date(year, 1, 1)
+        end = date(year + 1, 1, 1)
+
+    def midnight(d):
+        return datetime.combine(d, datetime.min.time()) if d is not None else None
+
+    return midnight(start), midnight(end)
+
+
+def filter_period(query, column, start, end):
+    """Restrict a query to start <= column < end, skipping a None bound."""
+    if start is not None:
+        query = query.filter(column >= start)
+    if end is not None:
+        query = query.filter(column < end)
+    return query
+
+
+PAGE_SIZE = 50
+
+
+def encode_cursor(key, row_id):
+    """Opaque page cursor for the row with sort key `key` and primary key `row_id`."""
+    return f"{key.isoformat()}_{row_id}"
+
+
+def decode_cursor(cursor):
+    """(key, id) from an encode_cursor string, or None when missing or malformed."""
+    if not cursor:
+        return None
+    key, _, row_id = cursor.rpartition('_')
     try:
-        static_folder = current_app.static_folder
-        images_dir = os.path.join(static_folder, 'product_images')
-        if not os.path.exists(images_dir):
-            return None
-        
-        pattern = os.path.join(images_dir, f"{base_name}.*")
-        matches = glob.glob(pattern)
-        if matches:
-            filename = os.path.basename(matches[0])
-            return f"product_images/{filename}"
-    except RuntimeError:
-        # Working outside of application context
-        pass
-    return None
+        return datetime.fromisoformat(key), int(row_id)
+    except ValueError:
+        return None
+
+
+def keyset_page(query, key_column, id_column, cursor=None, per_page=PAGE_SIZE):
+    """Newest-first page of `query` ordered by (key_column, id_column).
+
+    Rows after `cursor` are read with a row-value comparison, so each page
+    costs one index range scan however deep into the history it is.
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    position = decode_cursor(cursor)
+    if position is not None:
+        query = query.filter(tuple_(key_column, id_column) < tuple_(*position))
+
+    rows = query.order_by(key_column.desc(), id_column.desc()).limit(per_page + 1).all()
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last = rows[-1]
+        key = getattr(last, key_column.key)
+        if key is not None:
+            next_cursor = encode_cursor(key, getattr(last, id_column.key))
+    return rows, next_cursor
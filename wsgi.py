@@ -0,0 +1,24 @@
+"""Production entry point.
+
+    gunicorn -c gunicorn.conf.py wsgi:app          # Linux
+    python wsgi.py                                 # Windows / anywhere (waitress)
+
+Importing this module only builds the app; creating tables, applying
+migrations and seeding users happens once in the server process
+(gunicorn's on_starting hook, or below for waitress), not in every worker.
+Report workers run as threads next to waitress, or as their own process
+under gunicorn (see jobs.py).
+"""
+import os
+import jobs
+from app import create_app, initialize_database
+
+app = create_app()
+
+if __name__ == '__main__':
+    from waitress import serve
+
+    initialize_database(app)
+    jobs.start_workers(app)
+    serve(app, host=os.environ.get('HOST', '0.0.0.0'), port=int(os.environ.get('PORT', 8080)),
+          threads=int(os.environ.get('THREADS', 16)))